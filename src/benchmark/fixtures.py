@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import os
+import click
+import random
+import logging
+from datetime import date, timedelta
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, ZIP_DEFLATED
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+NS = "http://docs.oasis-open.org/legaldocml/ns/akn/3.0/CSD13"
+
+ENGLISH = (
+    "the minister bill state land question house deputy government department "
+    "country people money farmer year matter policy report committee "
+    "amendment section council housing education health scheme tax trade "
+    "member chair industry worker price rate school hospital road county "
+    "board act motion support increase reduce provide consider agree propose "
+    "ask know think important necessary serious present public local national "
+    "irish economic Dáil Tánaiste Taoiseach Seanad Éireann Fianna Fáil Fine "
+    "Gael"
+).split()
+FUNCTION = (
+    "the of and to in that it is was for on be this not are have we by with as"
+).split()
+IRISH = (
+    "tá an rud sin ar fad go maith agus níl sé ceart ach tá sé tábhachtach "
+    "mar gheall ar an gcáin agus an tír seo Ceann Comhairle Aire Teachta ní "
+    "féidir linn é sin a dhéanamh anois an bhfuil an tAire sásta leis dúirt "
+    "sé go raibh na daoine ag fanacht le fada an lá"
+).split()
+# C1 control characters of the kind clean_xml repairs
+NOISE = ["\x93", "\x94", "\x92", "\xad", "-\xad", "\x97"]
+
+
+def english_sentence(rng):
+    words = [rng.choice(ENGLISH) if rng.random() < 0.55
+             else rng.choice(FUNCTION)
+             for _ in range(rng.randint(6, 28))]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + rng.choice([".", ".", ".", "?"])
+
+
+def irish_sentence(rng):
+    words = [rng.choice(IRISH) for _ in range(rng.randint(5, 18))]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + "."
+
+
+def paragraph(rng, irish, noise):
+    sentences = [irish_sentence(rng) if rng.random() < irish
+                 else english_sentence(rng)
+                 for _ in range(rng.randint(1, 6))]
+    text = " ".join(sentences)
+    if rng.random() < noise:
+        i = rng.randrange(len(text))
+        text = text[:i] + rng.choice(NOISE) + text[i:]
+    return text
+
+
+def sitting(rng, day, persons, paragraphs, irish, noise):
+    '''One debateRecord with its speech paragraphs spread over sections and
+    speakers the way the Oireachtas export lays them out.
+    '''
+    refs = "".join('<TLCPerson eId="{0}" href="/ie/oireachtas/member/id/{0}"'
+                   ' showAs="{0}"/>'.format(p)
+                   for p in persons)
+    body, n, section = [], 0, 0
+    while n < paragraphs:
+        section += 1
+        body.append('<debateSection eId="dbsect_{0}" name="debate">'
+                    '<heading>Section {0}</heading>'.format(section))
+        for s in range(rng.randint(2, 8)):
+            if n >= paragraphs:
+                break
+            who = rng.choice(persons)
+            body.append('<speech by="#{}" eId="dbsect_{}_spk_{}">'
+                        '<from>{}</from>'.format(who, section, s, who))
+            for _ in range(min(rng.randint(1, 6), paragraphs - n)):
+                n += 1
+                body.append('<p eId="para_{}">{}</p>'.format(
+                    n, escape(paragraph(rng, irish, noise))))
+            body.append("</speech>")
+        body.append("</debateSection>")
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<akomaNtoso xmlns="{ns}"><debateRecord name="debateRecord"><meta>'
+        '<identification source="#bench"><FRBRWork>'
+        '<FRBRthis value="/akn/ie/debateRecord/dail/{d}/debate/main"/>'
+        '<FRBRdate date="{d}" name=""/></FRBRWork>'
+        '<FRBRExpression><FRBRdate date="{d}" name="#published"/>'
+        '</FRBRExpression></identification>'
+        '<references source="#bench">{refs}</references></meta>'
+        '<preface><p>Dáil Éireann debate - {d}</p></preface>'
+        '<debateBody>{body}</debateBody></debateRecord></akomaNtoso>'
+    ).format(ns=NS, d=day.isoformat(), refs=refs, body="".join(body))
+
+
+def make_archive(path, sittings=50, paragraphs=200, irish=0.05, noise=0.02,
+                 start_year=1980, years=2, seed=0):
+    '''Write a zip of synthetic sittings named like the AKN export, spread
+    evenly over `years` years. `irish` is the share of sentences in Irish
+    and `noise` the share of paragraphs with a stray C1 character. Returns
+    the number of paragraphs written.
+    '''
+    rng = random.Random(seed)
+    persons = ["Deputy{}".format(i) for i in range(60)]
+    step = max(1, (365 * years) // max(sittings, 1))
+    day = date(start_year, 1, 10)
+    with ZipFile(path, "w", ZIP_DEFLATED) as z:
+        for _ in range(sittings):
+            xml = sitting(rng, day, rng.sample(persons, 20), paragraphs,
+                          irish, noise)
+            z.writestr("dail/AK-dail-{}.xml".format(day.isoformat()),
+                       xml.encode("utf-8"))
+            day += timedelta(days=step)
+    logging.info("Wrote {} sittings of {} paragraphs to {}".format(
+        sittings, paragraphs, path))
+    return sittings * paragraphs
+
+
+@click.command()
+@click.argument('output_filepath',
+                default=os.path.join(project_dir,
+                                     "data/external/AKN_bench.zip"),
+                type=click.Path())
+@click.option('--sittings', default=50)
+@click.option('--paragraphs', default=200, help="Paragraphs per sitting.")
+@click.option('--irish', default=0.05, help="Share of sentences in Irish.")
+@click.option('--start-year', default=1980)
+@click.option('--years', default=2)
+@click.option('--seed', default=0)
+def main(output_filepath, sittings, paragraphs, irish, start_year, years,
+         seed):
+    '''Generate a synthetic Akoma Ntoso debateRecord zip.
+    '''
+    make_archive(output_filepath, sittings, paragraphs, irish,
+                 start_year=start_year, years=years, seed=seed)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import click
+import shutil
+import logging
+import platform
+import resource
+import tempfile
+import importlib.util
+import multiprocessing
+from zipfile import ZipFile
+from src.benchmark.fixtures import make_archive
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+STAGES = ["clean_xml", "language", "tagging", "extract_lines", "training"]
+# The stage whose output each stage reads
+INPUTS = {"language": "clean_xml", "tagging": "language",
+          "extract_lines": "tagging", "training": "tagging"}
+# Optional packages each stage needs, checked before it is started
+REQUIRES = {"language": ["lxml"], "tagging": ["spacy", "en_core_web_sm"],
+            "extract_lines": ["gensim"], "training": ["gensim"]}
+
+
+def corpus_totals(path):
+    '''Lines and whitespace tokens (less the URI) in a sharded corpus.
+    '''
+    from src.data.corpus import Corpus
+    corpus = Corpus(path)
+    lines = tokens = 0
+    for year in corpus.years():
+        for line in corpus.lines(year):
+            lines += 1
+            tokens += line.count(" ")
+    return lines, tokens
+
+
+def run_clean_xml(source, output, workers, years):
+    from src.data.clean_xml import clean_archive
+    path = os.path.join(output, "AKN_dail.zip")
+    clean_archive(source, path, workers)
+    with ZipFile(source) as z:
+        return path, {"paragraphs": None,
+                      "bytes": sum(i.file_size for i in z.infolist())}
+
+
+def missing(stage):
+    return [m for m in REQUIRES.get(stage, [])
+            if importlib.util.find_spec(m) is None]
+
+
+def run_language(source, output, workers, years):
+    from src.data.get_english_text import build
+    failed = build(source, output, years[0], years[-1], workers)
+    if failed:
+        raise RuntimeError("Extraction failed for {}".format(
+            ", ".join(str(y) for y in sorted(failed))))
+    paragraphs, tokens = corpus_totals(output)
+    return output, {"paragraphs": paragraphs, "tokens": tokens}
+
+
+def run_tagging(source, output, workers, years):
+    from src.features.build_features import main
+    main([str(years[0]), str(years[-1]), source, output,
+          "--workers", str(workers)], standalone_mode=False)
+    path = os.path.join(output, "spacy-para-lemma-tag_{}-{}".format(
+        years[0], years[-1]))
+    paragraphs, _ = corpus_totals(path)
+    _, tokens = corpus_totals(source)
+    return path, {"paragraphs": paragraphs, "tokens": tokens}
+
+
+def run_extract_lines(source, output, workers, years):
+    from src.model.train_word2vec_model import ExtractLines
+    paragraphs = tokens = 0
+    for words in ExtractLines(source, years[0], years[-1] + 1, "word2vec",
+                              readers=workers):
+        paragraphs += 1
+        tokens += len(words)
+    return None, {"paragraphs": paragraphs, "tokens": tokens}
+
+
+def run_training(source, output, workers, years):
+    from src.model.encoded_corpus import EncodedCorpus
+    from src.model.train_word2vec_model import train_window
+    encoded = EncodedCorpus.build(source, os.path.join(output, "encoded"))
+    train_window(encoded.root, output, "bench", years[0], years[-1] + 1,
+                 workers, ("word2vec",))
+    return None, {"paragraphs": encoded.meta["n_docs"],
+                  "tokens": encoded.meta["n_tokens"]}
+
+
+RUNNERS = {"clean_xml": run_clean_xml, "language": run_language,
+           "tagging": run_tagging, "extract_lines": run_extract_lines,
+           "training": run_training}
+
+
+def measure(stage, source, output, workers, years, queue):
+    '''Run one stage in a fresh process and report its wall time, counts
+    and the peak RSS of the process and the workers it waited on.
+    '''
+    logging.basicConfig(level=logging.WARNING)
+    result = {"stage": stage, "workers": workers}
+    try:
+        start = time.time()
+        path, counts = RUNNERS[stage](source, output, workers, years)
+        result["seconds"] = time.time() - start
+        result.update(counts)
+        result["path"] = path
+    except ImportError as e:
+        result["skipped"] = str(e)
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    result["peak_rss_mb"] = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+    queue.put(result)
+
+
+def run_stage(stage, source, output, workers, years):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    p = ctx.Process(target=measure,
+                    args=(stage, source, output, workers, years, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+    for unit in ["paragraphs", "tokens", "bytes"]:
+        if result.get(unit) and result.get("seconds"):
+            result[unit + "_per_sec"] = result[unit] / result["seconds"]
+    return result
+
+
+def machine():
+    return {"platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": multiprocessing.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+@click.command()
+@click.option('--sittings', default=40,
+              help="Sittings in the synthetic archive.")
+@click.option('--paragraphs', default=200, help="Paragraphs per sitting.")
+@click.option('--irish', default=0.05, help="Share of sentences in Irish.")
+@click.option('--workers', default="1,2,4",
+              help="Comma-separated worker counts to run each stage with.")
+@click.option('--stages', default=",".join(STAGES),
+              help="Comma-separated stages to run.")
+@click.option('--start-year', default=1980)
+@click.option('--years', 'n_years', default=2,
+              help="Years the synthetic sittings are spread over.")
+@click.option('--tagged', type=click.Path(exists=True),
+              help="Existing tagged corpus for extract_lines and training "
+                   "if tagging does not run.")
+@click.option('--workdir', type=click.Path(),
+              help="Keep fixtures and outputs here instead of a temporary "
+                   "directory.")
+@click.option('--output', type=click.Path(), help="Write the results as JSON.")
+def main(sittings, paragraphs, irish, workers, stages, start_year, n_years,
+         tagged, workdir, output):
+    '''Time each pipeline stage on a synthetic AKN archive at several worker
+    counts. Each stage reads the output of its upstream stage's run with the
+    most workers; stages whose dependencies are not installed are skipped.
+    '''
+    workers = sorted(int(w) for w in workers.split(","))
+    stages = [s for s in STAGES if s in stages.split(",")]
+    root = workdir or tempfile.mkdtemp(prefix="bench-")
+    os.makedirs(root, exist_ok=True)
+    years = list(range(start_year, start_year + n_years))
+    source = os.path.join(root, "AKN_dail_copy.zip")
+    make_archive(source, sittings, paragraphs, irish, start_year=start_year,
+                 years=n_years)
+    outputs = {None: source}
+
+    results = []
+    try:
+        for stage in stages:
+            upstream = INPUTS.get(stage)
+            if upstream == "tagging" and outputs.get(upstream) is None:
+                outputs[upstream] = tagged
+            if outputs.get(upstream) is None:
+                reason = "no output from {}".format(upstream)
+                results.append({"stage": stage, "skipped": reason})
+                click.echo("{:<14} skipped: {}".format(stage, reason))
+                continue
+            if missing(stage):
+                reason = "{} not installed".format(", ".join(missing(stage)))
+                results.append({"stage": stage, "skipped": reason})
+                click.echo("{:<14} skipped: {}".format(stage, reason))
+                continue
+            for w in workers:
+                out = os.path.join(root, "{}-{}".format(stage, w))
+                shutil.rmtree(out, ignore_errors=True)
+                os.makedirs(out)
+                r = run_stage(stage, outputs[upstream], out, w, years)
+                results.append(r)
+                if "seconds" in r:
+                    outputs[stage] = r.pop("path")
+                    rates = ["{:,.0f} {}/s".format(r[k + "_per_sec"], k)
+                             for k in ["paragraphs", "tokens", "bytes"]
+                             if k + "_per_sec" in r]
+                    click.echo("{stage:<14} workers={workers:<3} "
+                               "{seconds:>8.2f}s  "
+                               "peak RSS {peak_rss_mb:>7.0f} MB  ".format(**r)
+                               + "  ".join(rates))
+                else:
+                    click.echo("{:<14} workers={:<3} {}".format(
+                        stage, w, r.get("skipped") or r.get("error")))
+                    break
+    finally:
+        if not workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump({"machine": machine(),
+                       "fixture": {"sittings": sittings,
+                                   "paragraphs": paragraphs, "irish": irish,
+                                   "years": years, "tagged": tagged},
+                       "results": results}, f, indent=2)
+    if any("error" in r for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import click
+import logging
+from itertools import islice
+from src.data.corpus import Corpus
+from src.features.build_features import TextPipeline
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+
+def bench(pipe, texts):
+    '''Time spaCy and the lemma/POS formatting separately for one pipeline.
+    '''
+    start = time.time()
+    docs = list(pipe.nlp.pipe(texts, as_tuples=True,
+                              batch_size=pipe.batch_size,
+                              n_process=pipe.workers))
+    tagged = time.time() - start
+    n_tokens = sum(len(doc) for doc, _ in docs)
+
+    start = time.time()
+    for doc, uri in docs:
+        if pipe.format == "sent":
+            for _ in pipe.iter_sentences(doc, uri):
+                pass
+        else:
+            pipe.iter_paragraphs(doc, uri)
+    formatted = time.time() - start
+    return {
+        "token_type": pipe.format,
+        "components": pipe.nlp.pipe_names,
+        "cache": pipe.tokens.maxsize,
+        "paragraphs": len(docs),
+        "tokens": n_tokens,
+        "spacy_tokens_per_sec": n_tokens / tagged,
+        "format_tokens_per_sec": n_tokens / formatted,
+        "total_tokens_per_sec": n_tokens / (tagged + formatted),
+        "cache_hit_rate": pipe.tokens.hits / (
+            (pipe.tokens.hits + pipe.tokens.misses) or 1),
+    }
+
+
+@click.command()
+@click.argument('year', default=1980)
+@click.argument('input_filepath',
+                default=os.path.join(project_dir, "data/interim/english"),
+                type=click.Path(exists=True, file_okay=False))
+@click.option('--paragraphs', default=2000,
+              help="Number of paragraphs to tag.")
+@click.option('--model', default="en_core_web_sm")
+@click.option('--workers', default=1)
+@click.option('--output', type=click.Path(), help="Write the results as JSON.")
+def main(year, input_filepath, paragraphs, model, workers, output):
+    '''Tokens/sec for TextPipeline in para and sent mode, with and without
+    the token cache, on one year of the English corpus written by
+    get_english_text.py.
+    '''
+    if year not in Corpus(input_filepath).index:
+        raise click.BadParameter(
+            "No shard for {} in {}".format(year, input_filepath),
+            param_hint="input_filepath")
+    results = []
+    texts = None
+    for token_type in ["para", "sent"]:
+        for cache_size in [200000, 0]:
+            pipe = TextPipeline(input_filepath, year, year,
+                                token_type=token_type, model=model,
+                                workers=workers, cache_size=cache_size)
+            if texts is None:
+                texts = list(islice(pipe.extract_paragraphs(year),
+                                    paragraphs))
+            r = bench(pipe, texts)
+            results.append(r)
+            click.echo("{token_type:>4} cache={cache:<6} "
+                       "spaCy {spacy_tokens_per_sec:>9,.0f} tok/s  "
+                       "format {format_tokens_per_sec:>11,.0f} tok/s  "
+                       "total {total_tokens_per_sec:>9,.0f} tok/s  "
+                       "hit rate {cache_hit_rate:.1%}".format(**r))
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
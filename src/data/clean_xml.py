@@ -1,30 +1,104 @@
 # -*- coding: utf-8 -*-
 import os
+import re
 import click
 import logging
-from zipfile import ZipFile
-
-
-dblquotes = re.compile("\x93|\x94")
-sglquotes = re.compile("\x91|\x92")
-space = re.compile("\x97|\x95")
-oe = re.compile("\x9c")
-dash = re.compile("-\xad|\xad|\xad-")
-nochar = re.compile("\x9d|\x85|\x96")
-
-akn = "../../data/external/AKN_dail_copy.zip"
-z = ZipFile(akn)
-
-testxml = "dail/AK-dail-1922-01-06.xml"
-for fn in z.filelist:
-    if fn.filename.startswith("dail/AK-dail"):
-        with z.open(fn) as x:
-            xml = x.read().decode("utf-8", "strict")
-        xml = dblquotes.sub('"', xml)
-        xml = sglquotes.sub("'", xml)
-        xml = space.sub(" ", xml)
-        xml = xml.replace("\x9c", "oe").replace("\x8a", "Š").replace("\x9a", "Š".lower())
-        xml = dash.sub("-", xml)
-        xml = nochar.sub("", xml)
-        with open("../../data/external/"+fn.filename, "wb") as f:
-            f.write(xml.encode("utf-8"))
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile, ZIP_DEFLATED
+from src.metrics import Metrics
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+# Windows-1252 characters that survived as C1 control codes in the AKN export,
+# mapped to their plain replacements. The soft hyphen is handled separately
+# because it absorbs a preceding hyphen.
+REPLACEMENTS = {
+    "\x93": '"', "\x94": '"',
+    "\x91": "'", "\x92": "'",
+    "\x97": " ", "\x95": " ",
+    "\x9c": "oe",
+    "\x8a": "Š", "\x9a": "š",
+    "\x9d": "", "\x85": "", "\x96": "",
+    "-\xad": "-", "\xad": "-",
+}
+CLEAN = re.compile("-?\xad|[{}]".format(
+    "".join(k for k in REPLACEMENTS if len(k) == 1 and k != "\xad")))
+
+_zip = None
+
+
+def clean(xml):
+    '''Replace every stray C1 character in a single pass over the document.
+    '''
+    return CLEAN.sub(lambda m: REPLACEMENTS[m.group(0)], xml)
+
+
+def _open_archive(input_filepath):
+    global _zip
+    _zip = ZipFile(input_filepath)
+
+
+def clean_member(name):
+    with _zip.open(name) as x:
+        xml = x.read().decode("utf-8", "strict")
+    return name, clean(xml).encode("utf-8")
+
+
+def clean_archive(input_filepath, output_filepath, workers, prefix="dail/AK-dail", metrics=None):
+    '''Clean each sitting in the input zip in a process pool and stream the
+    results into a new zip, in input order. At most a few sittings per worker
+    are in flight at any time so memory use does not grow with the archive.
+    '''
+    metrics = metrics or Metrics("clean_xml")
+    with ZipFile(input_filepath) as z:
+        members = [fn.filename for fn in z.filelist if fn.filename.startswith(prefix)]
+        metrics.bytes_read("clean", sum(fn.file_size for fn in z.filelist if fn.filename.startswith(prefix)))
+    logging.info("Cleaning {} sittings from {} with {} workers".format(
+        len(members), input_filepath, workers))
+    window = workers * 2
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_archive,
+                             initargs=(input_filepath,)) as executor, \
+            ZipFile(output_filepath, "w", ZIP_DEFLATED) as out:
+        def write():
+            with metrics.stage("clean"):
+                name, data = pending.popleft().result()
+            with metrics.stage("write"):
+                out.writestr(name, data)
+            metrics.count("sittings")
+            metrics.bytes_written("write", len(data))
+
+        for i, name in enumerate(members, 1):
+            pending.append(executor.submit(clean_member, name))
+            metrics.gauge("pending", len(pending))
+            if len(pending) >= window:
+                write()
+            if i % 200 == 0:
+                logging.info("Cleaned {} of {} sittings".format(i, len(members)))
+        while pending:
+            write()
+    logging.info("Wrote {} sittings to {}".format(len(members), output_filepath))
+    return len(members)
+
+
+@click.command()
+@click.argument('input_filepath', default=os.path.join(project_dir, "data/external/AKN_dail_copy.zip"), type=click.Path(exists=True))
+@click.argument('output_filepath', default=os.path.join(project_dir, "data/external/AKN_dail.zip"), type=click.Path())
+@click.option('--workers', default=multiprocessing.cpu_count(), help="Number of cleaning processes.")
+@click.option('--metrics', 'metrics_path', type=click.Path(), help="Append progress and a run summary here as JSON lines.")
+def main(input_filepath, output_filepath, workers, metrics_path):
+    logger = logging.getLogger(__name__)
+    logger.info('cleaning Akoma Ntoso archive')
+    metrics = Metrics("clean_xml", metrics_path)
+    clean_archive(input_filepath, output_filepath, workers, metrics=metrics)
+    metrics.close()
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
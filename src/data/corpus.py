@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import gzip
+import click
+import hashlib
+import logging
+import tarfile
+from collections import deque
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor
+from src.data.manifest import line_date
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+
+class Corpus:
+    '''A directory of per-year shards of "date/eId: text" lines, the format
+    passed between pipeline stages.
+
+    Each shard, <year>.txt.gz, is a series of independent gzip members, one
+    per sitting date, so it can still be read end to end with gzip or zcat.
+    A sidecar, <year>.idx.json, records each date's byte offset, compressed
+    length, line count and SHA-1, so readers can seek straight to the
+    sittings they need. Years are written independently, so several
+    processes can write one corpus at once.
+    '''
+    def __init__(self, root):
+        self.root = root
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self.index = {}
+        for fn in os.listdir(root):
+            m = re.match(r"(\d{4})\.idx\.json$", fn)
+            if m:
+                with open(os.path.join(root, fn)) as f:
+                    self.index[int(m.group(1))] = json.load(f)
+
+    def years(self):
+        return sorted(self.index)
+
+    def dates(self, year):
+        return [e[0] for e in self.index.get(year, [])]
+
+    def digests(self, year):
+        return {e[0]: e[4] for e in self.index.get(year, [])}
+
+    def n_lines(self, year):
+        return sum(e[3] for e in self.index.get(year, []))
+
+    def shard_path(self, year):
+        return os.path.join(self.root, "{}.txt.gz".format(year))
+
+    def entries(self, year, dates=None):
+        return [e for e in self.index.get(year, []) if dates is None or e[0] in dates]
+
+    def read_member(self, year, entry):
+        with open(self.shard_path(year), "rb") as f:
+            f.seek(entry[1])
+            return gzip.decompress(f.read(entry[2])).decode("utf-8")
+
+    def lines(self, year, dates=None):
+        '''Lines for a year, optionally only for the given sitting dates.
+        '''
+        for entry in self.entries(year, dates):
+            for line in self.read_member(year, entry).splitlines(True):
+                yield line
+
+    def select(self, start_date, end_date):
+        '''(year, entry) pairs for sittings with start_date <= date <= end_date.
+        '''
+        for year in range(int(start_date[:4]), int(end_date[:4]) + 1):
+            for entry in self.index.get(year, []):
+                if start_date <= entry[0] <= end_date:
+                    yield year, entry
+
+    def iter_lines(self, members, workers=4):
+        '''Lines from an iterable of (year, entry) pairs, in order, with up to
+        `workers` members decompressed ahead on background threads.
+        '''
+        window = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for year, entry in members:
+                window.append(executor.submit(self.read_member, year, entry))
+                if len(window) > workers:
+                    for line in window.popleft().result().splitlines(True):
+                        yield line
+            while window:
+                for line in window.popleft().result().splitlines(True):
+                    yield line
+
+    def iter_years(self, years, workers=4):
+        return self.iter_lines(((y, e) for y in years for e in self.index.get(y, [])), workers)
+
+    def write_year(self, year, lines):
+        '''Replace a year's shard with date-ordered lines.
+        '''
+        self._write(year, (("new", date, "".join(group)) for date, group in groupby(lines, key=line_date)))
+
+    def splice_year(self, year, lines, replaced_dates):
+        '''Rewrite a year's shard with the members for replaced_dates dropped
+        and the date-ordered lines merged in their place. Members for other
+        dates are copied across without recompressing them.
+        '''
+        new = groupby(lines, key=line_date)
+        kept = [e for e in self.entries(year) if e[0] not in replaced_dates]
+
+        def members():
+            pending = next(new, None)
+            for entry in kept:
+                while pending is not None and pending[0] < entry[0]:
+                    yield "new", pending[0], "".join(pending[1])
+                    pending = next(new, None)
+                yield "old", entry[0], entry
+            while pending is not None:
+                yield "new", pending[0], "".join(pending[1])
+                pending = next(new, None)
+        self._write(year, members())
+
+    def _write(self, year, members):
+        path = self.shard_path(year)
+        tmp = path + ".tmp"
+        index = []
+        old = open(path, "rb") if os.path.exists(path) else None
+        try:
+            with open(tmp, "wb") as f:
+                for kind, date, content in members:
+                    if index and date <= index[-1][0]:
+                        raise ValueError("Lines for {} are not in date order at {}".format(year, date))
+                    if kind == "old":
+                        old.seek(content[1])
+                        member = old.read(content[2])
+                        index.append([date, f.tell(), len(member), content[3], content[4]])
+                    else:
+                        data = content.encode("utf-8")
+                        member = gzip.compress(data, mtime=0)
+                        index.append([date, f.tell(), len(member), data.count(b"\n"),
+                                      hashlib.sha1(data).hexdigest()])
+                    f.write(member)
+        except Exception:
+            os.remove(tmp)
+            raise
+        finally:
+            if old is not None:
+                old.close()
+        os.replace(tmp, path)
+        with open(os.path.join(self.root, "{}.idx.json".format(year)), "w") as f:
+            json.dump(index, f)
+        self.index[year] = index
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_dirpath', type=click.Path())
+def main(input_filepath, output_dirpath):
+    '''Convert a tar.gz of per-year text files into a sharded corpus.
+    '''
+    corpus = Corpus(output_dirpath)
+    with tarfile.open(input_filepath, encoding="utf-8") as tf:
+        for fn in tf:
+            m = re.search(r"_(\d{4})\.txt$", fn.name)
+            if fn.isfile() and m:
+                lines = (line.decode("utf-8") for line in tf.extractfile(fn))
+                corpus.write_year(int(m.group(1)), lines)
+                logging.info("Wrote {} lines for {}".format(corpus.n_lines(int(m.group(1))), m.group(1)))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -2,100 +2,362 @@
 import os
 import click
 import logging
-import spacy
-import re
-from zipfile import ZipFile
-from lxml import etree
-from dotenv import find_dotenv, load_dotenv
+import sys
+import time
+import multiprocessing
 from datetime import datetime
-from collections import defaultdict
-from polyglot.text import Text as Poly
-from nltk.corpus import stopwords
-from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict, Counter, namedtuple
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.data.sitting_index import SittingIndex, open_member
+from src.data.manifest import Manifest
+from src.data.corpus import Corpus
+from src.features.language import TieredDetector, TIERS
+from src.features.stats import ParagraphStats, write_year_stats
+from src.features.paragraphs import export
+from src.metrics import Metrics
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
 
 NS = {"akn": "http://docs.oasis-open.org/legaldocml/ns/akn/3.0/CSD13"}
+BATCH = 256
+
+Paragraph = namedtuple("Paragraph", ["uri", "date", "speaker", "section", "heading", "text"])
 
 
 class LanguagePipeline:
     def __init__(
-            self, input_filepath, year
-            ):
+            self, input_filepath, year, sittings=None, detector="tiered",
+            metrics=None):
 
         self.input_filepath = input_filepath
         self.year = year
-        self.z = ZipFile(self.input_filepath)
-        self.sittings = [fn.filename for fn  in self.z.filelist if str(year) in fn.filename]
-
-        self.uris = []
+        if sittings is None:
+            sittings = SittingIndex.load_or_build(self.input_filepath).year(year)
+        self.sittings = sittings
+        self.detector = TieredDetector() if detector == "tiered" else None
+        self.stats = ParagraphStats()
+        self.metrics = metrics or Metrics("english")
 
     def __iter__(self):
-        for i, para in enumerate(self.extract_paragraphs()):
-            if len(para)> 0:
-                poly = " ".join(s.raw
-                     for s in Poly(para).sentences if s.language.code=="en")
-                logging.debug(poly)
-                yield self.uris[i] + ": " + poly + "\n"
+        paragraphs = self.metrics.timed("parse", (p for p in self.extract_paragraphs() if len(p.text) > 0))
+        while True:
+            batch = list(islice(paragraphs, BATCH))
+            if not batch:
+                break
+            with self.metrics.stage("detect"):
+                languages = self.languages([p.text for p in batch])
+            self.metrics.count("paragraphs", len(batch))
+            for p, sentences in zip(batch, languages):
+                self.stats.add(p, sentences)
+                english = " ".join(s for s, lang in sentences if lang == "en")
+                yield p.uri + ": " + english + "\n"
+
+    def languages(self, paragraphs):
+        '''(sentence, language) pairs for each paragraph, from the tiered
+        detector or from Polyglot alone.
+        '''
+        if self.detector is None:
+            from polyglot.text import Text as Poly
+            return [[(s.raw, s.language.code) for s in Poly(p).sentences] for p in paragraphs]
+        return self.detector.languages(paragraphs)
 
     def extract_paragraphs(self):
-        '''Input is zipped Akoma Ntoso XML of type debateRecord.
+        '''Input is zipped Akoma Ntoso XML of type debateRecord. Yields a
+        Paragraph for each speech paragraph.
         '''
         cumulative_para_count = 0
-        self.uris = []
         logging.info("Year: {}, No. sittings: {}".format(self.year, len(self.sittings)))
         i = 0
-        for i, sitting in enumerate(self.sittings):
-            logging.debug(sitting)
-            root = etree.fromstring(self.z.open(sitting).read())
-            date = root.find(".//{*}FRBRWork/{*}FRBRdate").attrib['date']
-            paragraphs = root.findall(".//{*}speech/{*}p")
-            l = len(paragraphs)
-            cumulative_para_count += l
-            for para in paragraphs:
-                uri = "{}/{}".format(date, para.attrib['eId'].replace("para_", ""))
-                self.uris.append(uri)
-                logging.debug("Date: {}, eId: {}".format(date, para.attrib['eId']))
-                text = " ".join(para.xpath(".//text()"))
-                yield text
+        for i, sitting in enumerate(self.sittings, 1):
+            logging.debug(sitting["name"])
+            self.metrics.count("sittings")
+            self.metrics.bytes_read("parse", sitting["compress_size"])
+            with open_member(self.input_filepath, sitting) as x:
+                for paragraph in iter_sitting(x):
+                    cumulative_para_count += 1
+                    yield paragraph
             if i % 20 == 0:
                 logging.info("Wrote {} paragraphs from {} sittings in {}".format(cumulative_para_count, i, self.year))
-        logging.info(logging.info("Finished with {}: Wrote {} paragraphs from {} sittings".format(self.year, cumulative_para_count, i)))
+        logging.info("Finished with {}: Wrote {} paragraphs from {} sittings".format(self.year, cumulative_para_count, i))
+
+
+def iter_sitting(fileobj):
+    '''Stream the speech paragraphs of one debateRecord with iterparse,
+    clearing each speech once its paragraphs have been yielded so memory
+    does not grow with the length of the sitting. A speech's by="#..."
+    reference is resolved to the href of the matching TLCPerson, and each
+    paragraph carries the eId and heading of its innermost debateSection.
+    '''
+    from lxml import etree
+    date = None
+    persons, headings = {}, {}
+    for _, el in etree.iterparse(fileobj, tag=("{*}FRBRdate", "{*}TLCPerson", "{*}heading", "{*}p", "{*}speech")):
+        tag = etree.QName(el).localname
+        parent = el.getparent()
+        if tag == "FRBRdate":
+            if date is None and etree.QName(parent).localname == "FRBRWork":
+                date = el.attrib['date']
+        elif tag == "TLCPerson":
+            persons[el.get("eId", el.get("id"))] = el.get("href")
+        elif tag == "heading":
+            # Headings are cleared with the speeches that follow them, so
+            # keep the text by section
+            if etree.QName(parent).localname == "debateSection":
+                headings[parent.get("eId")] = " ".join(" ".join(el.itertext()).split())
+        elif tag == "p":
+            if etree.QName(parent).localname == "speech":
+                logging.debug("Date: {}, eId: {}".format(date, el.attrib['eId']))
+                uri = "{}/{}".format(date, el.attrib['eId'].replace("para_", ""))
+                by = parent.get("by", "").lstrip("#")
+                section = parent.getparent()
+                while section is not None and etree.QName(section).localname != "debateSection":
+                    section = section.getparent()
+                section = section.get("eId", "") if section is not None else ""
+                # One line per paragraph: newlines inside a <p> would start
+                # a line without its uri
+                yield Paragraph(uri, date, persons.get(by) or by, section, headings.get(section, ""),
+                                " ".join(" ".join(el.itertext()).split()))
+        else:
+            el.clear()
+            while el.getprevious() is not None:
+                del parent[0]
+
 
-def pipeline(input_filepath, output_dirpath, year):
-    logging.info("Writing file for {}".format(year))
-    pipe = LanguagePipeline(input_filepath, year)
-    with open(os.path.join(output_dirpath, "english_{}.txt".format(year)), "w") as f:
+def pipeline(input_filepath, output_dirpath, year, part, sittings, detector, profile=None):
+    start = time.time()
+    metrics = Metrics("english", profile=profile and "{}.{}-{:03d}".format(profile, year, part))
+    pipe = LanguagePipeline(input_filepath, year, sittings, detector, metrics)
+    n = 0
+    path = part_path(output_dirpath, year, part)
+    with open(path, "w") as f:
         for line in pipe:
-            f.write(line)
-    logging.info("Closed file for {}".format(year))
+            with metrics.stage("write"):
+                f.write(line)
+            n += 1
+    with metrics.stage("write"):
+        pipe.stats.save(path + ".stats.npz")
+    metrics.bytes_written("write", os.path.getsize(path))
+    metrics.save_profile()
+    tiers = (pipe.detector.counts, pipe.detector.times) if pipe.detector else (Counter(), {})
+    return n, time.time() - start, tiers, metrics.snapshot()
+
+
+def extract_part(input_filepath, year, part, sittings, detector):
+    '''Like pipeline(), but return the English lines and paragraph
+    statistics to the caller instead of writing a part file.
+    '''
+    metrics = Metrics("english")
+    pipe = LanguagePipeline(input_filepath, year, sittings, detector, metrics)
+    lines = list(pipe)
+    tiers = (pipe.detector.counts, pipe.detector.times) if pipe.detector else (Counter(), {})
+    return lines, pipe.stats.columns(), tiers, metrics.snapshot()
+
+
+def part_path(output_dirpath, year, part):
+    return os.path.join(output_dirpath, "english_{}.part{:03d}".format(year, part))
+
+
+def sitting_digest(sitting):
+    return [sitting["date"], "{:08x}-{}".format(sitting["crc"], sitting["size"])]
+
+
+def plan_tasks(selected, chunk_bytes):
+    '''Split each year's selected sittings into runs of consecutive sittings
+    of roughly chunk_bytes of XML, largest first so the slowest tasks start
+    early.
+    '''
+    tasks = []
+    for year, sittings in selected.items():
+        chunk, size, part = [], 0, 0
+        for sitting in sittings:
+            chunk.append(sitting)
+            size += sitting["size"]
+            if size >= chunk_bytes:
+                tasks.append((size, year, part, chunk))
+                chunk, size, part = [], 0, part + 1
+        if chunk:
+            tasks.append((size, year, part, chunk))
+    tasks.sort(key=lambda t: t[0], reverse=True)
+    return tasks
+
+
+def read_parts(paths):
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                yield line
+
+
+def assemble_year(corpus, output_dirpath, year, parts, replaced=None):
+    '''Write a year's part files into its corpus shard or, if only some
+    sittings were reprocessed, splice them over the members for those dates.
+    Their paragraph statistics are merged into <year>.stats.npz the same way.
+    '''
+    paths = [part_path(output_dirpath, year, part) for part in range(parts)]
+    if replaced is None:
+        corpus.write_year(year, read_parts(paths))
+    else:
+        corpus.splice_year(year, read_parts(paths), replaced)
+    write_year_stats(output_dirpath, year, [p + ".stats.npz" for p in paths], replaced)
+    for path in paths:
+        os.remove(path)
+        os.remove(path + ".stats.npz")
+
+
+def build(input_filepath, output_dirpath, start_year, end_year, workers, chunk_mb=32, detector="tiered",
+          metrics=None, profile=None, dry_run=False):
+    '''Extract the English text of new and changed sittings between two
+    years into the corpus in output_dirpath, in tasks of about chunk_mb of
+    XML on one process pool. Returns the years that failed, whose part
+    files are removed and whose shards are left as they were. A dry run
+    only lists the work and writes nothing.
+    '''
+    if not dry_run and not os.path.exists(output_dirpath):
+        os.makedirs(output_dirpath)
+    metrics = metrics or Metrics("english")
+    with metrics.stage("index"):
+        index = SittingIndex.load_or_build(input_filepath, save=not dry_run)
+    # Corpus() creates its directory, which a dry run must not do
+    corpus = Corpus(output_dirpath) if not dry_run or os.path.exists(output_dirpath) else None
+    indexed = corpus.index if corpus is not None else {}
+    manifest = Manifest(os.path.join(output_dirpath, "manifest.json"),
+                        {"stage": "english", "detector": detector})
+
+    selected, replaced, digests = {}, {}, {}
+    for year in range(start_year, end_year+1):
+        sittings = index.year(year)
+        digests[year] = {s["name"]: sitting_digest(s) for s in sittings}
+        if year not in indexed or str(year) not in manifest.years:
+            if sittings:
+                selected[year], replaced[year] = sittings, None
+            continue
+        dirty, removed = manifest.diff(year, digests[year])
+        if dirty or removed:
+            old = manifest.years[str(year)]
+            replaced[year] = set([digests[year][k][0] for k in dirty] + [old[k][0] for k in removed])
+            # Shards are spliced by date, so every sitting on a replaced
+            # date is extracted again, not just the changed ones
+            selected[year] = [s for s in sittings if s["date"] in replaced[year]]
+            logging.info("{}: {} new or changed sittings, {} removed".format(year, len(dirty), len(removed)))
+    logging.info("{} of {} years need rebuilding".format(len(selected), end_year - start_year + 1))
+
+    failed = set()
+
+    def finish_year(year):
+        # A year that fails to assemble is reported with the failed tasks;
+        # its part files are removed at the end
+        try:
+            with metrics.stage("assemble"):
+                assemble_year(corpus, output_dirpath, year, parts[year], replaced[year])
+        except Exception:
+            logging.exception("{} failed to assemble".format(year))
+            failed.add(year)
+            return
+        if os.path.exists(corpus.shard_path(year)):
+            metrics.bytes_written("assemble", os.path.getsize(corpus.shard_path(year)))
+        manifest.update_year(year, digests[year])
+        manifest.save()
+        logging.info("Closed file for {}".format(year))
+
+    tasks = plan_tasks(selected, chunk_mb * 1024 * 1024)
+    remaining = defaultdict(int)
+    for _, year, _, _ in tasks:
+        remaining[year] += 1
+    parts = dict(remaining)
+    if dry_run:
+        for year in sorted(selected):
+            click.echo("{}: {} sittings in {} tasks{}".format(
+                year, len(selected[year]), parts.get(year, 0),
+                "" if replaced[year] is None else ", replacing {} dates".format(len(replaced[year]))))
+        return set()
+    for year in selected:
+        if year not in parts:
+            parts[year] = 0
+            finish_year(year)
+    logging.info("Scheduling {} tasks for {} years on {} workers".format(len(tasks), len(remaining), workers))
+
+    tier_counts, tier_times = Counter(), defaultdict(float)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(pipeline, input_filepath, output_dirpath, year, part, chunk, detector, profile): (year, part, len(chunk))
+                   for _, year, part, chunk in tasks}
+        metrics.pool("tasks", futures)
+        for done, future in enumerate(as_completed(futures), 1):
+            year, part, n_sittings = futures[future]
+            remaining[year] -= 1
+            metrics.pool("tasks", futures)
+            try:
+                n, secs, (counts, times), snapshot = future.result()
+                metrics.merge(snapshot)
+                tier_counts.update(counts)
+                for tier, t in times.items():
+                    tier_times[tier] += t
+                logging.info("[{}/{}] {} part {}: {} paragraphs from {} sittings in {:.1f}s".format(
+                    done, len(futures), year, part, n, n_sittings, secs))
+            except Exception:
+                logging.exception("[{}/{}] {} part {} failed".format(done, len(futures), year, part))
+                failed.add(year)
+            if remaining[year] == 0 and year not in failed:
+                finish_year(year)
+
+    if detector == "tiered":
+        total = sum(tier_counts.values()) or 1
+        for tier in TIERS:
+            logging.info("Language detection, {}: {} sentences ({:.1%}), {:.1f} CPU s".format(
+                tier, tier_counts[tier], tier_counts[tier] / total, tier_times[tier]))
+    for year in failed:
+        for part in range(parts[year]):
+            for path in [part_path(output_dirpath, year, part), part_path(output_dirpath, year, part) + ".stats.npz"]:
+                if os.path.exists(path):
+                    os.remove(path)
+    return failed
 
 
 @click.command()
 @click.argument('start_year', default = 1922)
 @click.argument('end_year', default = 2015)
-@click.argument('input_filepath', default = "../../data/external/AKN_dail.zip", type=click.Path(exists=True))
-@click.argument('output_dirpath', default = "../../data/interim/english", type=click.Path())
+@click.argument('input_filepath', default = os.path.join(project_dir, "data/external/AKN_dail.zip"), type=click.Path(exists=True))
+@click.argument('output_dirpath', default = os.path.join(project_dir, "data/interim/english"), type=click.Path())
+@click.option('--workers', default=multiprocessing.cpu_count(), help="Number of extraction processes.")
+@click.option('--chunk-mb', default=32, help="Approximate MB of XML per task.")
+@click.option('--detector', type=click.Choice(["tiered", "polyglot"]), default="tiered",
+              help="Fada/stopword pre-filter with Polyglot fallback, or Polyglot on every sentence.")
+@click.option('--metrics', 'metrics_path', type=click.Path(), help="Append progress and a run summary here as JSON lines.")
+@click.option('--profile', type=click.Path(), help="Write sampled cProfile stats for each task to PROFILE.<year>-<part>.")
+@click.option('--table', 'table_dirpath', type=click.Path(), help="Also write per-year Parquet paragraph tables here.")
+@click.option('--dry-run', is_flag=True, help="List the years and sittings that would be extracted and exit.")
 #@click.argument('nlp', default = None)
-def main(input_filepath, output_dirpath, start_year, end_year):
+def main(input_filepath, output_dirpath, start_year, end_year, workers, chunk_mb, detector, metrics_path, profile,
+         table_dirpath, dry_run):
     logger = logging.getLogger(__name__)
     logger.info('making English only interim data set from raw data')
-    logging.info("Prepared pipeline")
-    if not os.path.exists(output_dirpath):
-        os.makedirs(output_dirpath)
-    for year in range(start_year, end_year+1):
-        with ProcessPoolExecutor(max_workers=4) as executor:
-            r = executor.submit(pipeline, input_filepath, output_dirpath, year)
-            logging.info("Result: {}".format(r.result()))
+    metrics = Metrics("english", metrics_path)
+    failed = build(input_filepath, output_dirpath, start_year, end_year, workers, chunk_mb, detector,
+                   metrics, profile, dry_run)
+    if dry_run:
+        return
+    if failed:
+        logging.error("Finished with failures in: {}".format(", ".join(str(y) for y in sorted(failed))))
+        metrics.close()
+        sys.exit(1)
+    if table_dirpath:
+        with metrics.stage("table"):
+            failed = export(output_dirpath, table_dirpath, workers, range(start_year, end_year + 1))
+        if failed:
+            logging.error("Paragraph tables failed for: {}".format(", ".join(str(y) for y in sorted(failed))))
+            metrics.close()
+            sys.exit(1)
+    metrics.close()
     logging.info("Finished")
 
 
 if __name__ == '__main__':
     now = datetime.now()
-    logfile = "logs/make-english-dataset_{}.log".format(now.strftime("%Y-%m-%dT%H-%M"))
+    logfile = os.path.join(project_dir, "logs", "make-english-dataset_{}.log".format(now.strftime("%Y-%m-%dT%H-%M")))
+    os.makedirs(os.path.dirname(logfile), exist_ok=True)
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(filename=logfile, level=logging.INFO, format=log_fmt)
 
-    # not used in this stub but often useful for finding various files
-    project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
     logging.info('Project dir: {}'.format(project_dir))
     # find .env automagically by walking up directories until it's found, then
     # load up the .env entries as environment variables
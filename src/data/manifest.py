@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import logging
+
+
+class Manifest:
+    '''Content hashes of the inputs that went into a stage's per-year output
+    files, plus the configuration they were produced with. A rerun compares
+    fresh hashes against the manifest and only reprocesses what changed; a
+    change of configuration invalidates everything.
+    '''
+    def __init__(self, path, config):
+        self.path = path
+        self.config = config
+        self.config_hash = digest(json.dumps(config, sort_keys=True))
+        self.years = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                d = json.load(f)
+            if d["config_hash"] == self.config_hash:
+                self.years = d["years"]
+            else:
+                logging.info("Configuration changed since last run, rebuilding everything")
+
+    def diff(self, year, digests):
+        '''Return the keys that are new or changed for a year, and those that
+        were recorded previously but have since disappeared.
+        '''
+        old = self.years.get(str(year), {})
+        dirty = set(k for k, h in digests.items() if old.get(k) != h)
+        removed = set(old) - set(digests)
+        return dirty, removed
+
+    def update_year(self, year, digests):
+        self.years[str(year)] = dict(digests)
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"config": self.config, "config_hash": self.config_hash,
+                       "years": self.years}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def line_date(line):
+    '''Sitting date from a "date/eId: text" line.
+    '''
+    return line.split("/", 1)[0]
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import re
+import json
+import zlib
+import click
+import struct
+import logging
+from bisect import bisect_left, bisect_right
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED, structFileHeader, sizeFileHeader
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+FILENAME_DATE = re.compile(r"AK-dail-(\d{4}-\d{2}-\d{2})")
+CHUNK = 64 * 1024
+
+
+class MemberReader(io.RawIOBase):
+    '''Reads a single zip member given its local header offset, without
+    parsing the archive's central directory.
+    '''
+    def __init__(self, archive, entry):
+        self._f = open(archive, "rb")
+        self._f.seek(entry["offset"])
+        header = struct.unpack(structFileHeader, self._f.read(sizeFileHeader))
+        if header[0] != b"PK\x03\x04":
+            self._f.close()
+            raise ValueError("Bad local header for {} in {}".format(entry["name"], archive))
+        self._f.seek(header[10] + header[11], os.SEEK_CUR)
+        self._remaining = entry["compress_size"]
+        if entry["compress_type"] == ZIP_DEFLATED:
+            self._decomp = zlib.decompressobj(-15)
+        elif entry["compress_type"] == ZIP_STORED:
+            self._decomp = None
+        else:
+            self._f.close()
+            raise ValueError("Unsupported compression for {}".format(entry["name"]))
+        self._flushed = False
+        self._buf = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            if self._remaining <= 0:
+                if self._decomp is None or self._flushed:
+                    return 0
+                self._buf = self._decomp.flush()
+                self._flushed = True
+                continue
+            chunk = self._f.read(min(CHUNK, self._remaining))
+            if not chunk:
+                raise EOFError("Truncated zip member")
+            self._remaining -= len(chunk)
+            self._buf = self._decomp.decompress(chunk) if self._decomp else chunk
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+class SittingIndex:
+    '''Maps each debateRecord in an AKN zip to its sitting date, size and
+    local header offset. Built once per archive and persisted alongside it
+    as JSON; entries are kept sorted by date so date ranges are a bisect.
+    '''
+    def __init__(self, archive, sittings, stamp=None):
+        self.archive = archive
+        self.sittings = sorted(sittings, key=lambda s: (s["date"], s["name"]))
+        self.dates = [s["date"] for s in self.sittings]
+        self.stamp = stamp or archive_stamp(archive)
+
+    def __len__(self):
+        return len(self.sittings)
+
+    @classmethod
+    def build(cls, archive, prefix="dail/AK-dail"):
+        sittings = []
+        with ZipFile(archive) as z:
+            for fn in z.filelist:
+                if not fn.filename.startswith(prefix):
+                    continue
+                m = FILENAME_DATE.search(fn.filename)
+                date = m.group(1) if m else frbr_date(z, fn)
+                sittings.append({
+                    "name": fn.filename,
+                    "date": date,
+                    "size": fn.file_size,
+                    "compress_size": fn.compress_size,
+                    "compress_type": fn.compress_type,
+                    "offset": fn.header_offset,
+                    "crc": fn.CRC})
+        logging.info("Indexed {} sittings in {}".format(len(sittings), archive))
+        return cls(archive, sittings)
+
+    @classmethod
+    def load(cls, path, archive):
+        with open(path) as f:
+            d = json.load(f)
+        return cls(archive, d["sittings"], d["stamp"])
+
+    @classmethod
+    def load_or_build(cls, archive, save=True):
+        '''Load the persisted index for an archive, rebuilding it if the
+        archive has changed since it was written, and saving the rebuilt
+        index unless save is False.
+        '''
+        path = index_path(archive)
+        if os.path.exists(path):
+            index = cls.load(path, archive)
+            if index.stamp == archive_stamp(archive):
+                return index
+            logging.info("Sitting index for {} is stale".format(archive))
+        index = cls.build(archive)
+        if save:
+            index.save(path)
+        return index
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"stamp": self.stamp, "sittings": self.sittings}, f)
+
+    def select(self, start_date, end_date):
+        '''Sittings with start_date <= date <= end_date (ISO date strings).
+        '''
+        lo = bisect_left(self.dates, start_date)
+        hi = bisect_right(self.dates, end_date)
+        return self.sittings[lo:hi]
+
+    def year(self, year):
+        return self.select("{}-01-01".format(year), "{}-12-31".format(year))
+
+    def years(self):
+        return sorted(set(int(d[:4]) for d in self.dates))
+
+    def open(self, entry):
+        return open_member(self.archive, entry)
+
+
+def open_member(archive, entry):
+    return io.BufferedReader(MemberReader(archive, entry))
+
+
+def archive_stamp(archive):
+    st = os.stat(archive)
+    return [st.st_size, int(st.st_mtime)]
+
+
+def index_path(archive):
+    return archive + ".index.json"
+
+
+def frbr_date(z, fn):
+    from lxml import etree
+    with z.open(fn) as x:
+        for _, el in etree.iterparse(x, tag="{*}FRBRdate"):
+            return el.attrib["date"]
+    raise ValueError("No FRBRdate in {}".format(fn.filename))
+
+
+@click.command()
+@click.argument('input_filepath', default=os.path.join(project_dir, "data/external/AKN_dail.zip"), type=click.Path(exists=True))
+def main(input_filepath):
+    index = SittingIndex.build(input_filepath)
+    index.save(index_path(input_filepath))
+    logging.info("Wrote {}".format(index_path(input_filepath)))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
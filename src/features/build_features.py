@@ -2,27 +2,97 @@
 import os
 import click
 import logging
-import spacy
-import tarfile
 import multiprocessing
-from dotenv import find_dotenv, load_dotenv
 from datetime import datetime
-from collections import defaultdict
+from itertools import groupby
+from collections import OrderedDict
+from src.data.manifest import Manifest, line_date
+from src.data.corpus import Corpus
+from src.features.token_cache import TokenCache, SittingBuilder
+from src.metrics import Metrics
 
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+POS = ["ADV", "ADJ", "VERB", "PROPN", "NOUN"]
+# Components each token_type can do without. Lemmas need the tagger and
+# attribute ruler; sentence mode swaps the parser for the lighter senter
+# where the model ships one.
+EXCLUDE = {"para": ["ner", "parser", "senter"], "sent": ["ner"]}
+
+
+# spaCy pipelines loaded in this process, by (model, token_type)
+_nlp = {}
+
+
+def load_nlp(model, token_type):
+    '''Load a spaCy model for a token_type once per process.
+    '''
+    if (model, token_type) in _nlp:
+        return _nlp[model, token_type]
+    import spacy
+    nlp = spacy.load(model, exclude=EXCLUDE[token_type])
+    if token_type == "sent":
+        if "senter" in nlp.disabled:
+            if "parser" in nlp.pipe_names:
+                nlp.disable_pipe("parser")
+            nlp.enable_pipe("senter")
+        elif "parser" not in nlp.pipe_names and "senter" not in nlp.pipe_names:
+            raise ValueError("{} has neither a parser nor a senter to split sentences with".format(model))
+    logging.info("Loaded {} with components: {}".format(model, ", ".join(nlp.pipe_names)))
+    _nlp[model, token_type] = nlp
+    return nlp
+
+
+class TokenFilter:
+    '''Bounded LRU cache from (orth, tag) to the "lemma/POS" string written
+    for a token, or None if the token is dropped. The tag fixes the coarse
+    POS and the lemmatizer's rule, so repeat tokens skip the attribute
+    lookups, string formatting and POS membership test. maxsize=0 turns the
+    cache off.
+    '''
+    def __init__(self, maxsize=200000):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, tok):
+        key = (tok.orth, tok.tag)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        value = "{}/{}".format(tok.lemma_, tok.pos_) if (
+            tok.is_alpha and not tok.is_stop and tok.pos_ in POS) else None
+        if self.maxsize:
+            self.cache[key] = value
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return value
 
 
 class TextPipeline:
     def __init__(
             self, input_filepath,
             start_year, end_year,
-            token_type="para"):
+            token_type="para", model="en_core_web_sm",
+            workers=1, batch_size=200, cache_size=200000, metrics=None,
+            cache_dirpath=None, cache_gb=2.0):
         self.format = token_type
-        self.nlp = spacy.load("en")
+        self.model = model
+        self.tokens = TokenFilter(cache_size)
         self.input_filepath = input_filepath
+        # no input corpus when paragraphs are streamed in through tag()
+        self.corpus = Corpus(input_filepath) if input_filepath else None
         self.start_year = start_year
         self.end_year = end_year
-
-        self.uris = []
+        self.workers = workers
+        self.batch_size = batch_size
+        self.metrics = metrics or Metrics("tagged")
+        # spaCy's output per sitting, kept across runs
+        self.cache = TokenCache(cache_dirpath, {"spacy_model": model, "exclude": EXCLUDE[token_type]},
+                                int(cache_gb * (1 << 30))) if cache_dirpath else None
 
     def __iter__(self):
         for year in range(self.start_year, self.end_year+1):
@@ -32,90 +102,213 @@ class TextPipeline:
                 yield line
             yield "!!close " + str(year)
 
-    def spacy_pipeline(self, year):
-        for i, toks in enumerate(
-                self.nlp.pipe(self.extract_paragraphs(year),
-                        batch_size=200, n_threads=cores)):
+    @property
+    def nlp(self):
+        return self.load()
+
+    def load(self):
+        '''The spaCy pipeline, loaded on first use so that planning a run
+        does not pay for it.
+        '''
+        return load_nlp(self.model, self.format)
+
+    def config(self):
+        return {"stage": "tagged", "spacy_model": self.model,
+                "token_type": self.format, "pos": POS}
+
+    def spacy_pipeline(self, year, dates=None):
+        '''Tag a year's paragraphs from the input corpus. With a token
+        cache, cached sittings are formatted from it and the rest are tagged
+        and added to it.
+        '''
+        if self.cache is None:
+            return self.tag(self.metrics.timed("read", self.extract_paragraphs(year, dates)))
+        return self.cached_pipeline(year, dates)
+
+    def tag_docs(self, paragraphs):
+        '''spaCy Docs for (text, uri) pairs, fanning batches out over
+        `workers` processes. The URI travels with each text as its context,
+        so order and URIs are preserved.
+        '''
+        m = self.metrics
+        for toks, uri in m.timed("spacy", self.nlp.pipe(
+                paragraphs, as_tuples=True,
+                batch_size=self.batch_size, n_process=self.workers)):
+            m.count("paragraphs")
+            m.count("tokens", len(toks))
+            yield toks, uri
+
+    def format_doc(self, toks, uri):
+        with self.metrics.stage("format"):
             if self.format == "sent":
-                for sent in (self.iter_sentences(toks, i)):
-                    yield sent
-            else:
-                yield self.iter_paragraphs(toks, i)
+                return list(self.iter_sentences(toks, uri))
+            return [self.iter_paragraphs(toks, uri)]
+
+    def tag(self, paragraphs):
+        '''Tag (text, uri) pairs into output lines.
+        '''
+        for toks, uri in self.tag_docs(paragraphs):
+            for line in self.format_doc(toks, uri):
+                yield line
 
+    def tag_sittings(self, year, entries):
+        '''Tag whole sittings, given their corpus index entries, adding
+        each to the token cache. Yields (date, CachedSitting, lines).
+        '''
+        digests = {e[0]: e[4] for e in entries}
+        paragraphs = self.metrics.timed("read", self.extract_paragraphs(year, set(digests)))
+        for date, docs in groupby(self.tag_docs(paragraphs), key=lambda d: line_date(d[1])):
+            builder, lines = SittingBuilder(), []
+            for toks, uri in docs:
+                builder.add(toks, uri)
+                lines.extend(self.format_doc(toks, uri))
+            with self.metrics.stage("cache"):
+                sitting = builder.build()
+                self.cache.put(date, digests[date], sitting)
+            yield date, sitting, lines
+
+    def cached_sittings(self, year, entries):
+        '''(date, CachedSitting, lines or None) for each entry, in order,
+        tagging runs of sittings missing from the cache together.
+        '''
+        missing = []
+        for entry in entries:
+            with self.metrics.stage("cache"):
+                sitting = self.cache.get(entry[0], entry[4])
+            if sitting is None:
+                missing.append(entry)
+                continue
+            if missing:
+                for tagged in self.tag_sittings(year, missing):
+                    yield tagged
+                missing = []
+            self.metrics.count("cached_sittings")
+            yield entry[0], sitting, None
+        if missing:
+            for tagged in self.tag_sittings(year, missing):
+                yield tagged
+
+    def cached_pipeline(self, year, dates=None):
+        for _, sitting, lines in self.cached_sittings(year, self.corpus.entries(year, dates)):
+            if lines is None:
+                with self.metrics.stage("format"):
+                    lines = sitting.lines(self.format, POS)
+            for line in lines:
+                yield line
 
-    def iter_sentences(self, toks, i):
-        sentences = [["{}/{}".format(tok.lemma_, tok.pos_) for tok in sent
-                if tok.is_alpha and not
-                tok.is_stop and
-                tok.pos_ in ["ADV", "ADJ", "VERB", "PROPN", "NOUN"]]
+    def sittings(self, start_date, end_date):
+        '''Cached spaCy output of each sitting with start_date <= date <=
+        end_date, tagging and caching those not in the cache yet.
+        '''
+        for year, entries in groupby(self.corpus.select(start_date, end_date), key=lambda e: e[0]):
+            for _, sitting, _ in self.cached_sittings(year, [e for _, e in entries]):
+                yield sitting
+
+    def iter_sentences(self, toks, uri):
+        sentences = [[t for t in map(self.tokens, sent) if t]
                 for sent in toks.sents]
         for sentence in sentences:
-            yield str(i)+": "+" ".join(sentence)+"\n"
-
-    def iter_paragraphs(self, toks, i):
-        paragraph = ["{}/{}".format(tok.lemma_, tok.pos_) for tok in toks
-                if tok.is_alpha and not
-                tok.is_stop and
-                tok.pos_ in ["ADV", "ADJ", "VERB", "PROPN", "NOUN"]]
-        return self.uris[i] + ": " + " ".join(paragraph)+"\n"
-
-    def extract_paragraphs(self, year):
-        self.uris = []
-        i = []
+            yield uri+": "+" ".join(sentence)+"\n"
+
+    def iter_paragraphs(self, toks, uri):
+        paragraph = [t for t in map(self.tokens, toks) if t]
+        return uri + ": " + " ".join(paragraph)+"\n"
+
+    def date_digests(self, year):
+        '''Hashes of the input lines for each sitting date in a year, as
+        recorded in the input corpus index.
+        '''
+        return self.corpus.digests(year)
+
+    def extract_paragraphs(self, year, dates=None):
+        i = 0
         logging.info("Year: {}".format(year))
-        with tarfile.open(self.input_filepath, encoding="utf-8") as tf:
-            filenames = [fn for fn in tf if str(year) in fn.name]
-            for fn in filenames:
-                fileobj = tf.extractfile(fn)
-                for i, line in enumerate(fileobj):
-                    uri_text = line.decode("utf-8").split(": ")
-                    self.uris.append(uri_text[0])
-                    yield uri_text[1]
-                    if i % 2000 == 0:
-                        logging.info("Wrote {}, of {} paragraphs for {}".format(uri_text[0], i, year))
-        logging.info(logging.info("Finished with {}: Wrote {} paragraphs".format(year, i)))
+        self.metrics.bytes_read("read", sum(e[2] for e in self.corpus.entries(year, dates)))
+        for i, line in enumerate(self.corpus.lines(year, dates), 1):
+            uri_text = line.split(": ", 1)
+            yield uri_text[1], uri_text[0]
+            if i % 2000 == 0:
+                logging.info("Wrote {}, of {} paragraphs for {}".format(uri_text[0], i, year))
+        logging.info("Finished with {}: Wrote {} paragraphs".format(year, i))
 
 
 
 @click.command()
 @click.argument('start_year', default = 1923)
 @click.argument('end_year', default = 2015)
-@click.argument('input_filepath', default = "../../data/interim/english-dail_1922-2015.tar.gz", type=click.Path(exists=True))
-@click.argument('output_dirpath', default = "../../data/processed", type=click.Path(exists=True))
+@click.argument('input_filepath', default = os.path.join(project_dir, "data/interim/english"), type=click.Path(exists=True))
+@click.argument('output_dirpath', default = os.path.join(project_dir, "data/processed"), type=click.Path(exists=True))
+@click.option('--model', default="en_core_web_sm", help="spaCy model to tag with.")
+@click.option('--workers', default=multiprocessing.cpu_count(), help="Number of spaCy processes.")
+@click.option('--batch-size', default=200, help="Paragraphs per spaCy batch.")
+@click.option('--token-type', type=click.Choice(["para", "sent"]), default="para",
+              help="Write one line per paragraph or per sentence.")
+@click.option('--metrics', 'metrics_path', type=click.Path(), help="Append progress and a run summary here as JSON lines.")
+@click.option('--profile', type=click.Path(), help="Write sampled cProfile stats here.")
+@click.option('--dry-run', is_flag=True, help="List the years that would be tagged and exit.")
+@click.option('--cache', 'cache_dirpath', type=click.Path(),
+              help="Token cache to reuse spaCy's output from and add it to (see src/features/token_cache.py).")
+@click.option('--cache-gb', default=2.0, help="Size the token cache is kept under.")
 #@click.argument('nlp', default = None)
-def main(input_filepath, output_dirpath, start_year, end_year):
-    method = "spacy-para-lemma-tag"
+def main(input_filepath, output_dirpath, start_year, end_year, model, workers, batch_size, token_type, metrics_path, profile,
+         dry_run, cache_dirpath, cache_gb):
+    method = "spacy-{}-lemma-tag".format(token_type)
     logger = logging.getLogger(__name__)
     logger.info('making tagged data set from raw data')
-    pipe = TextPipeline(input_filepath, start_year, end_year)
-
-    logging.info("Prepared spaCy pipeline")
+    metrics = Metrics("tagged", metrics_path, profile=profile)
+    # A dry run writes nothing, so it opens neither the token cache nor a
+    # corpus that does not exist yet, as both create their directories
+    pipe = TextPipeline(input_filepath, start_year, end_year, token_type=token_type,
+                        model=model, workers=workers, batch_size=batch_size, metrics=metrics,
+                        cache_dirpath=None if dry_run else cache_dirpath, cache_gb=cache_gb)
     directory = "{}/{}_{}-{}".format(output_dirpath, method, start_year, end_year)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    for sentence in pipe:
-        if sentence.startswith("!!open"):
-            fn = "{}_{}.txt".format(method, sentence.split()[-1])
-            f = open(os.path.join(directory, fn), "w")
-            logging.info("Writing file for {}".format(fn))
-        elif sentence.startswith("!!close"):
-            f.close()
-            logging.info("Closed file for {}".format(sentence.split()[-1]))
+    corpus = Corpus(directory) if not dry_run or os.path.exists(directory) else None
+    indexed = corpus.index if corpus is not None else {}
+    manifest = Manifest(os.path.join(directory, "manifest.json"), pipe.config())
+    for year in range(start_year, end_year+1):
+        digests = pipe.date_digests(year)
+        if year not in indexed or str(year) not in manifest.years:
+            dates, replaced = None, None
+            if dry_run and digests:
+                click.echo("{}: all {} sittings".format(year, len(digests)))
         else:
-            sentence = sentence
-            f.write((sentence))
+            dates, removed = manifest.diff(year, digests)
+            if not dates and not removed:
+                logging.info("Nothing to do for {}".format(year))
+                continue
+            replaced = dates | removed
+            logging.info("{}: {} new or changed sittings, {} removed".format(year, len(dates), len(removed)))
+            if dry_run:
+                click.echo("{}: {} new or changed sittings, {} removed".format(year, len(dates), len(removed)))
+        if dry_run:
+            continue
+        if pipe.cache is None:
+            with metrics.stage("load"):
+                pipe.load()
+        logging.info("Writing shard for {}".format(year))
+        with metrics.stage("write"):
+            if replaced is None:
+                corpus.write_year(year, pipe.spacy_pipeline(year))
+            else:
+                corpus.splice_year(year, pipe.spacy_pipeline(year, dates), replaced)
+        metrics.bytes_written("write", os.path.getsize(corpus.shard_path(year)))
+        manifest.update_year(year, digests)
+        manifest.save()
+        logging.info("Closed file for {}".format(year))
+    if pipe.cache is not None:
+        logging.info("Token cache: {} sittings read, {} tagged, {:,} bytes".format(
+            pipe.cache.hits, pipe.cache.misses, pipe.cache.size))
+    metrics.close()
     logging.info("Finished")
 
 
 if __name__ == '__main__':
     now = datetime.now()
-    logfile = "logs/make-dataset_{}.log".format(now.strftime("%Y-%m-%dT%H-%M"))
+    logfile = os.path.join(project_dir, "logs", "make-dataset_{}.log".format(now.strftime("%Y-%m-%dT%H-%M")))
+    os.makedirs(os.path.dirname(logfile), exist_ok=True)
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(filename=logfile, level=logging.INFO, format=log_fmt)
-    cores = multiprocessing.cpu_count()
 
-    # not used in this stub but often useful for finding various files
-    project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
     logging.info('Project dir: {}'.format(project_dir))
     # find .env automagically by walking up directories until it's found, then
     # load up the .env entries as environment variables
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import click
+import hashlib
+import logging
+import multiprocessing
+from datetime import datetime
+from collections import deque, defaultdict, Counter
+from concurrent.futures import ProcessPoolExecutor
+from src.data.sitting_index import SittingIndex
+from src.data.manifest import Manifest, line_date
+from src.data.corpus import Corpus
+from src.data.get_english_text import extract_part, plan_tasks, part_path, sitting_digest, assemble_year
+from src.features.build_features import TextPipeline
+from src.features.stats import save_columns
+from src.features.language import TIERS
+from src.metrics import Metrics
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+
+def ordered_results(executor, tasks, window, metrics):
+    '''Submit (year, part, sittings) tasks to the extraction pool and yield
+    their results in task order, with at most `window` tasks in flight, so
+    extraction runs ahead of tagging by a bounded amount.
+    '''
+    pending = deque()
+    tasks = iter(tasks)
+    for year, part, sittings in tasks:
+        pending.append((year, part, executor.submit(extract_part, *sittings)))
+        if len(pending) >= window:
+            break
+    while pending:
+        year, part, future = pending.popleft()
+        metrics.gauge("extract_in_flight", len(pending) + 1)
+        with metrics.stage("wait_extract"):
+            result = future.result()
+        for next_year, next_part, sittings in tasks:
+            pending.append((next_year, next_part, executor.submit(extract_part, *sittings)))
+            break
+        yield year, part, result
+
+
+class FusedYear:
+    '''Feeds one year's extraction results to the tagger as (text, uri)
+    pairs, hashing each date's English lines the way Corpus does, so the
+    tagged corpus gets the same manifest digests as a two-stage build. With
+    a tap, each result is also written as a part file for the interim
+    English corpus.
+    '''
+    def __init__(self, results, year, parts, tap=None):
+        self.results = results
+        self.year = year
+        self.parts = parts
+        self.tap = tap
+        self.digests = {}
+        self.tiers = Counter(), defaultdict(float)
+        self.snapshots = []
+
+    def __iter__(self):
+        hashes = {}
+        for _ in range(self.parts):
+            year, part, (lines, stats, (counts, times), snapshot) = next(self.results)
+            assert year == self.year
+            self.tiers[0].update(counts)
+            for tier, t in times.items():
+                self.tiers[1][tier] += t
+            self.snapshots.append(snapshot)
+            if self.tap:
+                path = part_path(self.tap, year, part)
+                with open(path, "w") as f:
+                    f.writelines(lines)
+                save_columns(path + ".stats.npz", stats)
+            for line in lines:
+                date = line_date(line)
+                if date not in hashes:
+                    hashes[date] = hashlib.sha1()
+                hashes[date].update(line.encode("utf-8"))
+                uri, text = line.split(": ", 1)
+                yield text, uri
+        self.digests = {date: h.hexdigest() for date, h in hashes.items()}
+
+
+@click.command()
+@click.argument('start_year', default=1923)
+@click.argument('end_year', default=2015)
+@click.argument('input_filepath', default=os.path.join(project_dir, "data/external/AKN_dail.zip"), type=click.Path(exists=True))
+@click.argument('output_dirpath', default=os.path.join(project_dir, "data/processed"), type=click.Path(exists=True))
+@click.option('--tap', type=click.Path(), help="Also write the interim English corpus to this directory.")
+@click.option('--extract-workers', default=max(1, multiprocessing.cpu_count() // 2), help="Extraction and language detection processes.")
+@click.option('--tag-workers', default=max(1, multiprocessing.cpu_count() // 2), help="spaCy processes.")
+@click.option('--chunk-mb', default=8, help="Approximate MB of XML per extraction task.")
+@click.option('--detector', type=click.Choice(["tiered", "polyglot"]), default="tiered")
+@click.option('--model', default="en_core_web_sm", help="spaCy model to tag with.")
+@click.option('--batch-size', default=200, help="Paragraphs per spaCy batch.")
+@click.option('--token-type', type=click.Choice(["para", "sent"]), default="para")
+@click.option('--metrics', 'metrics_path', type=click.Path(), help="Append progress and a run summary here as JSON lines.")
+def main(start_year, end_year, input_filepath, output_dirpath, tap, extract_workers, tag_workers,
+         chunk_mb, detector, model, batch_size, token_type, metrics_path):
+    '''Extract, filter and tag in one pass: paragraphs stream from the
+    extraction pool straight into spaCy without an interim corpus on disk,
+    unless --tap asks for one. Requested years are always rebuilt; the
+    output matches build_features.py run on get_english_text.py output.
+    '''
+    metrics = Metrics("fused", metrics_path)
+    index = SittingIndex.load_or_build(input_filepath)
+    pipe = TextPipeline(None, start_year, end_year, token_type=token_type, model=model,
+                        workers=tag_workers, batch_size=batch_size, metrics=metrics)
+    directory = os.path.join(output_dirpath, "spacy-{}-lemma-tag_{}-{}".format(token_type, start_year, end_year))
+    corpus = Corpus(directory)
+    manifest = Manifest(os.path.join(directory, "manifest.json"), pipe.config())
+    if tap:
+        tap_corpus = Corpus(tap)
+        tap_manifest = Manifest(os.path.join(tap, "manifest.json"), {"stage": "english", "detector": detector})
+
+    selected = {year: index.year(year) for year in range(start_year, end_year + 1) if index.year(year)}
+    tasks = sorted((year, part, (input_filepath, year, part, chunk, detector))
+                   for _, year, part, chunk in plan_tasks(selected, chunk_mb * 1024 * 1024))
+    parts = Counter(year for year, _, _ in tasks)
+    logging.info("Streaming {} tasks for {} years: {} extraction workers, {} spaCy workers".format(
+        len(tasks), len(parts), extract_workers, tag_workers))
+
+    def run_year(year):
+        fused = FusedYear(results, year, parts[year], tap)
+        with metrics.stage("write"):
+            corpus.write_year(year, pipe.tag(fused))
+        metrics.bytes_written("write", os.path.getsize(corpus.shard_path(year)))
+        manifest.update_year(year, fused.digests)
+        manifest.save()
+        for snapshot in fused.snapshots:
+            metrics.merge(snapshot)
+        if tap:
+            with metrics.stage("tap"):
+                assemble_year(tap_corpus, tap, year, parts[year])
+            tap_manifest.update_year(year, {s["name"]: sitting_digest(s) for s in selected[year]})
+            tap_manifest.save()
+        return fused
+
+    tier_counts, tier_times = Counter(), defaultdict(float)
+    with ProcessPoolExecutor(max_workers=extract_workers) as executor:
+        results = ordered_results(executor, tasks, extract_workers * 2, metrics)
+        for year in sorted(parts):
+            try:
+                fused = run_year(year)
+            except Exception:
+                logging.exception("{} failed".format(year))
+                executor.shutdown(cancel_futures=True)
+                metrics.close()
+                sys.exit(1)
+            tier_counts.update(fused.tiers[0])
+            for tier, t in fused.tiers[1].items():
+                tier_times[tier] += t
+            logging.info("Closed file for {}".format(year))
+
+    if detector == "tiered":
+        total = sum(tier_counts.values()) or 1
+        for tier in TIERS:
+            logging.info("Language detection, {}: {} sentences ({:.1%}), {:.1f} CPU s".format(
+                tier, tier_counts[tier], tier_counts[tier] / total, tier_times[tier]))
+    metrics.close()
+    logging.info("Finished")
+
+
+if __name__ == '__main__':
+    now = datetime.now()
+    logfile = os.path.join(project_dir, "logs", "make-fused-dataset_{}.log".format(now.strftime("%Y-%m-%dT%H-%M")))
+    os.makedirs(os.path.dirname(logfile), exist_ok=True)
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(filename=logfile, level=logging.INFO, format=log_fmt)
+
+    main()
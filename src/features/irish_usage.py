@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import click
+import logging
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.features.stats import COLUMNS, SENTENCES, stats_paths, load_columns, save_columns
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+COUNTS = ["paragraphs"] + COLUMNS + SENTENCES
+# Column holding the total, English and Irish counts for each unit
+UNITS = {"sentences": ("sentences", "en_sentences", "ga_sentences"),
+         "tokens": ("tokens", "en", "ga")}
+
+
+def year_usage(stats_path):
+    '''Per-speaker totals of one year's paragraph statistics: paragraphs,
+    tokens and sentences by language.
+    '''
+    d = load_columns(stats_path, ["speaker"] + COLUMNS + SENTENCES)
+    n = len(d["speakers"])
+    usage = {"speakers": d["speakers"],
+             "paragraphs": np.bincount(d["speaker"], minlength=n).astype(np.int64)}
+    for c in COLUMNS + SENTENCES:
+        usage[c] = np.bincount(d["speaker"], weights=d[c], minlength=n).astype(np.int64)
+    return usage
+
+
+def usage_path(root, year):
+    return os.path.join(root, "{}.usage.npz".format(year))
+
+
+def write_year_usage(stats_path, root, year):
+    usage = year_usage(stats_path)
+    save_columns(usage_path(root, year), usage)
+    return len(usage["speakers"]), int(usage["sentences"].sum())
+
+
+def source_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def update(corpus_path, root, workers):
+    '''Bring the usage table in root up to date with the per-year stats
+    files of the extracted corpus: years whose stats file changed are
+    recounted, one year per process, vanished years are dropped, and the
+    combined table is rewritten. Returns the years that failed.
+    '''
+    if not os.path.exists(root):
+        os.makedirs(root)
+    meta_path = os.path.join(root, "meta.json")
+    sources = {}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            sources = json.load(f)["sources"]
+    paths = dict(stats_paths(corpus_path))
+    for year in [y for y in sources if int(y) not in paths]:
+        if os.path.exists(usage_path(root, year)):
+            os.remove(usage_path(root, year))
+        del sources[year]
+    todo = [year for year, path in paths.items() if sources.get(str(year)) != source_key(path)]
+    logging.info("Counting {} of {} years on {} workers".format(len(todo), len(paths), workers))
+
+    failed = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(write_year_usage, paths[year], root, year): year
+                   for year in sorted(todo, key=lambda y: os.path.getsize(paths[y]), reverse=True)}
+        for done, future in enumerate(as_completed(futures), 1):
+            year = futures[future]
+            try:
+                n_speakers, n_sentences = future.result()
+                sources[str(year)] = source_key(paths[year])
+                logging.info("[{}/{}] {}: {} speakers, {} sentences".format(done, len(futures), year, n_speakers, n_sentences))
+            except Exception:
+                logging.exception("[{}/{}] {} failed".format(done, len(futures), year))
+                failed.add(year)
+
+    years = sorted(int(y) for y in sources)
+    parts = [load_columns(usage_path(root, year)) for year in years]
+    speakers = np.unique(np.concatenate([p["speakers"] for p in parts])) if parts else np.array([], dtype=str)
+    table = {"speakers": speakers,
+             "year": np.concatenate([np.full(len(p["speakers"]), y, dtype=np.int16) for y, p in zip(years, parts)] or
+                                    [np.array([], dtype=np.int16)]),
+             "speaker": np.concatenate([np.searchsorted(speakers, p["speakers"]) for p in parts] or
+                                       [np.array([], dtype=np.int64)]).astype(np.int32)}
+    for c in COUNTS:
+        table[c] = np.concatenate([p[c] for p in parts] or [np.array([], dtype=np.int64)])
+    save_columns(os.path.join(root, "usage.npz"), table)
+    with open(meta_path, "w") as f:
+        json.dump({"source": os.path.abspath(corpus_path), "sources": sources}, f, indent=1)
+    return failed
+
+
+class UsageTable:
+    '''Paragraphs, tokens and sentences by language for every speaker and
+    year, one row per (year, speaker) that spoke, as written by update().
+    Aggregates over years or speakers are bincounts over masked rows.
+    '''
+    def __init__(self, root):
+        self.root = root
+        d = load_columns(os.path.join(root, "usage.npz"))
+        self.speakers = d.pop("speakers")
+        self.columns = d
+
+    def __len__(self):
+        return len(self.columns["year"])
+
+    def mask(self, speaker=None, start_year=None, end_year=None):
+        year = self.columns["year"]
+        rows = np.ones(len(year), dtype=bool)
+        if start_year is not None:
+            rows &= year >= start_year
+        if end_year is not None:
+            rows &= year <= end_year
+        if speaker is not None:
+            i = np.searchsorted(self.speakers, speaker)
+            if i == len(self.speakers) or self.speakers[i] != speaker:
+                raise KeyError("No speaker {}".format(speaker))
+            rows &= self.columns["speaker"] == i
+        return rows
+
+    def by_speaker(self, unit="sentences", start_year=None, end_year=None, minimum=1):
+        '''(speakers, totals, Irish counts, Irish share) over a range of
+        years, for speakers with at least `minimum` of the unit, sorted by
+        Irish share.
+        '''
+        total, _, ga = UNITS[unit]
+        rows = self.mask(start_year=start_year, end_year=end_year)
+        codes = self.columns["speaker"][rows]
+        totals = np.bincount(codes, weights=self.columns[total][rows], minlength=len(self.speakers))
+        irish = np.bincount(codes, weights=self.columns[ga][rows], minlength=len(self.speakers))
+        keep = np.flatnonzero(totals >= max(minimum, 1))
+        share = irish[keep] / totals[keep]
+        order = keep[np.argsort(-share, kind="stable")]
+        return (self.speakers[order], totals[order].astype(np.int64), irish[order].astype(np.int64),
+                irish[order] / totals[order])
+
+    def by_year(self, unit="sentences", speaker=None, start_year=None, end_year=None):
+        '''(years, totals, English counts, Irish counts) for the whole house
+        or one speaker.
+        '''
+        total, en, ga = UNITS[unit]
+        rows = self.mask(speaker, start_year, end_year)
+        years, keys = np.unique(self.columns["year"][rows], return_inverse=True)
+        sums = [np.bincount(keys, weights=self.columns[c][rows], minlength=len(years)).astype(np.int64)
+                for c in (total, en, ga)]
+        return (years.astype(int), *sums)
+
+
+@click.group()
+def main():
+    '''Irish and English use per speaker and year.
+    '''
+
+
+@main.command("update")
+@click.argument('input_filepath', default=os.path.join(project_dir, "data/interim/english"), type=click.Path(exists=True))
+@click.argument('output_dirpath', default=os.path.join(project_dir, "data/processed/irish_usage"), type=click.Path())
+@click.option('--workers', default=multiprocessing.cpu_count(), help="Number of processes.")
+def update_table(input_filepath, output_dirpath, workers):
+    '''Recount the years whose paragraph statistics changed.
+    '''
+    failed = update(input_filepath, output_dirpath, workers)
+    if failed:
+        logging.error("Finished with failures in: {}".format(", ".join(str(y) for y in sorted(failed))))
+        sys.exit(1)
+
+
+@main.command()
+@click.argument('table_dirpath', default=os.path.join(project_dir, "data/processed/irish_usage"), type=click.Path(exists=True))
+@click.option('--speaker', help="Show one speaker's use by year.")
+@click.option('--unit', type=click.Choice(sorted(UNITS)), default="sentences")
+@click.option('--start-year', type=int)
+@click.option('--end-year', type=int)
+@click.option('--minimum', default=1000, help="Leave out speakers with fewer sentences or tokens than this.")
+@click.option('--top', default=20, help="Number of speakers to list.")
+def show(table_dirpath, speaker, unit, start_year, end_year, minimum, top):
+    '''Speakers with the highest share of Irish, or one speaker's (or with
+    --speaker all, the house's) use of Irish by year.
+    '''
+    table = UsageTable(table_dirpath)
+    if speaker:
+        years, totals, en, ga = table.by_year(unit, None if speaker == "all" else speaker, start_year, end_year)
+        for year, t, e, g in zip(years, totals, en, ga):
+            click.echo("{} {:>12,} {:>12,} English {:>10,} Irish {:>7.2%}".format(year, t, e, g, g / t if t else 0))
+        return
+    for name, t, g, share in zip(*[a[:top] for a in table.by_speaker(unit, start_year, end_year, minimum)]):
+        click.echo("{:<60} {:>12,} {:>10,} Irish {:>7.2%}".format(name, t, g, share))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import re
+import time
+import logging
+import numpy as np
+from collections import Counter, defaultdict
+
+
+FADAS = np.array([ord(c) for c in "áéíóúÁÉÍÓÚ"], dtype=np.uint32)
+SENTENCE = re.compile(r"(?<=[.!?])\s+")
+WORD = re.compile(r"\w+")
+TIERS = ["fada", "stopword", "polyglot"]
+_polyglot_missing = False
+# English stopwords that are also common Irish words
+HOMOGRAPHS = frozenset(["a", "an", "is", "i", "do"])
+
+# NLTK's English stopword list, shipped here so the detector needs no
+# corpus download
+ENGLISH_STOPWORDS = """
+i me my myself we our ours ourselves you you're you've you'll you'd your yours
+yourself yourselves he him his himself she she's her hers herself it it's its
+itself they them their theirs themselves what which who whom this that that'll
+these those am is are was were be been being have has had having do does did
+doing a an the and but if or because as until while of at by for with about
+against between into through during before after above below to from up down
+in out on off over under again further then once here there when where why how
+all any both each few more most other some such no nor not only own same so
+than too very s t can will just don don't should should've now d ll m o re ve
+y ain aren aren't couldn couldn't didn didn't doesn doesn't hadn hadn't hasn
+hasn't haven haven't isn isn't ma mightn mightn't mustn mustn't needn needn't
+shan shan't shouldn shouldn't wasn wasn't weren weren't won won't wouldn
+wouldn't
+""".split()
+
+
+def split_sentences(text):
+    return [s for s in SENTENCE.split(text.strip()) if s]
+
+
+class TieredDetector:
+    '''English/Irish sentence classifier adapted from the detect_language
+    heuristic in the Detect Gaeilge notebook.
+
+    Sentences are first scored on the proportion of characters that carry a
+    fada, computed for a whole batch at once; anything below `low` is
+    English. The rest are scored on the share of their tokens that are
+    English stopwords, which rescues English sentences that mention the
+    Dáil or the Tánaiste: above `english_stops` is English, otherwise a
+    fada score above `high` or a stopword share below `irish_stops` is
+    Irish. Only sentences left in the ambiguous band go to Polyglot, if it
+    is installed.
+    '''
+    def __init__(self, low=0.008, high=0.01, irish_stops=0.1, english_stops=0.2, stops=None):
+        self.low = low
+        self.high = high
+        self.irish_stops = irish_stops
+        self.english_stops = english_stops
+        if stops is None:
+            stops = ENGLISH_STOPWORDS
+        self.stops = frozenset(stops) - HOMOGRAPHS
+        self.counts = Counter()
+        self.times = defaultdict(float)
+
+    def classify(self, sentences):
+        '''Return a language code for each sentence.
+        '''
+        if not sentences:
+            return []
+        start = time.time()
+        lengths = np.array([len(s) for s in sentences])
+        codes = np.frombuffer("".join(sentences).encode("utf-32-le"), dtype=np.uint32)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        fadas = np.add.reduceat(np.isin(codes, FADAS), offsets)
+        score = fadas / lengths
+        langs = np.where(score < self.low, "en", "").tolist()
+        ambiguous = np.flatnonzero(score >= self.low).tolist()
+        self.counts["fada"] += len(sentences) - len(ambiguous)
+        self.times["fada"] += time.time() - start
+
+        if ambiguous:
+            start = time.time()
+            undecided = []
+            for i in ambiguous:
+                tokens = set(WORD.findall(sentences[i].lower()))
+                ratio = len(tokens & self.stops) / len(tokens) if tokens else 0.0
+                if ratio > self.english_stops:
+                    langs[i] = "en"
+                elif ratio < self.irish_stops or score[i] > self.high:
+                    langs[i] = "ga"
+                else:
+                    undecided.append(i)
+            self.counts["stopword"] += len(ambiguous) - len(undecided)
+            self.times["stopword"] += time.time() - start
+
+            if undecided:
+                start = time.time()
+                for i in undecided:
+                    langs[i] = polyglot_language(sentences[i])
+                self.counts["polyglot"] += len(undecided)
+                self.times["polyglot"] += time.time() - start
+        return langs
+
+    def languages(self, paragraphs):
+        '''Return a list of (sentence, language) pairs for each paragraph,
+        classifying the sentences of the whole batch together.
+        '''
+        sentences = [split_sentences(p) for p in paragraphs]
+        langs = iter(self.classify([s for sents in sentences for s in sents]))
+        return [[(s, next(langs)) for s in sents] for sents in sentences]
+
+    def english(self, paragraphs):
+        '''Return the English sentences of each paragraph, joined with spaces.
+        '''
+        return [" ".join(s for s, lang in sents if lang == "en") for sents in self.languages(paragraphs)]
+
+    def report(self):
+        total = sum(self.counts.values()) or 1
+        for tier in TIERS:
+            logging.info("{}: {} sentences ({:.1%}) in {:.2f}s".format(
+                tier, self.counts[tier], self.counts[tier] / total, self.times[tier]))
+
+
+def polyglot_language(sentence):
+    try:
+        from polyglot.detect import Detector
+    except ImportError:
+        global _polyglot_missing
+        if not _polyglot_missing:
+            logging.warning("Polyglot is not installed; ambiguous sentences are left unclassified")
+            _polyglot_missing = True
+        return "un"
+    try:
+        return Detector(sentence, quiet=True).language.code
+    except Exception:
+        return "un"
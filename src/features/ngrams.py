@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import click
+import hashlib
+import logging
+import multiprocessing
+import numpy as np
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.data.manifest import Manifest
+from src.data.corpus import Corpus
+from src.features.search import term_key
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+ORDERS = (1, 2, 3)
+# Tokens gathered before their n-grams are counted and reduced
+CHUNK = 1 << 22
+MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def ngram_keys(parts):
+    '''64-bit key of each row of an (m, n) array of term keys. A unigram's
+    key is its term key.
+    '''
+    keys = parts[:, 0].copy()
+    for j in range(1, parts.shape[1]):
+        keys = (keys * MIX) ^ parts[:, j]
+    return keys
+
+
+class CountTable:
+    '''Counts of the n-grams of one order: sorted n-gram keys, the term keys
+    of each n-gram and its count. Tables for different years or windows
+    combine with merge().
+    '''
+    def __init__(self, keys, parts, counts):
+        self.keys = keys
+        self.parts = parts
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def count(cls, parts):
+        keys = ngram_keys(parts)
+        keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        return cls(keys, parts[first], np.bincount(inverse.ravel(), minlength=len(keys)).astype(np.int64))
+
+    @classmethod
+    def merge(cls, tables, order):
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return cls(np.array([], dtype=np.uint64), np.zeros((0, order), dtype=np.uint64),
+                       np.array([], dtype=np.int64))
+        if len(tables) == 1:
+            return tables[0]
+        keys = np.concatenate([t.keys for t in tables])
+        keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=np.concatenate([t.counts for t in tables]), minlength=len(keys))
+        return cls(keys, np.concatenate([t.parts for t in tables])[first], counts.astype(np.int64))
+
+    def get(self, keys):
+        '''Counts for an array of n-gram keys, 0 where absent.
+        '''
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=np.int64)
+        i = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[i] == keys, self.counts[i], 0)
+
+    def select(self, mask):
+        return CountTable(self.keys[mask], self.parts[mask], self.counts[mask])
+
+    def save(self, path):
+        for name in ["keys", "parts", "counts"]:
+            tmp = "{}.{}.{}.tmp.npy".format(path, name, os.getpid())
+            np.save(tmp, getattr(self, name))
+            os.replace(tmp, "{}.{}.npy".format(path, name))
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        return cls(*[np.load("{}.{}.npy".format(path, name), mmap_mode=mmap_mode)
+                     for name in ["keys", "parts", "counts"]])
+
+
+def table_path(root, year, order):
+    return os.path.join(root, "{}.n{}".format(year, order))
+
+
+def terms_path(root, year):
+    return os.path.join(root, "{}.terms.txt".format(year))
+
+
+def count_year(corpus_path, root, year):
+    '''Count the unigrams, bigrams and trigrams of one year of the tagged
+    corpus, a chunk of paragraphs at a time, never across a paragraph
+    boundary. Writes <year>.n<order>.{keys,parts,counts}.npy and the
+    unigrams' terms in <year>.terms.txt, and returns the number of tokens
+    and distinct n-grams of each order.
+    '''
+    corpus = Corpus(corpus_path)
+    term_keys = {}
+    partial = {n: [] for n in ORDERS}
+    keys, lengths = array("Q"), array("I")
+
+    def flush():
+        k = np.frombuffer(keys, dtype=np.uint64)
+        docs = np.repeat(np.arange(len(lengths)), np.frombuffer(lengths, dtype=np.uint32))
+        for n in ORDERS:
+            if len(k) < n:
+                continue
+            parts = np.stack([k[j:len(k) - n + 1 + j] for j in range(n)], axis=1)
+            partial[n].append(CountTable.count(parts[docs[:len(docs) - n + 1] == docs[n - 1:]]))
+
+    for line in corpus.lines(year):
+        words = line.split()[1:]
+        for word in words:
+            if word not in term_keys:
+                term_keys[word] = term_key(word)
+        keys.extend([term_keys[w] for w in words])
+        lengths.append(len(words))
+        if len(keys) >= CHUNK:
+            flush()
+            keys, lengths = array("Q"), array("I")
+    flush()
+
+    n_tokens, sizes = 0, []
+    for n in ORDERS:
+        table = CountTable.merge(partial.pop(n), n)
+        table.save(table_path(root, year, n))
+        sizes.append(len(table))
+        if n == 1:
+            n_tokens = int(table.counts.sum())
+            terms = dict((v, k) for k, v in term_keys.items())
+            path = terms_path(root, year)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write("\n".join(terms[k] for k in table.keys.tolist()))
+            os.replace(path + ".tmp", path)
+    return n_tokens, sizes
+
+
+def remove_year(root, year):
+    for n in ORDERS:
+        for name in ["keys", "parts", "counts"]:
+            path = "{}.{}.npy".format(table_path(root, year, n), name)
+            if os.path.exists(path):
+                os.remove(path)
+    path = terms_path(root, year)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def build(corpus_path, root, workers):
+    '''Count every year of the corpus whose sittings changed since the last
+    run, one year per process, and drop the tables of vanished years.
+    Returns the years that failed.
+    '''
+    if not os.path.exists(root):
+        os.makedirs(root)
+    corpus = Corpus(corpus_path)
+    manifest = Manifest(os.path.join(root, "manifest.json"), {"stage": "ngrams", "orders": list(ORDERS)})
+    todo = []
+    for year in corpus.years():
+        dirty, removed = manifest.diff(year, corpus.digests(year))
+        if dirty or removed:
+            todo.append(year)
+    for year in [int(y) for y in manifest.years if int(y) not in corpus.index]:
+        remove_year(root, year)
+        del manifest.years[str(year)]
+    manifest.save()
+    logging.info("Counting {} of {} years on {} workers".format(len(todo), len(corpus.years()), workers))
+
+    failed = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(count_year, corpus_path, root, year): year
+                   for year in sorted(todo, key=corpus.n_lines, reverse=True)}
+        for done, future in enumerate(as_completed(futures), 1):
+            year = futures[future]
+            try:
+                n_tokens, sizes = future.result()
+                manifest.update_year(year, corpus.digests(year))
+                manifest.save()
+                logging.info("[{}/{}] {}: {} tokens, {} distinct n-grams".format(
+                    done, len(futures), year, n_tokens, " / ".join(str(s) for s in sizes)))
+            except Exception:
+                logging.exception("[{}/{}] {} failed".format(done, len(futures), year))
+                failed.add(year)
+    return failed
+
+
+class NgramCounts:
+    '''The per-year count tables written by build(). Tables are
+    memory-mapped, so a frequency time series only reads the pages its
+    binary searches touch; counts over a range of years are merged from
+    the years' tables, never from the text.
+    '''
+    def __init__(self, root):
+        self.root = root
+        self.manifest = Manifest(os.path.join(root, "manifest.json"), {"stage": "ngrams", "orders": list(ORDERS)})
+        self.years = sorted(int(y) for y in self.manifest.years)
+
+    def select(self, start_year=None, end_year=None):
+        '''Years with start_year <= year <= end_year.
+        '''
+        return [y for y in self.years if (start_year is None or y >= start_year) and
+                (end_year is None or y <= end_year)]
+
+    def year_table(self, year, order):
+        return CountTable.load(table_path(self.root, year, order))
+
+    def table(self, order, start_year=None, end_year=None, prefixes=None):
+        '''Counts of one order over a range of years. With prefixes, only
+        n-grams whose first n-1 terms have one of those keys are kept,
+        which keeps the merge small.
+        '''
+        tables = []
+        for year in self.select(start_year, end_year):
+            t = self.year_table(year, order)
+            if prefixes is not None:
+                t = t.select(np.isin(ngram_keys(t.parts[:, :order - 1]), prefixes))
+            tables.append(t)
+        return CountTable.merge(tables, order)
+
+    def vocabulary(self, start_year=None, end_year=None):
+        '''Sorted term keys and their terms over a range of years.
+        '''
+        keys, terms = [], []
+        for year in self.select(start_year, end_year):
+            keys.append(self.year_table(year, 1).keys)
+            with open(terms_path(self.root, year), encoding="utf-8") as f:
+                terms.append(np.array(f.read().split("\n")[:len(keys[-1])], dtype=object))
+        if not keys:
+            return np.array([], dtype=np.uint64), np.array([], dtype=object)
+        keys, first = np.unique(np.concatenate(keys), return_index=True)
+        return keys, np.concatenate(terms)[first]
+
+    def series(self, terms):
+        '''Occurrences of an n-gram given as a list of terms, per year, as
+        [(year, count, tokens in the year)].
+        '''
+        parts = np.array([[term_key(t) for t in terms]], dtype=np.uint64)
+        key = ngram_keys(parts)
+        result = []
+        for year in self.years:
+            result.append((year, int(self.year_table(year, len(terms)).get(key)[0]),
+                           int(self.year_table(year, 1).counts.sum())))
+        return result
+
+
+class Phrases:
+    '''Bigram and trigram phrases over a range of years, scored like
+    gensim's Phrases with its default scorer:
+        (count(a b) - min_count) * V / (count(a) * count(b))
+    where V is the vocabulary size, which the default threshold of 10 is
+    calibrated for. (word2phrase.c scales by the number of tokens instead,
+    with a threshold of 100.) A trigram a b c is scored as the
+    bigram of the phrase "a b" and c, so it is only considered when a b is
+    itself a phrase. bigrams and trigrams map each phrase's terms to its
+    count; apply() joins phrases greedily, longest first.
+    '''
+    def __init__(self, counts, start_year=None, end_year=None, threshold=10.0, min_count=5, delimiter="_"):
+        self.threshold = threshold
+        self.min_count = min_count
+        self.delimiter = delimiter
+        unigrams = counts.table(1, start_year, end_year)
+        vocab_size = max(len(unigrams), 1)
+        bigrams = counts.table(2, start_year, end_year)
+        scores = self.score(bigrams.counts, unigrams.get(bigrams.parts[:, 0]),
+                            unigrams.get(bigrams.parts[:, 1]), vocab_size)
+        bigrams = bigrams.select(scores > threshold)
+        trigrams = counts.table(3, start_year, end_year, prefixes=bigrams.keys)
+        scores = self.score(trigrams.counts, bigrams.get(ngram_keys(trigrams.parts[:, :2])),
+                            unigrams.get(trigrams.parts[:, 2]), vocab_size)
+        trigrams = trigrams.select(scores > threshold)
+        vocab_keys, vocab_terms = counts.vocabulary(start_year, end_year)
+        self.bigrams = self.terms(bigrams, vocab_keys, vocab_terms)
+        self.trigrams = self.terms(trigrams, vocab_keys, vocab_terms)
+        logging.info("{} bigram and {} trigram phrases".format(len(self.bigrams), len(self.trigrams)))
+
+    def score(self, counts, a, b, vocab_size):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = (counts - self.min_count) * float(vocab_size) / (a.astype(np.float64) * b)
+        return np.where((counts >= self.min_count) & (a > 0) & (b > 0), scores, -np.inf)
+
+    @staticmethod
+    def terms(table, vocab_keys, vocab_terms):
+        if not len(table):
+            return {}
+        terms = vocab_terms[np.searchsorted(vocab_keys, table.parts)].tolist()
+        return dict(zip(map(tuple, terms), table.counts.tolist()))
+
+    def signature(self):
+        h = hashlib.sha1()
+        for phrase in sorted(list(self.bigrams) + list(self.trigrams)):
+            h.update(" ".join(phrase).encode("utf-8") + b"\n")
+        h.update(self.delimiter.encode("utf-8"))
+        return h.hexdigest()
+
+    def apply(self, words):
+        out, i, n = [], 0, len(words)
+        while i < n:
+            if i + 2 < n and (words[i], words[i + 1], words[i + 2]) in self.trigrams:
+                out.append(self.delimiter.join(words[i:i + 3]))
+                i += 3
+            elif i + 1 < n and (words[i], words[i + 1]) in self.bigrams:
+                out.append(self.delimiter.join(words[i:i + 2]))
+                i += 2
+            else:
+                out.append(words[i])
+                i += 1
+        return out
+
+
+@click.group()
+def main():
+    '''Unigram, bigram and trigram counts over the tagged corpus.
+    '''
+
+
+@main.command("count")
+@click.argument('input_filepath', default=os.path.join(project_dir, "data/processed/spacy-para-lemma-tag_1923-2015"), type=click.Path(exists=True))
+@click.argument('output_dirpath', default=os.path.join(project_dir, "data/processed/ngrams"), type=click.Path())
+@click.option('--workers', default=multiprocessing.cpu_count(), help="Number of counting processes.")
+def count(input_filepath, output_dirpath, workers):
+    '''Count new and changed years of a tagged corpus.
+    '''
+    failed = build(input_filepath, output_dirpath, workers)
+    if failed:
+        logging.error("Finished with failures in: {}".format(", ".join(str(y) for y in sorted(failed))))
+        sys.exit(1)
+
+
+@main.command()
+@click.argument('ngram')
+@click.argument('counts_dirpath', default=os.path.join(project_dir, "data/processed/ngrams"), type=click.Path(exists=True))
+def series(ngram, counts_dirpath):
+    '''Yearly frequency of a term or a two or three term sequence, e.g.
+    "fianna/PROPN fáil/PROPN".
+    '''
+    terms = ngram.split()
+    if len(terms) not in ORDERS:
+        raise click.BadParameter("Give between {} and {} terms".format(ORDERS[0], ORDERS[-1]))
+    for year, n, total in NgramCounts(counts_dirpath).series(terms):
+        click.echo("{} {:>10,} {:>10.1f} per million".format(year, n, 1e6 * n / total if total else 0))
+
+
+@main.command()
+@click.argument('counts_dirpath', default=os.path.join(project_dir, "data/processed/ngrams"), type=click.Path(exists=True))
+@click.option('--start-year', type=int)
+@click.option('--end-year', type=int)
+@click.option('--threshold', default=10.0)
+@click.option('--min-count', default=5)
+@click.option('--top', default=50, help="Number of phrases to list, most frequent first.")
+def phrases(counts_dirpath, start_year, end_year, threshold, min_count, top):
+    '''Phrases the pre-pass for training would join.
+    '''
+    p = Phrases(NgramCounts(counts_dirpath), start_year, end_year, threshold, min_count)
+    found = sorted(list(p.bigrams.items()) + list(p.trigrams.items()), key=lambda kv: (-kv[1], kv[0]))
+    for phrase, n in found[:top]:
+        click.echo("{:>10,} {}".format(n, " ".join(phrase)))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import click
+import logging
+import datetime
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.features.stats import COLUMNS, SENTENCES, stats_paths, load_columns
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+# Values of the language column: the language with most tokens in the
+# paragraph, or "none" for paragraphs without any
+LANGUAGES = ["en", "ga", "other", "none"]
+
+
+def languages(d):
+    '''Index into LANGUAGES of each row's dominant language.
+    '''
+    counts = np.stack([d["en"], d["ga"], d["other"]], axis=1)
+    return np.where(d["tokens"] > 0, counts.argmax(axis=1), len(LANGUAGES) - 1).astype(np.int8)
+
+
+def to_table(d):
+    '''Arrow table of the paragraph rows in a stats column dict. Speaker,
+    section and heading are expanded from their codes; Parquet stores them
+    dictionary-encoded again.
+    '''
+    import pyarrow as pa
+    table = {"uri": pa.array(np.char.decode(d["uri"], "ascii").tolist(), pa.string()),
+             "date": pa.array(d["date"], pa.date32())}
+    for k, values in [("speaker", "speakers"), ("section", "sections"), ("heading", "headings")]:
+        table[k] = pa.array(d[values].tolist(), pa.string()).take(pa.array(d[k]))
+    table["language"] = pa.array(LANGUAGES, pa.string()).take(pa.array(languages(d)))
+    for c in COLUMNS + SENTENCES:
+        if c in d:
+            table[c] = pa.array(d[c], pa.int32())
+    return pa.table(table)
+
+
+def table_path(root, year):
+    return os.path.join(root, "{}.parquet".format(year))
+
+
+def write_year_table(stats_path, root, year):
+    '''Convert one year's stats file to <year>.parquet. Returns the number
+    of rows.
+    '''
+    import pyarrow.parquet as pq
+    table = to_table(load_columns(stats_path))
+    path = table_path(root, year)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, path)
+    return table.num_rows
+
+
+def export(corpus_path, root, workers, years=None):
+    '''Write the paragraph table for every year of the extracted corpus, or
+    only the given years, one year per process. Years whose table is newer
+    than their stats file are skipped, and tables of years no longer in the
+    corpus are removed. Returns the years that failed.
+    '''
+    if not os.path.exists(root):
+        os.makedirs(root)
+    paths = dict(stats_paths(corpus_path))
+    for fn in os.listdir(root):
+        m = re.match(r"(\d{4})\.parquet$", fn)
+        if m and int(m.group(1)) not in paths:
+            os.remove(os.path.join(root, fn))
+    todo = [year for year in sorted(paths) if (years is None or year in years) and (
+        not os.path.exists(table_path(root, year)) or
+        os.path.getmtime(table_path(root, year)) < os.path.getmtime(paths[year]))]
+    logging.info("Writing paragraph tables for {} of {} years on {} workers".format(len(todo), len(paths), workers))
+
+    failed = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(write_year_table, paths[year], root, year): year
+                   for year in sorted(todo, key=lambda y: os.path.getsize(paths[y]), reverse=True)}
+        for done, future in enumerate(as_completed(futures), 1):
+            year = futures[future]
+            try:
+                logging.info("[{}/{}] {}: {} paragraphs".format(done, len(futures), year, future.result()))
+            except Exception:
+                logging.exception("[{}/{}] {} failed".format(done, len(futures), year))
+                failed.add(year)
+    return failed
+
+
+class ParagraphTable:
+    '''The per-year Parquet files written by export(), read as one dataset.
+    Filters on date, speaker, section and language are pushed down to the
+    files, so a date range only opens the years it covers and a speaker
+    filter skips row groups by their statistics.
+    '''
+    def __init__(self, root):
+        import pyarrow.dataset as ds
+        self.root = root
+        self.paths = sorted(os.path.join(root, fn) for fn in os.listdir(root) if re.match(r"\d{4}\.parquet$", fn))
+        self.dataset = ds.dataset(self.paths, format="parquet")
+
+    def filter(self, start_date=None, end_date=None, speaker=None, section=None, language=None):
+        import pyarrow.dataset as ds
+        conditions = []
+        if start_date is not None:
+            conditions.append(ds.field("date") >= datetime.date.fromisoformat(start_date))
+        if end_date is not None:
+            conditions.append(ds.field("date") <= datetime.date.fromisoformat(end_date))
+        for k, v in [("speaker", speaker), ("section", section), ("language", language)]:
+            if v is not None:
+                conditions.append(ds.field(k) == v)
+        expr = None
+        for c in conditions:
+            expr = c if expr is None else expr & c
+        return expr
+
+    def read(self, columns=None, **filters):
+        '''Arrow table of the matching rows; filters are the keyword
+        arguments of filter().
+        '''
+        return self.dataset.to_table(columns=columns, filter=self.filter(**filters))
+
+    def totals(self, by="speaker", **filters):
+        '''Token counts per value of a column over the matching rows, as an
+        Arrow table sorted by total tokens.
+        '''
+        table = self.read([by] + COLUMNS, **filters)
+        grouped = table.group_by(by).aggregate([(c, "sum") for c in COLUMNS])
+        return grouped.sort_by([("tokens_sum", "descending")])
+
+
+@click.group()
+def main():
+    '''Columnar table of every extracted paragraph: uri, date, speaker,
+    section, heading, dominant language and token counts.
+    '''
+
+
+@main.command("export")
+@click.argument('input_filepath', default=os.path.join(project_dir, "data/interim/english"), type=click.Path(exists=True))
+@click.argument('output_dirpath', default=os.path.join(project_dir, "data/processed/paragraphs"), type=click.Path())
+@click.option('--workers', default=multiprocessing.cpu_count(), help="Number of processes.")
+def export_tables(input_filepath, output_dirpath, workers):
+    '''Write Parquet tables for new and changed years of the English corpus.
+    '''
+    failed = export(input_filepath, output_dirpath, workers)
+    if failed:
+        logging.error("Finished with failures in: {}".format(", ".join(str(y) for y in sorted(failed))))
+        sys.exit(1)
+
+
+@main.command()
+@click.argument('table_dirpath', default=os.path.join(project_dir, "data/processed/paragraphs"), type=click.Path(exists=True))
+@click.option('--by', type=click.Choice(["speaker", "section", "heading", "language"]), default="speaker")
+@click.option('--speaker', help="Speaker href, e.g. /ie/oireachtas/member/id/...")
+@click.option('--language', type=click.Choice(LANGUAGES))
+@click.option('--start-date', help="YYYY-MM-DD")
+@click.option('--end-date', help="YYYY-MM-DD")
+@click.option('--top', default=20, help="Number of groups to list.")
+def query(table_dirpath, by, speaker, language, start_date, end_date, top):
+    '''Token counts by language per speaker, section, heading or dominant
+    language.
+    '''
+    table = ParagraphTable(table_dirpath).totals(by, speaker=speaker, language=language,
+                                                 start_date=start_date, end_date=end_date)
+    click.echo("{:<50} {:>12} {:>12} {:>12} {:>12}".format(by, *COLUMNS))
+    for row in table.slice(0, top).to_pylist():
+        click.echo("{:<50} {:>12,} {:>12,} {:>12,} {:>12,}".format(
+            str(row[by]), *[row[c + "_sum"] for c in COLUMNS]))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import zlib
+import click
+import hashlib
+import logging
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.data.manifest import Manifest
+from src.data.corpus import Corpus
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+URI_WIDTH = 32
+
+
+def term_key(term):
+    '''Stable 64-bit key for a lemma or lemma/POS term.
+    '''
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def encode_postings(docs, positions):
+    '''Compress one term's postings, given the document and position of
+    every occurrence sorted by (doc, position). The block is a uint32
+    array of [n_docs, doc gaps..., term frequencies..., position gaps...],
+    with positions delta-encoded within each document, deflated.
+    '''
+    ids, starts, tfs = np.unique(docs, return_index=True, return_counts=True)
+    gaps = np.diff(positions, prepend=0)
+    gaps[starts] = positions[starts]
+    block = np.concatenate(([len(ids)], np.diff(ids, prepend=0), tfs, gaps)).astype(np.uint32)
+    return zlib.compress(block.tobytes())
+
+
+def decode_postings(data):
+    '''Inverse of encode_postings: (doc ids, term frequencies, positions).
+    '''
+    block = np.frombuffer(zlib.decompress(data), dtype=np.uint32)
+    n = int(block[0])
+    docs = np.cumsum(block[1:n + 1], dtype=np.int64)
+    tfs = block[n + 1:2 * n + 1].astype(np.int64)
+    gaps = block[2 * n + 1:].astype(np.int64)
+    total = np.cumsum(gaps)
+    starts = np.concatenate(([0], np.cumsum(tfs)[:-1]))
+    positions = total - np.repeat(total[starts] - gaps[starts], tfs)
+    return docs, tfs, positions
+
+
+class Segment:
+    '''The index for one year of the tagged corpus:
+    - <year>.keys.npy: sorted 64-bit term keys.
+    - <year>.spans.npy: offset, length and document frequency of each key's
+      block in <year>.postings.bin.
+    - <year>.uris.npy: each paragraph's URI, fixed width.
+    - <year>.dates.npy: each paragraph's sitting date.
+    Every paragraph is indexed under its lemma/POS tokens and their bare
+    lemmas. Positions count the filtered tokens of the line, so a phrase
+    matches tokens that are adjacent in the build_features output.
+    '''
+    def __init__(self, root, year):
+        self.year = year
+        self.path = os.path.join(root, str(year))
+        self.keys = np.load(self.path + ".keys.npy", mmap_mode="r")
+        self.spans = np.load(self.path + ".spans.npy", mmap_mode="r")
+        self.uris = np.load(self.path + ".uris.npy", mmap_mode="r")
+        self.dates = np.load(self.path + ".dates.npy", mmap_mode="r")
+
+    def postings(self, term):
+        key = np.uint64(term_key(term))
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        offset, length, _ = self.spans[i]
+        with open(self.path + ".postings.bin", "rb") as f:
+            f.seek(offset)
+            return decode_postings(f.read(length))
+
+    def match(self, terms):
+        '''Documents containing the terms as a phrase, with the number of
+        times it occurs in each, as (doc ids, counts). No terms match
+        nothing.
+        '''
+        none = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        if not terms:
+            return none
+        hits = None
+        for k, term in enumerate(terms):
+            p = self.postings(term)
+            if p is None:
+                return none
+            docs, tfs, positions = p
+            # A phrase match is a (doc, start position) pair present for
+            # every term once each term's position is shifted back by its
+            # offset in the phrase.
+            shifted = positions - k
+            keep = shifted >= 0
+            starts = (np.repeat(docs, tfs)[keep] << 32) | shifted[keep]
+            hits = starts if hits is None else np.intersect1d(hits, starts, assume_unique=True)
+            if not len(hits):
+                break
+        docs, counts = np.unique(hits >> 32, return_counts=True)
+        return docs, counts
+
+    def select(self, docs, start_date=None, end_date=None):
+        '''Mask of the docs whose sitting falls within the date range.
+        '''
+        dates = self.dates[docs]
+        mask = np.ones(len(docs), dtype=bool)
+        if start_date is not None:
+            mask &= dates >= np.datetime64(start_date, "D")
+        if end_date is not None:
+            mask &= dates <= np.datetime64(end_date, "D")
+        return mask
+
+
+def index_year(corpus_path, root, year):
+    '''Build the segment for one year and return its number of paragraphs
+    and distinct terms.
+    '''
+    corpus = Corpus(corpus_path)
+    ids, occ_terms, occ_docs, occ_pos = {}, [], [], []
+    uris = []
+    for doc, line in enumerate(corpus.lines(year)):
+        tokens = line.split()
+        uris.append(tokens[0][:-1])
+        for pos, tok in enumerate(tokens[1:]):
+            for term in set((tok, tok.rsplit("/", 1)[0])):
+                t = ids.get(term)
+                if t is None:
+                    t = ids[term] = len(ids)
+                occ_terms.append(t)
+                occ_docs.append(doc)
+                occ_pos.append(pos)
+    terms = np.array(occ_terms, dtype=np.int64)
+    docs = np.array(occ_docs, dtype=np.int64)
+    positions = np.array(occ_pos, dtype=np.int64)
+    del occ_terms, occ_docs, occ_pos
+
+    # Sort occurrences into key order, then by doc and position, so each
+    # term's postings are one contiguous run.
+    names = list(ids)
+    keys = np.array([term_key(t) for t in names], dtype=np.uint64)
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[np.argsort(keys)] = np.arange(len(keys))
+    order = np.lexsort((positions, docs, rank[terms]))
+    terms, docs, positions = rank[terms][order], docs[order], positions[order]
+    bounds = np.flatnonzero(np.diff(terms)) + 1
+    starts = np.concatenate(([0], bounds)) if len(terms) else bounds
+    ends = np.concatenate((bounds, [len(terms)])) if len(terms) else bounds
+
+    path = os.path.join(root, str(year))
+    spans = np.zeros((len(starts), 3), dtype=np.int64)
+    with open(path + ".postings.bin.tmp", "wb") as f:
+        for i, (lo, hi) in enumerate(zip(starts.tolist(), ends.tolist())):
+            block = encode_postings(docs[lo:hi], positions[lo:hi])
+            spans[i] = f.tell(), len(block), len(np.unique(docs[lo:hi]))
+            f.write(block)
+    os.replace(path + ".postings.bin.tmp", path + ".postings.bin")
+    np.save(path + ".keys.npy", np.sort(keys))
+    np.save(path + ".spans.npy", spans)
+    uris = [u.encode("utf-8") for u in uris]
+    if uris and max(len(u) for u in uris) > URI_WIDTH:
+        raise ValueError("URI longer than {} bytes in {}".format(URI_WIDTH, year))
+    uris = np.array(uris, dtype="S{}".format(URI_WIDTH))
+    np.save(path + ".uris.npy", uris)
+    np.save(path + ".dates.npy", np.array([u.split(b"/", 1)[0].decode() for u in uris], dtype="datetime64[D]"))
+    return len(uris), len(keys)
+
+
+def remove_segment(root, year):
+    for ext in ["keys.npy", "spans.npy", "uris.npy", "dates.npy", "postings.bin"]:
+        path = os.path.join(root, "{}.{}".format(year, ext))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def build(corpus_path, root, workers):
+    '''Index every year of the corpus whose sittings changed since the last
+    run, one year per process, and drop the segments of vanished years.
+    Returns the years that failed.
+    '''
+    if not os.path.exists(root):
+        os.makedirs(root)
+    corpus = Corpus(corpus_path)
+    manifest = Manifest(os.path.join(root, "manifest.json"), {"stage": "search", "uri_width": URI_WIDTH})
+    todo = []
+    for year in corpus.years():
+        dirty, removed = manifest.diff(year, corpus.digests(year))
+        if dirty or removed:
+            todo.append(year)
+    for year in [int(y) for y in manifest.years if int(y) not in corpus.index]:
+        remove_segment(root, year)
+        del manifest.years[str(year)]
+    manifest.save()
+    logging.info("Indexing {} of {} years on {} workers".format(len(todo), len(corpus.years()), workers))
+
+    failed = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(index_year, corpus_path, root, year): year
+                   for year in sorted(todo, key=corpus.n_lines, reverse=True)}
+        for done, future in enumerate(as_completed(futures), 1):
+            year = futures[future]
+            try:
+                n_docs, n_terms = future.result()
+                manifest.update_year(year, corpus.digests(year))
+                manifest.save()
+                logging.info("[{}/{}] {}: {} paragraphs, {} terms".format(done, len(futures), year, n_docs, n_terms))
+            except Exception:
+                logging.exception("[{}/{}] {} failed".format(done, len(futures), year))
+                failed.add(year)
+    return failed
+
+
+class SearchIndex:
+    '''Query the per-year segments written by build(). A query is one or
+    more whitespace-separated terms, each a lemma ("land") or lemma/POS
+    ("land/NOUN"); several terms are matched as a phrase.
+    '''
+    def __init__(self, root):
+        self.root = root
+        self.segments = {}
+        self.years = sorted(int(m.group(1)) for m in
+                            (re.match(r"(\d{4})\.keys\.npy$", fn) for fn in os.listdir(root)) if m)
+
+    def segment(self, year):
+        if year not in self.segments:
+            self.segments[year] = Segment(self.root, year)
+        return self.segments[year]
+
+    def in_range(self, start_date=None, end_date=None):
+        return [y for y in self.years
+                if (start_date is None or y >= int(start_date[:4]))
+                and (end_date is None or y <= int(end_date[:4]))]
+
+    def matches(self, query, start_date=None, end_date=None):
+        '''(year, doc ids, counts) for each year with matches.
+        '''
+        terms = query.split()
+        if not terms:
+            return
+        for year in self.in_range(start_date, end_date):
+            seg = self.segment(year)
+            docs, counts = seg.match(terms)
+            mask = seg.select(docs, start_date, end_date)
+            if mask.any():
+                yield year, docs[mask], counts[mask]
+
+    def search(self, query, start_date=None, end_date=None):
+        '''Matching paragraph URIs, in date order, with their match counts.
+        '''
+        for year, docs, counts in self.matches(query, start_date, end_date):
+            uris = self.segment(year).uris[docs]
+            for uri, count in zip(uris.tolist(), counts.tolist()):
+                yield uri.decode("utf-8"), count
+
+    def timeline(self, query, start_date=None, end_date=None):
+        '''Paragraphs matched and total matches per year, as
+        [(year, paragraphs, matches)].
+        '''
+        return [(year, len(docs), int(counts.sum()))
+                for year, docs, counts in self.matches(query, start_date, end_date)]
+
+
+@click.group()
+def main():
+    '''Positional inverted index over the tagged corpus.
+    '''
+
+
+@main.command()
+@click.argument('input_filepath', default=os.path.join(project_dir, "data/processed/spacy-para-lemma-tag_1923-2015"), type=click.Path(exists=True))
+@click.argument('output_dirpath', default=os.path.join(project_dir, "data/processed/search"), type=click.Path())
+@click.option('--workers', default=multiprocessing.cpu_count(), help="Number of indexing processes.")
+def index(input_filepath, output_dirpath, workers):
+    '''Index new and changed years of a tagged corpus.
+    '''
+    failed = build(input_filepath, output_dirpath, workers)
+    if failed:
+        logging.error("Finished with failures in: {}".format(", ".join(str(y) for y in sorted(failed))))
+        sys.exit(1)
+
+
+@main.command()
+@click.argument('query')
+@click.argument('index_dirpath', default=os.path.join(project_dir, "data/processed/search"), type=click.Path(exists=True))
+@click.option('--start-date', help="YYYY-MM-DD")
+@click.option('--end-date', help="YYYY-MM-DD")
+@click.option('--limit', default=20, help="Number of paragraph URIs to list; 0 for none.")
+def query(query, index_dirpath, start_date, end_date, limit):
+    '''Matches per year for a lemma, lemma/POS or phrase, then the first
+    matching paragraphs.
+    '''
+    idx = SearchIndex(index_dirpath)
+    total = 0
+    for year, n_docs, n_hits in idx.timeline(query, start_date, end_date):
+        click.echo("{} {:>8,} paragraphs {:>8,} matches".format(year, n_docs, n_hits))
+        total += n_hits
+    click.echo("Total: {:,} matches".format(total))
+    for i, (uri, count) in enumerate(idx.search(query, start_date, end_date)):
+        if i >= limit:
+            break
+        click.echo("{} {}".format(uri, count))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
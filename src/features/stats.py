@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import csv
+import json
+import click
+import hashlib
+import logging
+import numpy as np
+from array import array
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+TERMS = os.path.join(os.path.dirname(__file__), "dail_terms.csv")
+COLUMNS = ["tokens", "en", "ga", "other"]
+SENTENCES = ["sentences", "en_sentences", "ga_sentences", "other_sentences"]
+
+
+# Row-level string columns stored as codes into a table of their values
+CODED = {"speaker": "speakers", "section": "sections", "heading": "headings"}
+ROWS = ["date", "uri", "speaker", "section", "heading"] + COLUMNS + SENTENCES
+
+
+class ParagraphStats:
+    '''Per-paragraph statistics gathered while extracting the English text:
+    uri, sitting date, speaker, debate section and heading, and the number
+    of tokens and of sentences in the paragraph, split into English, Irish
+    and other languages.
+    '''
+    def __init__(self):
+        self.uris = []
+        self.dates = []
+        self.speakers = []
+        self.sections = []
+        self.headings = []
+        self.counts = array("I")
+
+    def __len__(self):
+        return len(self.dates)
+
+    def add(self, paragraph, sentences):
+        '''Record one Paragraph from its (sentence, language) pairs.
+        '''
+        en = ga = other = n_en = n_ga = n_other = 0
+        for sentence, lang in sentences:
+            n = len(sentence.split())
+            if lang == "en":
+                en += n
+                n_en += 1
+            elif lang == "ga":
+                ga += n
+                n_ga += 1
+            else:
+                other += n
+                n_other += 1
+        self.uris.append(paragraph.uri)
+        self.dates.append(paragraph.date)
+        self.speakers.append(paragraph.speaker)
+        self.sections.append(paragraph.section)
+        self.headings.append(paragraph.heading)
+        self.counts.extend((en + ga + other, en, ga, other, n_en + n_ga + n_other, n_en, n_ga, n_other))
+
+    def columns(self):
+        d = {"date": np.array(self.dates, dtype="datetime64[D]"),
+             "uri": np.array(self.uris, dtype="S")}
+        for k, values in [("speaker", self.speakers), ("section", self.sections), ("heading", self.headings)]:
+            d[CODED[k]], codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+            d[k] = codes.astype(np.int32)
+        counts = np.frombuffer(self.counts, dtype=np.uint32).reshape(-1, len(COLUMNS + SENTENCES))
+        for i, c in enumerate(COLUMNS + SENTENCES):
+            d[c] = counts[:, i].astype(np.int32)
+        return d
+
+    def save(self, path):
+        save_columns(path, self.columns())
+
+
+def save_columns(path, d):
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        np.savez(f, **d)
+    os.replace(tmp, path)
+
+
+def load_columns(path, keys=None):
+    '''Columns of a stats file, or only the given ones. Coded columns
+    bring their value tables with them.
+    '''
+    with np.load(path) as d:
+        if keys is None:
+            keys = d.files
+        else:
+            keys = [k for k in d.files if k in set(keys) | {CODED[c] for c in keys if c in CODED}]
+        return {k: d[k] for k in keys}
+
+
+def concat_columns(parts):
+    '''Concatenate column dicts, remapping each part's speaker, section and
+    heading codes onto their combined value tables, and stable-sort the rows
+    by date. Only the columns present in every part are kept.
+    '''
+    parts = [p for p in parts if len(p["date"])]
+    if not parts:
+        return ParagraphStats().columns()
+    keys = [k for k in ROWS if all(k in p for p in parts)]
+    d = {}
+    for k in keys:
+        if k in CODED:
+            table = np.unique(np.concatenate([p[CODED[k]] for p in parts]))
+            d[k] = np.concatenate([np.searchsorted(table, p[CODED[k]])[p[k]] for p in parts]).astype(np.int32)
+            d[CODED[k]] = table
+        else:
+            d[k] = np.concatenate([p[k] for p in parts])
+    order = np.argsort(d["date"], kind="stable")
+    for k in keys:
+        d[k] = d[k][order]
+    return d
+
+
+def year_stats_path(root, year):
+    return os.path.join(root, "{}.stats.npz".format(year))
+
+
+def write_year_stats(root, year, part_paths, replaced=None):
+    '''Merge the stats of a year's extraction parts into the corpus's
+    <year>.stats.npz, keeping the rows of dates that were not replaced.
+    '''
+    parts = [load_columns(p) for p in part_paths]
+    path = year_stats_path(root, year)
+    if replaced is not None and os.path.exists(path):
+        old = load_columns(path)
+        keep = ~np.isin(old["date"], np.array(sorted(replaced), dtype="datetime64[D]"))
+        for k in ROWS:
+            if k in old:
+                old[k] = old[k][keep]
+        parts.insert(0, old)
+    save_columns(path, concat_columns(parts))
+
+
+class DailTerms:
+    '''Start and end dates of each Dáil, from the static table shipped in
+    dail_terms.csv.
+    '''
+    def __init__(self, path=TERMS):
+        with open(path) as f:
+            rows = list(csv.DictReader(f))
+        self.numbers = np.array([int(r["house_num"]) for r in rows])
+        self.starts = np.array([r["start_term"] for r in rows], dtype="datetime64[D]")
+        self.ends = np.array([r["end_term"] for r in rows], dtype="datetime64[D]")
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def dates(self, house_num):
+        i = np.flatnonzero(self.numbers == house_num)
+        if not len(i):
+            raise KeyError("No Dáil {}".format(house_num))
+        return str(self.starts[i[0]]), str(self.ends[i[0]])
+
+    def lookup(self, dates):
+        '''Index into the table of the term containing each date, or -1.
+        '''
+        i = np.searchsorted(self.starts, dates, side="right") - 1
+        ok = (i >= 0) & (dates <= self.ends[np.maximum(i, 0)])
+        return np.where(ok, i, -1)
+
+
+class StatsStore:
+    '''Columnar per-paragraph statistics for the whole corpus, one .npy
+    file per column, sorted by date and memory-mapped on load:
+    - date.npy: sitting date as datetime64[D].
+    - speaker.npy: index into speakers.txt.
+    - tokens.npy, en.npy, ga.npy, other.npy: token counts.
+    - meta.json: number of rows and a hash of the per-year stats files it
+      was built from.
+    Aggregates over a date range, year, Dáil term or speaker are a binary
+    search on the dates and a bincount over the slice.
+    '''
+    def __init__(self, root, terms=None):
+        self.root = root
+        with open(os.path.join(root, "meta.json")) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(root, "speakers.txt"), encoding="utf-8") as f:
+            self.speakers = np.array(f.read().split("\n")[:self.meta["n_speakers"]], dtype=object)
+        self.columns = {c: np.load(os.path.join(root, c + ".npy"), mmap_mode="r")
+                        for c in ["date", "speaker"] + COLUMNS}
+        self.terms = terms or DailTerms()
+
+    def __len__(self):
+        return self.meta["n_rows"]
+
+    @classmethod
+    def build(cls, corpus_path, root):
+        '''Combine the per-year stats files written by the extraction stage.
+        '''
+        if not os.path.exists(root):
+            os.makedirs(root)
+        paths = stats_paths(corpus_path)
+        d = concat_columns([load_columns(p, ["date", "speaker"] + COLUMNS) for _, p in paths])
+        for k in ["date", "speaker"] + COLUMNS:
+            np.save(os.path.join(root, k + ".npy"), d[k])
+        with open(os.path.join(root, "speakers.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(d["speakers"].tolist()))
+        with open(os.path.join(root, "meta.json"), "w") as f:
+            json.dump({"source": os.path.abspath(corpus_path), "source_hash": stats_hash(paths),
+                       "n_rows": len(d["date"]), "n_speakers": len(d["speakers"]),
+                       "years": [y for y, _ in paths]}, f, indent=1)
+        logging.info("Built statistics for {} paragraphs by {} speakers".format(len(d["date"]), len(d["speakers"])))
+        return cls(root)
+
+    @classmethod
+    def load_or_build(cls, corpus_path, root):
+        meta = os.path.join(root, "meta.json")
+        if os.path.exists(meta):
+            with open(meta) as f:
+                if json.load(f)["source_hash"] == stats_hash(stats_paths(corpus_path)):
+                    return cls(root)
+            logging.info("Statistics in {} are out of date".format(root))
+        return cls.build(corpus_path, root)
+
+    def span(self, start_date=None, end_date=None):
+        '''Row range for start_date <= date <= end_date.
+        '''
+        dates = self.columns["date"]
+        lo = 0 if start_date is None else np.searchsorted(dates, np.datetime64(start_date, "D"), side="left")
+        hi = len(dates) if end_date is None else np.searchsorted(dates, np.datetime64(end_date, "D"), side="right")
+        return slice(int(lo), int(hi))
+
+    def total(self, column="tokens", start_date=None, end_date=None):
+        return int(self.columns[column][self.span(start_date, end_date)].sum(dtype=np.int64))
+
+    def dail(self, house_num, column="tokens"):
+        '''Total of a column over one Dáil term.
+        '''
+        return self.total(column, *self.terms.dates(house_num))
+
+    def keys(self, by, rows):
+        '''Group keys and labels for rows, by "year", "term" or "speaker".
+        '''
+        if by == "year":
+            years = self.columns["date"][rows].astype("datetime64[Y]").astype(int) + 1970
+            first = int(years[0]) if len(years) else 0
+            last = int(years[-1]) if len(years) else -1
+            return years - first, np.arange(first, last + 1)
+        if by == "term":
+            i = self.terms.lookup(self.columns["date"][rows])
+            return np.where(i < 0, len(self.terms), i), np.append(self.terms.numbers, -1)
+        if by == "speaker":
+            return self.columns["speaker"][rows], self.speakers
+        raise ValueError("Unknown grouping: {}".format(by))
+
+    def group(self, by, column="tokens", start_date=None, end_date=None):
+        '''Sum a column per year, Dáil term or speaker as (labels, sums),
+        dropping empty groups. Dates outside every term are labelled -1.
+        '''
+        rows = self.span(start_date, end_date)
+        keys, labels = self.keys(by, rows)
+        sums = np.bincount(keys, weights=self.columns[column][rows], minlength=len(labels))
+        nonzero = np.flatnonzero(sums)
+        return labels[nonzero], sums[nonzero].astype(np.int64)
+
+    def top(self, by, column="tokens", n=20, start_date=None, end_date=None):
+        labels, sums = self.group(by, column, start_date, end_date)
+        order = np.argsort(-sums, kind="stable")[:n]
+        return list(zip(labels[order].tolist(), sums[order].tolist()))
+
+
+def stats_paths(corpus_path):
+    paths = []
+    for fn in os.listdir(corpus_path):
+        m = re.match(r"(\d{4})\.stats\.npz$", fn)
+        if m:
+            paths.append((int(m.group(1)), os.path.join(corpus_path, fn)))
+    return sorted(paths)
+
+
+def stats_hash(paths):
+    h = hashlib.sha1()
+    for year, path in paths:
+        st = os.stat(path)
+        h.update("{} {} {}\n".format(year, st.st_size, st.st_mtime_ns).encode("utf-8"))
+    return h.hexdigest()
+
+
+@click.command()
+@click.argument('input_filepath', default=os.path.join(project_dir, "data/interim/english"), type=click.Path(exists=True))
+@click.argument('output_dirpath', default=os.path.join(project_dir, "data/processed/stats"), type=click.Path())
+@click.option('--by', type=click.Choice(["year", "term", "speaker"]), default="term")
+@click.option('--column', type=click.Choice(COLUMNS), default="tokens")
+@click.option('--dail', type=int, help="Restrict to one Dáil term.")
+@click.option('--start-date', help="YYYY-MM-DD")
+@click.option('--end-date', help="YYYY-MM-DD")
+@click.option('--top', default=0, help="Only show the largest N groups.")
+def main(input_filepath, output_dirpath, by, column, dail, start_date, end_date, top):
+    '''Token counts from the extraction stage, grouped by year, Dáil term
+    or speaker.
+    '''
+    store = StatsStore.load_or_build(input_filepath, output_dirpath)
+    if dail is not None:
+        start_date, end_date = store.terms.dates(dail)
+        click.echo("Dáil: {}\nStart date: {}\nEnd date: {}".format(dail, start_date, end_date))
+    if top:
+        rows = store.top(by, column, top, start_date, end_date)
+    else:
+        rows = zip(*[a.tolist() for a in store.group(by, column, start_date, end_date)])
+    for label, value in rows:
+        click.echo("{:<40} {:>15,}".format(str(label), value))
+    click.echo("Total: {:,}".format(store.total(column, start_date, end_date)))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import click
+import logging
+import numpy as np
+from src.data.manifest import digest
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+ALPHA, STOP = 1, 2
+ENTRY = re.compile(r"(\d{4}-\d{2}-\d{2})\.([0-9a-f]+)\.npz$")
+
+
+class CachedSitting:
+    '''spaCy's analysis of one sitting, packed into arrays:
+    - uris: each paragraph's URI.
+    - paragraphs: token offset of each paragraph, plus the end.
+    - lemmas, tags: the sitting's distinct lemma and POS strings.
+    - lemma, pos: per token, an index into lemmas and tags.
+    - flags: per token, ALPHA | STOP.
+    - sentences: token offset of each sentence start, if the pipeline
+      that tagged it marked sentences.
+    '''
+    def __init__(self, d):
+        self.uris = d["uris"]
+        self.paragraphs = d["paragraphs"]
+        self.lemmas = d["lemmas"]
+        self.tags = d["tags"]
+        self.lemma = d["lemma"]
+        self.pos = d["pos"]
+        self.flags = d["flags"]
+        self.sentences = d["sentences"]
+        self.has_sentences = bool(d["has_sentences"])
+
+    def __len__(self):
+        return len(self.uris)
+
+    def columns(self):
+        return {"uris": self.uris, "paragraphs": self.paragraphs, "lemmas": self.lemmas, "tags": self.tags,
+                "lemma": self.lemma, "pos": self.pos, "flags": self.flags, "sentences": self.sentences,
+                "has_sentences": np.array(self.has_sentences)}
+
+    def save(self, path):
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez(f, **self.columns())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as d:
+            return cls({k: d[k] for k in d.files})
+
+    def keep(self, pos=None):
+        '''Mask of alphabetic, non-stopword tokens, with a POS in pos if
+        given.
+        '''
+        keep = ((self.flags & ALPHA) > 0) & ((self.flags & STOP) == 0)
+        if pos is not None:
+            keep &= np.isin(self.tags, list(pos))[self.pos]
+        return keep
+
+    def spans(self, token_type):
+        '''(paragraph index, first token, end token) of each output line:
+        one per paragraph, or one per sentence.
+        '''
+        para = np.arange(len(self.uris))
+        if token_type == "para":
+            return para, self.paragraphs[:-1], self.paragraphs[1:]
+        if not self.has_sentences:
+            raise ValueError("Sitting was tagged without sentence boundaries")
+        starts = self.sentences.astype(np.int64)
+        owner = np.searchsorted(self.paragraphs, starts, side="right") - 1
+        ends = np.append(starts[1:], self.paragraphs[-1])
+        ends = np.minimum(ends, self.paragraphs[owner + 1])
+        return owner, starts, ends
+
+    def lines(self, token_type="para", pos=None):
+        '''The lines TextPipeline writes for this sitting: "uri: lemma/POS
+        ..." per paragraph or per sentence.
+        '''
+        keep = self.keep(pos)
+        combo = self.lemma[keep].astype(np.int64) * len(self.tags) + self.pos[keep]
+        labels, inverse = np.unique(combo, return_inverse=True)
+        labels = np.array(["{}/{}".format(self.lemmas[c // len(self.tags)], self.tags[c % len(self.tags)])
+                           for c in labels.tolist()], dtype=object)
+        terms = labels[inverse.ravel()].tolist()
+        kept = np.concatenate(([0], np.cumsum(keep)))
+        owner, starts, ends = self.spans(token_type)
+        uris = self.uris.astype(str).tolist()
+        return ["{}: {}\n".format(uris[p], " ".join(terms[lo:hi]))
+                for p, lo, hi in zip(owner.tolist(), kept[starts].tolist(), kept[ends].tolist())]
+
+    def tokens(self, token_type="sent", pos=None):
+        '''Lemma lists per sentence or paragraph, keeping alphabetic
+        non-stopwords, as the notebooks build them for gensim.
+        '''
+        keep = self.keep(pos)
+        lemmas = self.lemmas.astype(object)[self.lemma[keep]].tolist()
+        kept = np.concatenate(([0], np.cumsum(keep)))
+        _, starts, ends = self.spans(token_type)
+        return [lemmas[lo:hi] for lo, hi in zip(kept[starts].tolist(), kept[ends].tolist())]
+
+
+class SittingBuilder:
+    '''Collects the spaCy Docs of one sitting's paragraphs into a
+    CachedSitting, keeping only their arrays so the Docs can be dropped.
+    '''
+    def __init__(self):
+        self.uris = []
+        self.arrays = []
+        self.strings = {}
+        self.has_sentences = True
+
+    def add(self, doc, uri):
+        from spacy.attrs import LEMMA, POS, IS_ALPHA, IS_STOP, SENT_START
+        # uint64, so SENT_START's -1 shows up as a large number
+        a = doc.to_array([LEMMA, POS, IS_ALPHA, IS_STOP, SENT_START]).reshape(-1, 5)
+        for h in np.unique(a[:, :2]).tolist():
+            if h not in self.strings:
+                self.strings[h] = doc.vocab.strings[h]
+        self.has_sentences &= doc.has_annotation("SENT_START")
+        self.uris.append(uri)
+        self.arrays.append(a)
+
+    def build(self):
+        a = np.concatenate(self.arrays) if self.arrays else np.zeros((0, 5), dtype=np.uint64)
+        lengths = [len(x) for x in self.arrays]
+        lemmas, lemma = np.unique(a[:, 0], return_inverse=True)
+        tags, pos = np.unique(a[:, 1], return_inverse=True)
+        return CachedSitting({
+            "uris": np.array(self.uris, dtype="S"),
+            "paragraphs": np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))).astype(np.uint32),
+            "lemmas": np.array([self.strings[h] for h in lemmas.tolist()], dtype=str),
+            "tags": np.array([self.strings[h] for h in tags.tolist()], dtype=str),
+            "lemma": lemma.ravel().astype(np.uint32),
+            "pos": pos.ravel().astype(np.uint8),
+            "flags": (a[:, 2] * ALPHA + a[:, 3] * STOP).astype(np.uint8),
+            "sentences": (np.flatnonzero(a[:, 4] == 1).astype(np.uint32) if self.has_sentences
+                          else np.array([], dtype=np.uint32)),
+            "has_sentences": np.array(self.has_sentences)})
+
+
+class TokenCache:
+    '''Size-bounded disk cache of CachedSittings, one file per sitting in a
+    subdirectory for each tagging configuration, named by sitting date and
+    the digest of the sitting's English text, so edited sittings miss.
+    Reading an entry touches its mtime; when the cache grows past
+    max_bytes, the least recently used entries of every configuration are
+    removed until it is back under 90% of that.
+    '''
+    def __init__(self, root, config, max_bytes=2 << 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.dirpath = os.path.join(root, digest(json.dumps(config, sort_keys=True))[:16])
+        os.makedirs(self.dirpath, exist_ok=True)
+        with open(os.path.join(self.dirpath, "config.json"), "w") as f:
+            json.dump(config, f, indent=1, sort_keys=True)
+        self.size = sum(size for _, _, size in self.entries())
+        self.hits = self.misses = 0
+
+    def entries(self):
+        '''(path, mtime, size) of every entry, in every configuration.
+        '''
+        for dirpath, _, filenames in os.walk(self.root):
+            for fn in filenames:
+                if ENTRY.match(fn):
+                    path = os.path.join(dirpath, fn)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, st.st_mtime, st.st_size
+
+    def path(self, date, source_digest):
+        return os.path.join(self.dirpath, "{}.{}.npz".format(date, source_digest[:16]))
+
+    def get(self, date, source_digest):
+        path = self.path(date, source_digest)
+        try:
+            os.utime(path)
+            sitting = CachedSitting.load(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return sitting
+
+    def put(self, date, source_digest, sitting):
+        for fn in os.listdir(self.dirpath):
+            m = ENTRY.match(fn)
+            if m and m.group(1) == date:
+                self.remove(os.path.join(self.dirpath, fn))
+        path = self.path(date, source_digest)
+        sitting.save(path)
+        self.size += os.path.getsize(path)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def remove(self, path):
+        # another process may have evicted it first
+        try:
+            n = os.path.getsize(path)
+            os.remove(path)
+            self.size -= n
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda e: e[1])
+        self.size = sum(size for _, _, size in entries)
+        removed = 0
+        for path, _, _ in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            self.remove(path)
+            removed += 1
+        logging.info("Evicted {} sittings from the token cache, {:,} bytes left".format(removed, self.size))
+
+
+def load_tokens(input_filepath, start_date, end_date, token_type="sent", model="en_core_web_sm", pos=None,
+                cache_dirpath=os.path.join(project_dir, "data/interim/token_cache"), max_gb=2.0):
+    '''Lemma lists for each sentence (or paragraph) spoken between two
+    dates, from the token cache, tagging and caching any sittings not in
+    it yet.
+    '''
+    from src.features.build_features import TextPipeline
+    start_year, end_year = int(start_date[:4]), int(end_date[:4])
+    pipe = TextPipeline(input_filepath, start_year, end_year, token_type=token_type, model=model,
+                        cache_dirpath=cache_dirpath, cache_gb=max_gb)
+    tokens = []
+    for sitting in pipe.sittings(start_date, end_date):
+        tokens.extend(sitting.tokens(token_type, pos))
+    logging.info("{} sittings from the token cache, {} tagged".format(pipe.cache.hits, pipe.cache.misses))
+    return tokens
+
+
+@click.command()
+@click.argument('start_date')
+@click.argument('end_date')
+@click.argument('input_filepath', default=os.path.join(project_dir, "data/interim/english"), type=click.Path(exists=True))
+@click.argument('cache_dirpath', default=os.path.join(project_dir, "data/interim/token_cache"), type=click.Path())
+@click.option('--model', default="en_core_web_sm", help="spaCy model to tag with.")
+@click.option('--token-type', type=click.Choice(["para", "sent"]), default="sent")
+@click.option('--workers', default=1, help="Number of spaCy processes.")
+@click.option('--max-gb', default=2.0, help="Size the cache is kept under.")
+def main(start_date, end_date, input_filepath, cache_dirpath, model, token_type, workers, max_gb):
+    '''Tag the sittings between START_DATE and END_DATE (YYYY-MM-DD) into
+    the token cache, e.g. ahead of exploring one Dáil term.
+    '''
+    from src.features.build_features import TextPipeline
+    pipe = TextPipeline(input_filepath, int(start_date[:4]), int(end_date[:4]), token_type=token_type,
+                        model=model, workers=workers, cache_dirpath=cache_dirpath, cache_gb=max_gb)
+    n = sum(len(s) for s in pipe.sittings(start_date, end_date))
+    click.echo("{:,} paragraphs: {} sittings cached already, {} tagged; cache holds {:,} bytes".format(
+        n, pipe.cache.hits, pipe.cache.misses, pipe.cache.size))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import cProfile
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Metrics:
+    '''Per-stage timers, item counters, bytes read and written and gauges
+    such as queue depths for one pipeline run.
+
+    Stage times are exclusive: entering a stage pauses the one around it on
+    the same thread, so when a writer consumes a tagger that consumes a
+    reader, each is charged only for its own work and the times add up to
+    the wall time covered. Worker processes keep their own Metrics and
+    send back snapshot(), which the parent merge()s.
+
+    With a path, a JSON line of the current totals is appended at most
+    every `interval` seconds and a summary line on close(). With
+    `profile`, cProfile is switched on for `profile_window` seconds out of
+    every `profile_every`, and the sampled stats are dumped to that path.
+    '''
+    def __init__(self, name, path=None, interval=30.0, profile=None, profile_every=60.0, profile_window=2.0):
+        self.name = name
+        self.path = path
+        self.interval = interval
+        self.start = self.last = time.time()
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.read = defaultdict(int)
+        self.written = defaultdict(int)
+        self.gauges = {}
+        self.peaks = defaultdict(float)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profile = profile
+        self.profile_every = profile_every
+        self.profile_window = profile_window
+        self.profiler = cProfile.Profile() if profile else None
+        self.profiling_until = None
+        self.next_profile = self.start
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def _enter(self, name):
+        now = time.perf_counter()
+        stack = self._stack()
+        if stack:
+            self._charge(stack[-1], now)
+        stack.append([name, now])
+
+    def _exit(self):
+        now = time.perf_counter()
+        stack = self._stack()
+        self._charge(stack.pop(), now)
+        if stack:
+            stack[-1][1] = now
+        self.tick()
+
+    def _charge(self, entry, now):
+        with self.lock:
+            self.times[entry[0]] += now - entry[1]
+
+    @contextmanager
+    def stage(self, name):
+        self._enter(name)
+        with self.lock:
+            self.calls[name] += 1
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def timed(self, name, iterable):
+        '''Yield from iterable, charging the time spent producing each item
+        to the stage.
+        '''
+        it = iter(iterable)
+        while True:
+            self._enter(name)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                self._exit()
+            with self.lock:
+                self.calls[name] += 1
+            yield item
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def bytes_read(self, stage, n):
+        with self.lock:
+            self.read[stage] += n
+
+    def bytes_written(self, stage, n):
+        with self.lock:
+            self.written[stage] += n
+
+    def gauge(self, name, value):
+        '''Record the current value of something like a queue depth; the
+        summary keeps the peak.
+        '''
+        with self.lock:
+            self.gauges[name] = value
+            self.peaks[name] = max(self.peaks[name], value)
+        self.tick()
+
+    def pool(self, name, futures):
+        '''Gauge an executor's unfinished futures: name_in_flight are
+        running or handed to a worker process, name_queued are still waiting
+        for one.
+        '''
+        running = sum(1 for f in futures if f.running())
+        waiting = sum(1 for f in futures if not f.running() and not f.done())
+        self.gauge(name + "_in_flight", running)
+        self.gauge(name + "_queued", waiting)
+
+    def snapshot(self):
+        with self.lock:
+            return {"stages": dict(self.times), "calls": dict(self.calls),
+                    "counters": dict(self.counters), "bytes_read": dict(self.read),
+                    "bytes_written": dict(self.written), "gauges": dict(self.gauges),
+                    "peaks": dict(self.peaks)}
+
+    def merge(self, snapshot):
+        '''Add in the totals from another process's snapshot().
+        '''
+        with self.lock:
+            for key, target in [("stages", self.times), ("calls", self.calls), ("counters", self.counters),
+                                ("bytes_read", self.read), ("bytes_written", self.written)]:
+                for k, v in snapshot.get(key, {}).items():
+                    target[k] += v
+            for k, v in snapshot.get("peaks", {}).items():
+                self.peaks[k] = max(self.peaks[k], v)
+        self.tick()
+
+    def tick(self):
+        now = time.time()
+        if self.profiler is not None:
+            if self.profiling_until is not None and now >= self.profiling_until:
+                self.profiler.disable()
+                self.profiling_until = None
+            elif self.profiling_until is None and now >= self.next_profile:
+                self.profiler.enable()
+                self.profiling_until = now + self.profile_window
+                self.next_profile = now + self.profile_every
+        if self.path and now - self.last >= self.interval:
+            self.last = now
+            self.emit("progress")
+
+    def emit(self, event):
+        record = {"run": self.name, "event": event, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "elapsed": time.time() - self.start, "pid": os.getpid()}
+        record.update(self.snapshot())
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def save_profile(self):
+        if self.profiler is not None:
+            if self.profiling_until is not None:
+                self.profiler.disable()
+                self.profiling_until = None
+            self.profiler.dump_stats(self.profile)
+            logging.info("Wrote profile samples to {}".format(self.profile))
+
+    def close(self):
+        '''Log a run summary, write it as the last JSON line and save any
+        profile samples.
+        '''
+        self.save_profile()
+        elapsed = time.time() - self.start
+        s = self.snapshot()
+        logging.info("{} finished in {:.1f}s".format(self.name, elapsed))
+        total = sum(s["stages"].values()) or 1
+        for stage, secs in sorted(s["stages"].items(), key=lambda kv: -kv[1]):
+            logging.info("  {:<20} {:>10.1f}s {:>6.1%}  {:>10} calls  {:>14,} bytes in  {:>14,} bytes out".format(
+                stage, secs, secs / total, s["calls"].get(stage, 0),
+                s["bytes_read"].get(stage, 0), s["bytes_written"].get(stage, 0)))
+        for name, n in sorted(s["counters"].items()):
+            logging.info("  {:<20} {:>14,} ({:,.0f}/s)".format(name, n, n / (elapsed or 1)))
+        for name, peak in sorted(s["peaks"].items()):
+            logging.info("  {:<20} peak {:,.0f}".format(name, peak))
+        if self.path:
+            self.emit("summary")
+        return s
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import click
+import logging
+import numpy as np
+from src.model.predict_model import NeighbourIndex
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+
+def procrustes(source, target):
+    '''Orthogonal matrix R minimising ||source @ R - target|| for row-aligned
+    matrices of shared words.
+    '''
+    u, _, vt = np.linalg.svd(source.T @ target)
+    return u @ vt
+
+
+def shared(a, b):
+    '''Row indices in a and b of the words two KeyedVectors have in
+    common, and the words themselves.
+    '''
+    words, rows_a, rows_b = np.intersect1d(np.array(a.index_to_key), np.array(b.index_to_key),
+                                           assume_unique=True, return_indices=True)
+    return rows_a, rows_b, words
+
+
+class Drift:
+    '''Semantic drift between consecutive word2vec windows. Each window's
+    unit vectors are rotated onto the previous, already aligned window with
+    orthogonal Procrustes over their shared vocabulary, so every window ends
+    up in the space of the first. The aligned matrices are cached as .npy
+    files next to the neighbour index and memory-mapped on later runs.
+    Drift for a word is the cosine distance between its aligned vectors in
+    two consecutive windows, computed for the whole shared vocabulary at
+    once.
+    '''
+    def __init__(self, index):
+        self.index = index
+        self.windows = index.windows
+        self.cache_dirpath = os.path.join(index.cache_dirpath, "aligned")
+        os.makedirs(self.cache_dirpath, exist_ok=True)
+        self._aligned = {}
+
+    def path(self, i):
+        return os.path.join(self.cache_dirpath, os.path.basename(self.windows[i].model_path) + ".aligned.npy")
+
+    def chain(self):
+        '''What the cached matrices were aligned from: each window's model
+        file and modification time, in order.
+        '''
+        return [[os.path.basename(w.model_path), os.path.getmtime(w.model_path)] for w in self.windows]
+
+    def align(self):
+        meta = os.path.join(self.cache_dirpath, "chain.json")
+        if os.path.exists(meta):
+            with open(meta) as f:
+                cached = json.load(f)
+            if cached == self.chain()[:len(cached)] and all(os.path.exists(self.path(i)) for i in range(len(cached))):
+                start = len(cached)
+            else:
+                start = 0
+        else:
+            start = 0
+        for i in range(start, len(self.windows)):
+            vectors = np.asarray(self.windows[i].kv.vectors, dtype=np.float32)
+            if i > 0:
+                prev, cur = self.windows[i - 1].kv, self.windows[i].kv
+                rows_prev, rows_cur, _ = shared(prev, cur)
+                r = procrustes(vectors[rows_cur], self.aligned(i - 1)[rows_prev])
+                vectors = vectors @ r
+                logging.info("Aligned {} to {} over {} shared words".format(
+                    self.windows[i].label, self.windows[i - 1].label, len(rows_cur)))
+            np.save(self.path(i), vectors.astype(np.float32))
+            self._aligned.pop(i, None)
+            with open(meta, "w") as f:
+                json.dump(self.chain()[:i + 1], f)
+
+    def aligned(self, i):
+        if i not in self._aligned:
+            self._aligned[i] = np.load(self.path(i), mmap_mode="r")
+        return self._aligned[i]
+
+    def scores(self, i, max_rank=None):
+        '''Drift of every word shared by windows i - 1 and i, as (words,
+        distances). max_rank keeps only words among the max_rank most
+        frequent in both windows, since gensim orders each vocabulary by
+        frequency.
+        '''
+        prev, cur = self.windows[i - 1].kv, self.windows[i].kv
+        rows_prev, rows_cur, words = shared(prev, cur)
+        if max_rank is not None:
+            keep = (rows_prev < max_rank) & (rows_cur < max_rank)
+            rows_prev, rows_cur = rows_prev[keep], rows_cur[keep]
+            words = words[keep]
+        a, b = self.aligned(i - 1)[rows_prev], self.aligned(i)[rows_cur]
+        cos = np.einsum("ij,ij->i", a, b) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+        return words, 1 - cos
+
+    def most_changed(self, n=20, max_rank=None):
+        '''The n words with the highest drift for each consecutive pair of
+        windows, as [(from label, to label, [(word, distance), ...]), ...].
+        '''
+        self.align()
+        result = []
+        for i in range(1, len(self.windows)):
+            words, dist = self.scores(i, max_rank)
+            top = np.argsort(-dist, kind="stable")[:n]
+            result.append((self.windows[i - 1].label, self.windows[i].label,
+                           list(zip(words[top].tolist(), dist[top].tolist()))))
+        return result
+
+
+@click.command()
+@click.option('--models', 'model_dirpath', default=os.path.join(project_dir, "models/word2vec"), type=click.Path(exists=True))
+@click.option('--corpus', 'corpus_name', help="Corpus name in the model filenames, if there are several.")
+@click.option('--top', default=20, help="Words to list per period.")
+@click.option('--max-rank', type=int, help="Only consider the N most frequent words of each window.")
+@click.option('--output', type=click.Path(), help="Write the rankings as JSON.")
+def main(model_dirpath, corpus_name, top, max_rank, output):
+    '''Most changed words between consecutive word2vec windows.
+    '''
+    drift = Drift(NeighbourIndex(model_dirpath, corpus_name))
+    result = drift.most_changed(top, max_rank)
+    for a, b, ranked in result:
+        click.echo("{} -> {}: {}".format(a, b, ", ".join("{} ({:.2f})".format(w, d) for w, d in ranked)))
+    if output:
+        with open(output, "w") as f:
+            json.dump([{"from": a, "to": b, "words": ranked} for a, b, ranked in result], f, indent=2)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import click
+import shutil
+import hashlib
+import logging
+import numpy as np
+from array import array
+from src.data.corpus import Corpus
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+TAG_WIDTH = 32
+FLUSH = 1 << 20
+
+
+class EncodedCorpus:
+    '''A tagged corpus encoded once as integer token IDs, for training.
+
+    The directory holds:
+    - vocab.txt: one token per line, where the line number is the token ID.
+    - tokens.u32: every token ID, concatenated.
+    - offsets.i64: where each document starts in tokens.u32, plus a final
+      end offset.
+    - tags.bin: each document's URI as a fixed-width byte string.
+    - meta.json: array lengths, the document range of each year, a hash
+      of the source corpus index and the signature of any phrases joined.
+    The arrays are memory-mapped, so the whole corpus is never loaded.
+    '''
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, "meta.json")) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(root, "vocab.txt"), encoding="utf-8") as f:
+            self.words = np.array(f.read().split("\n")[:self.meta["vocab_size"]], dtype=object)
+        self.tokens = np.memmap(os.path.join(root, "tokens.u32"), dtype=np.uint32, mode="r",
+                                shape=(self.meta["n_tokens"],))
+        self.offsets = np.memmap(os.path.join(root, "offsets.i64"), dtype=np.int64, mode="r",
+                                 shape=(self.meta["n_docs"] + 1,))
+        self.tags = np.memmap(os.path.join(root, "tags.bin"), dtype="S{}".format(TAG_WIDTH), mode="r",
+                              shape=(self.meta["n_docs"],))
+        self.years = {int(y): r for y, r in self.meta["years"].items()}
+
+    @classmethod
+    def build(cls, corpus_path, root, phrases=None):
+        '''Encode every line of a tagged corpus in a single pass, joining
+        the tokens of each phrase into one if given a Phrases.
+        '''
+        if not os.path.exists(root):
+            os.makedirs(root)
+        shutil.rmtree(os.path.join(root, "counts"), ignore_errors=True)
+        corpus = Corpus(corpus_path)
+        vocab = {}
+        ids, offsets, years = array("I"), array("q", [0]), {}
+        n_tokens = 0
+        with open(os.path.join(root, "tokens.u32"), "wb") as tok_f, \
+                open(os.path.join(root, "tags.bin"), "wb") as tag_f:
+            for year in corpus.years():
+                first = len(offsets) - 1
+                for line in corpus.lines(year):
+                    line = line.split()
+                    tag = line[0][:-1].encode("utf-8")
+                    if len(tag) > TAG_WIDTH:
+                        raise ValueError("Tag longer than {} bytes: {}".format(TAG_WIDTH, tag))
+                    tag_f.write(tag.ljust(TAG_WIDTH, b"\0"))
+                    words = line[1:] if phrases is None else phrases.apply(line[1:])
+                    for word in words:
+                        i = vocab.get(word)
+                        if i is None:
+                            i = vocab[word] = len(vocab)
+                        ids.append(i)
+                    n_tokens += len(words)
+                    offsets.append(n_tokens)
+                    if len(ids) >= FLUSH:
+                        ids.tofile(tok_f)
+                        ids = array("I")
+                years[year] = [first, len(offsets) - 1]
+                logging.info("Encoded {}: {} documents, {} tokens so far, vocabulary {}".format(
+                    year, years[year][1] - first, n_tokens, len(vocab)))
+            ids.tofile(tok_f)
+        with open(os.path.join(root, "offsets.i64"), "wb") as f:
+            offsets.tofile(f)
+        with open(os.path.join(root, "vocab.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(sorted(vocab, key=vocab.get)))
+        with open(os.path.join(root, "meta.json"), "w") as f:
+            json.dump({"source": os.path.abspath(corpus_path),
+                       "source_hash": source_hash(corpus),
+                       "phrases": phrases.signature() if phrases is not None else None,
+                       "n_tokens": n_tokens, "n_docs": len(offsets) - 1,
+                       "vocab_size": len(vocab), "years": years}, f, indent=1)
+        return cls(root)
+
+    @classmethod
+    def load_or_build(cls, corpus_path, root, phrases=None):
+        meta = os.path.join(root, "meta.json")
+        if os.path.exists(meta):
+            with open(meta) as f:
+                meta = json.load(f)
+            if meta["source_hash"] == source_hash(Corpus(corpus_path)) and \
+                    meta.get("phrases") == (phrases.signature() if phrases is not None else None):
+                return cls(root)
+            logging.info("Encoded corpus in {} is out of date".format(root))
+        return cls.build(corpus_path, root, phrases)
+
+    def doc_range(self, start_year, end_year):
+        '''Documents for start_year <= year < end_year, as a [lo, hi) range.
+        '''
+        spans = [r for y, r in self.years.items() if start_year <= y < end_year]
+        if not spans:
+            return 0, 0
+        return min(lo for lo, _ in spans), max(hi for _, hi in spans)
+
+    def year_counts(self, year):
+        '''Sparse token frequencies for one year as (ids, counts), counted
+        once and cached under counts/.
+        '''
+        path = os.path.join(self.root, "counts", "{}.npz".format(year))
+        if os.path.exists(path):
+            with np.load(path) as d:
+                return d["ids"], d["counts"]
+        lo, hi = self.years[year]
+        counts = np.bincount(self.tokens[self.offsets[lo]:self.offsets[hi]])
+        ids = np.flatnonzero(counts).astype(np.uint32)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez(f, ids=ids, counts=counts[ids])
+        os.replace(tmp, path)
+        return ids, counts[ids]
+
+    def counts(self, start_year, end_year):
+        '''Token frequencies over a range of years, as a dense array of counts
+        indexed by token ID, merged from the per-year counts.
+        '''
+        counts = np.zeros(len(self.words), dtype=np.int64)
+        for year in self.years:
+            if start_year <= year < end_year:
+                ids, c = self.year_counts(year)
+                counts[ids] += c
+        return counts
+
+    def word_freq(self, start_year, end_year):
+        counts = self.counts(start_year, end_year)
+        nonzero = np.flatnonzero(counts)
+        return dict(zip(self.words[nonzero].tolist(), counts[nonzero].tolist()))
+
+
+class EncodedLines:
+    '''Restartable iterable over a range of years of an EncodedCorpus,
+    yielding token lists, or TaggedDocuments when tagged is True. Token IDs
+    are mapped back to strings a block of documents at a time with a single
+    fancy-indexing operation.
+    '''
+    def __init__(self, encoded, start_year, end_year, tagged=False, block=10000):
+        self.encoded = encoded
+        self.lo, self.hi = encoded.doc_range(start_year, end_year)
+        self.tagged = tagged
+        self.block = block
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    def __iter__(self):
+        enc = self.encoded
+        for start in range(self.lo, self.hi, self.block):
+            stop = min(start + self.block, self.hi)
+            offsets = enc.offsets[start:stop + 1]
+            words = enc.words[enc.tokens[offsets[0]:offsets[-1]]].tolist()
+            bounds = (offsets - offsets[0]).tolist()
+            if self.tagged:
+                from gensim.models.doc2vec import TaggedDocument
+                tags = enc.tags[start:stop]
+                for i in range(stop - start):
+                    yield TaggedDocument(words[bounds[i]:bounds[i + 1]], [tags[i].decode("utf-8")])
+            else:
+                for i in range(stop - start):
+                    yield words[bounds[i]:bounds[i + 1]]
+
+
+def source_hash(corpus):
+    h = hashlib.sha1()
+    for year in corpus.years():
+        for date, digest in sorted(corpus.digests(year).items()):
+            h.update("{} {}\n".format(date, digest).encode("utf-8"))
+    return h.hexdigest()
+
+
+@click.command()
+@click.argument('input_filepath', default=os.path.join(project_dir, "data/processed/spacy-para-lemma-tag_1923-2015"), type=click.Path(exists=True))
+@click.argument('output_dirpath', default=os.path.join(project_dir, "data/processed/encoded"), type=click.Path())
+def main(input_filepath, output_dirpath):
+    EncodedCorpus.build(input_filepath, output_dirpath)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import click
+import logging
+import numpy as np
+
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+MODEL = re.compile(r"word2vec-(.+)_(\d{4})-(\d{4})\.w2v$")
+BLOCK = 256
+
+
+class Window:
+    '''One training window's word vectors, unit-normalised and cached as a
+    KeyedVectors file with the vectors stored separately, so they load
+    memory-mapped.
+    '''
+    def __init__(self, model_path, cache_dirpath):
+        self.model_path = model_path
+        self.corpus, start, end = MODEL.search(os.path.basename(model_path)).groups()
+        self.start, self.end = int(start), int(end)
+        self.cache_path = os.path.join(cache_dirpath, os.path.basename(model_path) + ".kv")
+        self._kv = None
+
+    @property
+    def label(self):
+        return "{}-{}".format(self.start, self.end)
+
+    @property
+    def kv(self):
+        from gensim.models import KeyedVectors
+        if self._kv is None:
+            if not os.path.exists(self.cache_path) or \
+                    os.path.getmtime(self.cache_path) < os.path.getmtime(self.model_path):
+                self.export()
+            self._kv = KeyedVectors.load(self.cache_path, mmap="r")
+        return self._kv
+
+    def export(self):
+        from gensim.models import Word2Vec, KeyedVectors
+        logging.info("Caching normalised vectors for {}".format(self.model_path))
+        wv = Word2Vec.load(self.model_path).wv
+        kv = KeyedVectors(wv.vector_size, dtype=np.float32)
+        kv.add_vectors(wv.index_to_key, wv.get_normed_vectors().astype(np.float32))
+        tmp = "{}.{}.tmp".format(self.cache_path, os.getpid())
+        kv.save(tmp, sep_limit=0)
+        os.replace(tmp + ".vectors.npy", self.cache_path + ".vectors.npy")
+        os.replace(tmp, self.cache_path)
+
+
+class NeighbourIndex:
+    '''Nearest-neighbour queries over every word2vec window in a directory.
+    Windows are opened on first use and stay open, but their vectors are
+    memory-mapped, so keeping all of them available costs little resident
+    memory. Queries are answered for a batch of words at once with one
+    matrix product per window and block of words.
+    '''
+    def __init__(self, model_dirpath, corpus_name=None, cache_dirpath=None):
+        self.cache_dirpath = cache_dirpath or os.path.join(model_dirpath, "index")
+        os.makedirs(self.cache_dirpath, exist_ok=True)
+        windows = [Window(os.path.join(model_dirpath, fn), self.cache_dirpath)
+                   for fn in os.listdir(model_dirpath) if MODEL.search(fn)]
+        self.windows = sorted((w for w in windows if corpus_name is None or w.corpus == corpus_name),
+                              key=lambda w: (w.start, w.end))
+        if len({w.corpus for w in self.windows}) > 1:
+            raise ValueError("Models from several corpora in {}, pass corpus_name".format(model_dirpath))
+
+    def window_neighbours(self, window, words, topn=10):
+        '''{word: [(neighbour, similarity), ...]} for the words in the
+        window's vocabulary.
+        '''
+        kv = window.kv
+        present = [w for w in words if w in kv.key_to_index]
+        result = {}
+        n = min(topn + 1, len(kv.index_to_key))
+        for i in range(0, len(present), BLOCK):
+            block = present[i:i + BLOCK]
+            ids = np.array([kv.key_to_index[w] for w in block])
+            sims = kv.vectors[ids] @ kv.vectors.T
+            sims[np.arange(len(ids)), ids] = -np.inf
+            top = np.argpartition(-sims, n - 1, axis=1)[:, :n]
+            order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+            top = np.take_along_axis(top, order, axis=1)[:, :topn]
+            for word, row, idx in zip(block, sims, top):
+                result[word] = [(kv.index_to_key[j], float(row[j])) for j in idx]
+        return result
+
+    def neighbours(self, words, topn=10):
+        '''Neighbours of each word in every window, as
+        {word: [(window label, [(neighbour, similarity), ...]), ...]}.
+        Windows where a word is missing are left out.
+        '''
+        result = {w: [] for w in words}
+        for window in self.windows:
+            for word, nn in self.window_neighbours(window, words, topn).items():
+                result[word].append((window.label, nn))
+        return result
+
+    def drift(self, words, topn=20):
+        '''Change in each word's neighbourhood between consecutive windows,
+        as 1 - Jaccard overlap of the top-n neighbour sets, returned as
+        {word: [(from label, to label, distance), ...]}. Comparing
+        neighbour sets needs no alignment of the vector spaces.
+        '''
+        result = {w: [] for w in words}
+        previous = None
+        for window in self.windows:
+            current = {w: set(n for n, _ in nn) for w, nn in self.window_neighbours(window, words, topn).items()}
+            if previous is not None:
+                for w in words:
+                    if w in current and w in previous[1]:
+                        a, b = current[w], previous[1][w]
+                        result[w].append((previous[0], window.label, 1 - len(a & b) / len(a | b)))
+            previous = (window.label, current)
+        return result
+
+
+@click.command()
+@click.argument('words', nargs=-1, required=True)
+@click.option('--models', 'model_dirpath', default=os.path.join(project_dir, "models/word2vec"), type=click.Path(exists=True))
+@click.option('--corpus', 'corpus_name', help="Corpus name in the model filenames, if there are several.")
+@click.option('--topn', default=10)
+@click.option('--drift', is_flag=True, help="Report neighbourhood change between consecutive windows instead.")
+def main(words, model_dirpath, corpus_name, topn, drift):
+    '''Nearest neighbours of WORDS in each word2vec window.
+    '''
+    index = NeighbourIndex(model_dirpath, corpus_name)
+    if drift:
+        for word, steps in index.drift(list(words), topn).items():
+            click.echo(word)
+            for a, b, d in steps:
+                click.echo("  {} -> {}: {:.2f}".format(a, b, d))
+        return
+    for word, periods in index.neighbours(list(words), topn).items():
+        click.echo(word)
+        for label, nn in periods:
+            click.echo("  {}: {}".format(label, ", ".join("{} ({:.2f})".format(n, s) for n, s in nn)))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -1,77 +1,237 @@
 # -*- coding: utf-8 -*-
 import os
-import re
+import sys
 import click
+import tempfile
 import logging
-import tarfile
 import multiprocessing
-from dotenv import find_dotenv, load_dotenv
-from gensim.models import Word2Vec, Doc2Vec
-from gensim.models.doc2vec import LabeledSentence
+import numpy as np
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from src.data.corpus import Corpus
+from src.model.encoded_corpus import EncodedCorpus, EncodedLines
+from src.features.ngrams import NgramCounts, Phrases
+from src.metrics import Metrics
+
+project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+
+EXTENSIONS = {"word2vec": "w2v", "doc2vec": "d2v"}
 
 
 class ExtractLines:
-    def __init__(self, dirname, start_year, end_year, model):
+    def __init__(self, dirname, start_year, end_year, model, readers=4, phrases=None):
         self.dirname = dirname
+        self.corpus = Corpus(dirname)
         self.start_year = start_year
         self.end_year = end_year
         self.model = model
+        self.readers = readers
+        self.phrases = phrases
 
     def __iter__(self):
-        with tarfile.open(self.dirname, encoding="utf-8") as tf:
-            for fn in tf:
-                sitting_year = re.search("_(\d{4}).txt",
-                                    fn.name)
-                if fn.name.endswith("txt") and self.start_year <= int(sitting_year.group(1)) < self.end_year:
-                    fileobj = tf.extractfile(fn)
-                    for line in fileobj:
-                        line = line.decode("utf-8").split()
-                        if self.model == "word2vec":
-                            yield line[1:]
-                        else:
-                            yield LabeledSentence(words=line[1:], tags=[line[0][:-1]])
+        from gensim.models.doc2vec import TaggedDocument
+        years = [y for y in self.corpus.years() if self.start_year <= y < self.end_year]
+        for line in self.corpus.iter_years(years, self.readers):
+            line = line.split()
+            words = line[1:] if self.phrases is None else self.phrases.apply(line[1:])
+            if self.model == "word2vec":
+                yield words
+            else:
+                yield TaggedDocument(words=words, tags=[line[0][:-1]])
+
+
+
+def warm_start(model, previous):
+    '''Copy input and output weights for every word the model shares with
+    the previous window's model, so training continues from there and the
+    two vector spaces stay comparable.
+    '''
+    shared = [w for w in model.wv.index_to_key if w in previous.wv.key_to_index]
+    new = [model.wv.key_to_index[w] for w in shared]
+    old = [previous.wv.key_to_index[w] for w in shared]
+    model.wv.vectors[new] = previous.wv.vectors[old]
+    if model.negative and previous.negative:
+        model.syn1neg[new] = previous.syn1neg[old]
+    logging.info("Warm started {} of {} words".format(len(shared), len(model.wv.index_to_key)))
+
+
+def model_filename(kind, corpus_name, start, end):
+    return "{}-{}_{}-{}.{}".format(kind, corpus_name, start, end, EXTENSIONS[kind])
+
+
+def write_corpus_file(encoded, start, end, path):
+    '''Write a window out once in LineSentence format, one document per line,
+    for both trainers to read with corpus_file. Documents left empty by
+    filtering are dropped: gensim skips empty lines without counting them,
+    which would shift every later doc2vec tag. Returns the tags of the
+    documents written, in line order, and the number of tokens.
+    '''
+    lines = EncodedLines(encoded, start, end)
+    sizes = np.diff(encoded.offsets[lines.lo:lines.hi + 1])
+    with open(path, "w", encoding="utf-8") as f:
+        for words in lines:
+            if words:
+                f.write(" ".join(words))
+                f.write("\n")
+    tags = encoded.tags[lines.lo:lines.hi][sizes > 0]
+    return tags, int(sizes.sum())
+
 
+def model_class(kind):
+    from gensim.models import Word2Vec, Doc2Vec
+    return {"word2vec": Word2Vec, "doc2vec": Doc2Vec}[kind]
+
+
+def train_model(kind, corpus_file, word_freq, n_docs, n_tokens, workers, previous=None):
+    m = model_class(kind)(workers=workers)
+    if kind == "doc2vec":
+        # corpus_file documents are tagged with their line number; declaring
+        # the tags up front saves doc2vec its own vocabulary scan
+        m.dv.index_to_key = list(range(n_docs))
+    m.build_vocab_from_freq(word_freq, corpus_count=n_docs)
+    if previous is not None:
+        warm_start(m, model_class("word2vec").load(previous))
+    m.train(corpus_file=corpus_file, total_words=n_tokens, total_examples=n_docs, epochs=m.epochs)
+    return m
+
+
+def train_window(encoded_root, output_filepath, corpus_name, start, end, workers, kinds=("word2vec", "doc2vec"), previous=None):
+    '''Train and save the models for one window from a single pass over its
+    documents, running word2vec and doc2vec side by side with the workers
+    split between them. Returns the path of the saved word2vec model and a
+    metrics snapshot.
+    '''
+    metrics = Metrics("train")
+    encoded = EncodedCorpus(encoded_root)
+    fd, corpus_file = tempfile.mkstemp(suffix=".txt", dir=output_filepath)
+    os.close(fd)
+    try:
+        with metrics.stage("corpus_file"):
+            tags, n_tokens = write_corpus_file(encoded, start, end, corpus_file)
+        n_docs = len(tags)
+        metrics.bytes_written("corpus_file", os.path.getsize(corpus_file))
+        metrics.count("documents", n_docs)
+        metrics.count("tokens", n_tokens)
+        with metrics.stage("vocab"):
+            word_freq = encoded.word_freq(start, end)
+        shares = [workers // len(kinds) + (i < workers % len(kinds)) for i in range(len(kinds))]
+        with ThreadPoolExecutor(max_workers=len(kinds)) as executor:
+            futures = {kind: executor.submit(train_model, kind, corpus_file, word_freq, n_docs, n_tokens,
+                                             max(1, share), previous if kind == "word2vec" else None)
+                       for kind, share in zip(kinds, shares)}
+            saved = {}
+            for kind, future in futures.items():
+                path = os.path.join(output_filepath, model_filename(kind, corpus_name, start, end))
+                with metrics.stage("train"):
+                    m = future.result()
+                with metrics.stage("save"):
+                    m.save(path)
+                saved[kind] = path
+                logging.info("Saved: {}".format(os.path.basename(path)))
+    finally:
+        os.remove(corpus_file)
+    if "doc2vec" in saved:
+        # One tag per trained document vector, in the same order
+        with open(saved["doc2vec"] + ".tags", "w", encoding="utf-8") as f:
+            f.writelines(tag.decode("utf-8") + "\n" for tag in tags)
+    metrics.count("windows")
+    return saved.get("word2vec"), metrics.snapshot()
 
 
 @click.command()
 @click.argument('start_year', default = 1920)
 @click.argument('end_year', default = 2001)
 @click.argument('interval', default=5)
-@click.argument('model', default="word2vec")
-@click.argument('input_filepath', default="../../data/processed/poly-pos-para_1922-2016.tar.gz", type=click.Path(exists=True))
-@click.argument('output_filepath', default="../../models/word2vec", type=click.Path())
-def main(input_filepath, output_filepath, start_year, end_year, interval, model):
+@click.argument('model', default="both", type=click.Choice(["both", "word2vec", "doc2vec"]))
+@click.argument('input_filepath', default=os.path.join(project_dir, "data/processed/spacy-para-lemma-tag_1923-2015"), type=click.Path(exists=True))
+@click.argument('output_filepath', default=os.path.join(project_dir, "models/word2vec"), type=click.Path())
+@click.option('--encoded', type=click.Path(), default=None,
+              help="Encoded corpus cache, built if missing or stale (default: <input_filepath>[.phrases].encoded).")
+@click.option('--workers', default=multiprocessing.cpu_count(), help="Total training threads.")
+@click.option('--parallel', default=None, type=int,
+              help="Windows to train at once, sharing --workers between them (default: one per 4 cores).")
+@click.option('--warm-start/--cold-start', default=False,
+              help="Initialise each window from the previous window's word vectors; windows then train in order.")
+@click.option('--phrases', 'phrases_dirpath', type=click.Path(exists=True),
+              help="N-gram counts from src/features/ngrams.py; join the phrases they score above --phrase-threshold.")
+@click.option('--phrase-threshold', default=10.0)
+@click.option('--metrics', 'metrics_path', type=click.Path(), help="Append progress and a run summary here as JSON lines.")
+@click.option('--profile', type=click.Path(), help="Write sampled cProfile stats for the main process here.")
+@click.option('--dry-run', is_flag=True, help="List the windows that would be trained and exit.")
+def main(input_filepath, output_filepath, start_year, end_year, interval, model, encoded, workers, parallel, warm_start,
+         phrases_dirpath, phrase_threshold, metrics_path, profile, dry_run):
     logger = logging.getLogger(__name__)
     logger.info('making final data set from raw data')
+    corpus_name = os.path.basename(os.path.normpath(input_filepath))
+    windows = [(decade, decade+19) for decade in range(start_year, end_year, interval)]
+    kinds = ("word2vec", "doc2vec") if model == "both" else (model,)
+    if dry_run:
+        for start, end in windows:
+            click.echo("{}-{}: {}".format(start, end, ", ".join(model_filename(k, corpus_name, start, end) for k in kinds)))
+        return
     if not os.path.exists(output_filepath):
         os.makedirs(output_filepath)
+    metrics = Metrics("train", metrics_path, profile=profile)
+    phrases = None
+    if phrases_dirpath:
+        with metrics.stage("phrases"):
+            phrases = Phrases(NgramCounts(phrases_dirpath), threshold=phrase_threshold)
+    with metrics.stage("encode"):
+        encoded = EncodedCorpus.load_or_build(
+            input_filepath, encoded or os.path.normpath(input_filepath) + (".phrases" if phrases else "") + ".encoded",
+            phrases)
     logging.info("Start year: {}, End year: {}, Interval: {} years".format(start_year, end_year, interval))
-    for decade in range(start_year, end_year, interval):
-        logging.info("Training model for period from {} to {}".format(decade, decade+19))
-        lines = ExtractLines(input_filepath, decade, decade+19, model)
-        for model in [(Word2Vec, "word"), (Doc2Vec, "doc")]:
-            m = model[0](lines, workers=cores)
-            name = model[1]
-            fn = input_filepath.split("/")[-1].split(".")[0]
-            filename = "{}-spacy-pos-lemma_{}-{}.{}2v".format(name, fn, decade, decade+19, name[1])
-            m.save(os.path.join(output_filepath, filename))
-            logging.info("Saved: {}".format(filename))
-    logging.info("Finished")
 
+    # count each year once up front so the windows only merge counts
+    with metrics.stage("count"):
+        for year in encoded.years:
+            encoded.year_counts(year)
+
+    if warm_start:
+        previous = None
+        for start, end in windows:
+            logging.info("Training model for period from {} to {}".format(start, end))
+            previous, snapshot = train_window(encoded.root, output_filepath, corpus_name, start, end, workers, kinds, previous)
+            metrics.merge(snapshot)
+        metrics.close()
+        logging.info("Finished")
+        return
+
+    parallel = min(len(windows), parallel or max(1, workers // 4))
+    per_window = max(1, workers // parallel)
+    logging.info("Training {} windows, {} at a time with {} workers each".format(len(windows), parallel, per_window))
+    failed = []
+    with ProcessPoolExecutor(max_workers=parallel) as executor:
+        futures = {executor.submit(train_window, encoded.root, output_filepath, corpus_name, start, end, per_window, kinds): (start, end)
+                   for start, end in windows}
+        metrics.pool("windows", futures)
+        for done, future in enumerate(as_completed(futures), 1):
+            start, end = futures[future]
+            metrics.pool("windows", futures)
+            try:
+                _, snapshot = future.result()
+                metrics.merge(snapshot)
+                logging.info("[{}/{}] Trained period from {} to {}".format(done, len(futures), start, end))
+            except Exception:
+                logging.exception("[{}/{}] Period from {} to {} failed".format(done, len(futures), start, end))
+                failed.append((start, end))
+    if failed:
+        logging.error("Finished with failures in: {}".format(", ".join("{}-{}".format(*w) for w in failed)))
+        metrics.close()
+        sys.exit(1)
+    metrics.close()
+    logging.info("Finished")
 
 
 if __name__ == '__main__':
     now = datetime.now()
-    logfile = "logs/train_word2vec_model_{}.log".format(now.strftime("%Y-%m-%dT%H-%M"))
+    logfile = os.path.join(project_dir, "logs", "train_word2vec_model_{}.log".format(now.strftime("%Y-%m-%dT%H-%M")))
+    os.makedirs(os.path.dirname(logfile), exist_ok=True)
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(filename=logfile, level=logging.INFO, format=log_fmt)
-    cores = multiprocessing.cpu_count()
-    # not used in this stub but often useful for finding various files
-    project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
-
     # find .env automagically by walking up directories until it's found, then
     # load up the .env entries as environment variables
+    from dotenv import find_dotenv, load_dotenv
     load_dotenv(find_dotenv())
 
     main()
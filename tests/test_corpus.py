@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+from src.data.corpus import Corpus
+
+
+def lines(date, sitting, n):
+    return ["{}/{}: sitting {} paragraph {}\n".format(date, i, sitting, i) for i in range(n)]
+
+
+def test_lines_and_select_read_back_what_was_written(tmp_path):
+    corpus = Corpus(str(tmp_path))
+    written = lines("1980-01-10", "a", 3) + lines("1980-02-11", "b", 2)
+    corpus.write_year(1980, iter(written))
+    assert list(corpus.lines(1980)) == written
+    assert list(corpus.lines(1980, {"1980-02-11"})) == written[3:]
+    assert [e[0] for _, e in corpus.select("1980-02-01", "1980-12-31")] == ["1980-02-11"]
+    assert Corpus(str(tmp_path)).index == corpus.index
+
+
+def test_splice_replaces_whole_dates_with_several_sittings(tmp_path):
+    corpus = Corpus(str(tmp_path))
+    first, second, third = "1980-01-10", "1980-02-11", "1980-03-12"
+    # Two sittings on the second date
+    corpus.write_year(1980, iter(lines(first, "a", 2) + lines(second, "b", 3) + lines(second, "c", 4) +
+                                 lines(third, "d", 2)))
+    old = {e[0]: e for e in corpus.entries(1980)}
+
+    replacement = lines(second, "b", 3) + lines(second, "c2", 5)
+    corpus.splice_year(1980, iter(replacement), {second})
+    expected = lines(first, "a", 2) + replacement + lines(third, "d", 2)
+    assert list(corpus.lines(1980)) == expected
+    assert [e[3] for e in corpus.entries(1980)] == [2, 8, 2]
+    # Unchanged members are copied, not recompressed
+    assert corpus.entries(1980)[0][2:] == old[first][2:]
+
+    full = Corpus(str(tmp_path / "full"))
+    full.write_year(1980, iter(expected))
+    assert [e[4] for e in full.entries(1980)] == [e[4] for e in corpus.entries(1980)]
+
+
+def test_splice_inserts_new_dates_and_drops_removed_ones(tmp_path):
+    corpus = Corpus(str(tmp_path))
+    corpus.write_year(1980, iter(lines("1980-01-10", "a", 1) + lines("1980-03-12", "c", 1)))
+    corpus.splice_year(1980, iter(lines("1980-02-11", "b", 2)), {"1980-02-11", "1980-03-12"})
+    assert corpus.dates(1980) == ["1980-01-10", "1980-02-11"]
+
+
+def test_out_of_order_lines_leave_the_shard_untouched(tmp_path):
+    corpus = Corpus(str(tmp_path))
+    corpus.write_year(1980, iter(lines("1980-01-10", "a", 1)))
+    with pytest.raises(ValueError):
+        corpus.write_year(1980, iter(lines("1980-03-12", "b", 1) + lines("1980-02-11", "c", 1)))
+    assert not os.path.exists(corpus.shard_path(1980) + ".tmp")
+    assert list(Corpus(str(tmp_path)).lines(1980)) == lines("1980-01-10", "a", 1)
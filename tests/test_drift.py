@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from src.model.drift import procrustes
+
+
+def test_procrustes_recovers_a_rotation():
+    rng = np.random.RandomState(0)
+    source = rng.randn(200, 10)
+    rotation, _ = np.linalg.qr(rng.randn(10, 10))
+    r = procrustes(source, source @ rotation)
+    assert np.allclose(r, rotation)
+    assert np.allclose(r @ r.T, np.eye(10))
+
+
+def test_procrustes_is_orthogonal_for_noisy_targets():
+    rng = np.random.RandomState(1)
+    source, target = rng.randn(50, 8), rng.randn(50, 8)
+    r = procrustes(source, target)
+    assert np.allclose(r.T @ r, np.eye(8))
+    # No other orthogonal matrix tried does better
+    best = np.linalg.norm(source @ r - target)
+    for _ in range(20):
+        q, _ = np.linalg.qr(rng.randn(8, 8))
+        assert np.linalg.norm(source @ q - target) >= best
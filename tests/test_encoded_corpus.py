@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import os
+from src.data.corpus import Corpus
+from src.model.encoded_corpus import EncodedCorpus, EncodedLines
+
+YEARS = {
+    1980: ["1980-01-10/1: dáil/NOUN vote/NOUN\n", "1980-01-10/2: vote/NOUN\n"],
+    1981: ["1981-02-11/1: budget/NOUN vote/NOUN dáil/NOUN\n"],
+    1982: ["1982-03-12/1: budget/NOUN\n", "1982-03-12/2: \n"],
+}
+
+
+def build(tmp_path):
+    tagged = str(tmp_path / "tagged")
+    for year, lines in YEARS.items():
+        Corpus(tagged).write_year(year, iter(lines))
+    return tagged, EncodedCorpus.build(tagged, str(tmp_path / "encoded"))
+
+
+def test_encoded_lines_read_back_the_tagged_corpus(tmp_path, monkeypatch):
+    tagged, encoded = build(tmp_path)
+    lines = [line for year in sorted(YEARS) for line in YEARS[year]]
+    assert encoded.doc_range(1981, 1983) == (2, 5)
+    assert encoded.doc_range(1990, 2000) == (0, 0)
+    assert list(EncodedLines(encoded, 1980, 1983, block=2)) == [line.split()[1:] for line in lines]
+    docs = list(EncodedLines(encoded, 1981, 1982, tagged=True))
+    assert [(d.words, d.tags) for d in docs] == [(["budget/NOUN", "vote/NOUN", "dáil/NOUN"], ["1981-02-11/1"])]
+
+    # Reused while the tagged corpus is unchanged, rebuilt when it changes
+    built = []
+    monkeypatch.setattr(EncodedCorpus, "build", classmethod(lambda cls, *args: built.append(args)))
+    assert EncodedCorpus.load_or_build(tagged, encoded.root).meta == encoded.meta
+    assert built == []
+    Corpus(tagged).write_year(1983, iter(["1983-01-10/1: motion/NOUN\n"]))
+    EncodedCorpus.load_or_build(tagged, encoded.root)
+    assert built == [(tagged, encoded.root, None)]
+
+
+def test_window_counts_merge_the_cached_year_counts(tmp_path):
+    tagged, encoded = build(tmp_path)
+    assert encoded.word_freq(1980, 1982) == {"dáil/NOUN": 2, "vote/NOUN": 3, "budget/NOUN": 1}
+    assert encoded.word_freq(1981, 1983) == {"dáil/NOUN": 1, "vote/NOUN": 1, "budget/NOUN": 2}
+    assert sorted(os.listdir(os.path.join(encoded.root, "counts"))) == ["1980.npz", "1981.npz", "1982.npz"]
+    # Later windows read the cache instead of the tokens
+    encoded.tokens = None
+    assert encoded.counts(1980, 1983).tolist() == [2, 3, 2]
+
+    EncodedCorpus.build(tagged, encoded.root)
+    assert not os.path.exists(os.path.join(encoded.root, "counts"))
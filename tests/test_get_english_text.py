@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import io
+import gzip
+import random
+from datetime import date
+from zipfile import ZipFile, ZIP_DEFLATED
+from click.testing import CliRunner
+from src.benchmark.fixtures import sitting
+from src.data.get_english_text import main, iter_sitting
+
+PERSONS = ["Deputy{}".format(i) for i in range(10)]
+
+
+def write_archive(path, sittings):
+    '''Zip of (member name, date, seed) sittings.
+    '''
+    with ZipFile(path, "w", ZIP_DEFLATED) as z:
+        for name, day, seed in sittings:
+            xml = sitting(random.Random(seed), day, PERSONS, 12, 0.0, 0.0)
+            z.writestr("dail/{}.xml".format(name), xml.encode("utf-8"))
+
+
+def extract(archive, output):
+    result = CliRunner().invoke(main, ["1980", "1980", str(archive), str(output), "--workers", "1"])
+    assert result.exit_code == 0, result.output
+    with gzip.open(str(output / "1980.txt.gz"), "rt", encoding="utf-8") as f:
+        return f.read()
+
+
+def test_incremental_rebuild_keeps_other_sittings_on_a_changed_date(tmp_path):
+    day, other = date(1980, 3, 4), date(1980, 5, 6)
+    archive = tmp_path / "akn.zip"
+    write_archive(archive, [("AK-dail-1980-03-04", day, 1), ("AK-dail-1980-03-04-2", day, 2),
+                            ("AK-dail-1980-05-06", other, 3)])
+    extract(archive, tmp_path / "incremental")
+
+    # Change one of the two sittings on 1980-03-04
+    write_archive(archive, [("AK-dail-1980-03-04", day, 1), ("AK-dail-1980-03-04-2", day, 4),
+                            ("AK-dail-1980-05-06", other, 3)])
+    incremental = extract(archive, tmp_path / "incremental")
+    assert incremental == extract(archive, tmp_path / "full")
+    assert len(incremental.splitlines()) == 36
+
+
+def test_paragraph_with_newlines_is_one_line():
+    xml = sitting(random.Random(0), date(1980, 1, 1), PERSONS, 3, 0.0, 0.0)
+    xml = xml.replace('<p eId="para_2">', '<p eId="para_2">First line\n  second  line ')
+    paragraphs = list(iter_sitting(io.BytesIO(xml.encode("utf-8"))))
+    assert [p.uri for p in paragraphs] == ["1980-01-01/1", "1980-01-01/2", "1980-01-01/3"]
+    assert paragraphs[1].text.startswith("First line second line ")
+    assert all("\n" not in p.text and "  " not in p.text for p in paragraphs)
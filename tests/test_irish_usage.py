@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import os
+from src.data.get_english_text import Paragraph
+from src.features.stats import ParagraphStats, year_stats_path
+from src.features.irish_usage import update, usage_path, UsageTable
+
+
+def write_stats(corpus, year, rows):
+    stats = ParagraphStats()
+    for i, (speaker, sentences) in enumerate(rows):
+        date = "{}-01-10".format(year)
+        stats.add(Paragraph("{}/{}".format(date, i), date, speaker, "s1", "Heading", ""), sentences)
+    stats.save(year_stats_path(corpus, year))
+
+
+def test_usage_table_follows_the_stats_files(tmp_path):
+    corpus, root = str(tmp_path / "english"), str(tmp_path / "usage")
+    os.makedirs(corpus)
+    write_stats(corpus, 1980, [("#Lynch", [("a b", "en"), ("c", "ga")]),
+                               ("#Lynch", [("d e", "en")]),
+                               ("#deValera", [("tá sé", "ga")])])
+    write_stats(corpus, 1981, [("#Lynch", [("f", "ga")]),
+                               ("#Haughey", [("g h i", "en"), ("j", "en")])])
+    assert update(corpus, root, 1) == set()
+    table = UsageTable(root)
+    assert len(table) == 4
+    speakers, totals, irish, share = table.by_speaker()
+    assert speakers.tolist() == ["#deValera", "#Lynch", "#Haughey"]
+    assert totals.tolist() == [1, 4, 2] and irish.tolist() == [1, 2, 0]
+    assert share.tolist() == [1.0, 0.5, 0.0]
+    years, totals, en, ga = table.by_year("tokens", "#Lynch")
+    assert (years.tolist(), totals.tolist(), en.tolist(), ga.tolist()) == ([1980, 1981], [5, 1], [4, 0], [1, 1])
+    assert table.by_speaker(start_year=1981, end_year=1981)[0].tolist() == ["#Lynch", "#Haughey"]
+
+    # Changed years are recounted and vanished ones dropped
+    write_stats(corpus, 1980, [("#Lynch", [("a", "ga")])])
+    os.remove(year_stats_path(corpus, 1981))
+    write_stats(corpus, 1982, [("#Haughey", [("b", "en")])])
+    assert update(corpus, root, 1) == set()
+    assert not os.path.exists(usage_path(root, 1981))
+    table = UsageTable(root)
+    assert table.columns["year"].tolist() == [1980, 1982]
+    assert table.by_year()[3].tolist() == [1, 0]
+    # and unchanged ones are not
+    mtimes = [os.stat(usage_path(root, y)).st_mtime_ns for y in [1980, 1982]]
+    update(corpus, root, 1)
+    assert [os.stat(usage_path(root, y)).st_mtime_ns for y in [1980, 1982]] == mtimes
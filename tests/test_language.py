@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from src.features.language import TieredDetector, split_sentences
+
+
+def test_split_sentences():
+    assert split_sentences(" One. Two? Three ") == ["One.", "Two?", "Three"]
+
+
+def test_tiered_detector_needs_no_downloads():
+    detector = TieredDetector()
+    languages = detector.languages([
+        "The Minister for Finance is in the Dáil. Tá an tAire sásta leis an gcáin anois.",
+        "The Tánaiste and the Taoiseach were not in the House.",
+    ])
+    assert [lang for _, lang in languages[0]] == ["en", "ga"]
+    assert [lang for _, lang in languages[1]] == ["en"]
+    assert detector.counts["polyglot"] == 0
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from src.data.manifest import Manifest, line_date
+
+
+def test_diff_reports_new_changed_and_removed_keys(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    m = Manifest(path, {"stage": "test"})
+    m.update_year(1980, {"a": "1", "b": "2", "c": "3"})
+    m.save()
+
+    m = Manifest(path, {"stage": "test"})
+    dirty, removed = m.diff(1980, {"a": "1", "b": "changed", "d": "4"})
+    assert dirty == {"b", "d"}
+    assert removed == {"c"}
+    assert m.diff(1981, {"a": "1"}) == ({"a"}, set())
+
+
+def test_config_change_forgets_everything(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    m = Manifest(path, {"stage": "test", "model": 1})
+    m.update_year(1980, {"a": "1"})
+    m.save()
+    assert Manifest(path, {"stage": "test", "model": 1}).years == {"1980": {"a": "1"}}
+    assert Manifest(path, {"stage": "test", "model": 2}).years == {}
+
+
+def test_line_date():
+    assert line_date("1980-01-10/12: text with / slash\n") == "1980-01-10"
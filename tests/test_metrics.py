@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src import metrics as metrics_module
+from src.metrics import Metrics
+
+
+def test_nested_stages_are_charged_exclusively_and_merged(tmp_path, monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(metrics_module.time, "perf_counter", lambda: clock[0])
+    path = str(tmp_path / "logs" / "m.jsonl")
+    metrics = Metrics("test", path)
+
+    def read():
+        for i in range(2):
+            clock[0] += 1
+            yield i
+
+    with metrics.stage("write"):
+        clock[0] += 3
+        for _ in metrics.timed("read", read()):
+            clock[0] += 2
+    worker = Metrics("worker")
+    worker.count("paragraphs", 5)
+    worker.gauge("queue", 4)
+    worker.bytes_written("write", 100)
+    metrics.merge(worker.snapshot())
+    metrics.gauge("queue", 2)
+
+    s = metrics.close()
+    assert s["stages"] == {"write": 7, "read": 2}
+    assert s["calls"] == {"write": 1, "read": 2}
+    assert s["counters"] == {"paragraphs": 5}
+    assert s["bytes_written"] == {"write": 100}
+    assert s["gauges"] == {"queue": 2} and s["peaks"] == {"queue": 4}
+    with open(path) as f:
+        summary = json.loads(f.read().split("\n")[-2])
+    assert summary["event"] == "summary" and summary["stages"] == s["stages"]
+
+
+def test_pool_gauges_count_running_and_waiting_futures():
+    metrics = Metrics("test")
+    started, release = threading.Event(), threading.Event()
+
+    def task():
+        started.set()
+        release.wait()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        futures = [executor.submit(task) for _ in range(3)]
+        started.wait()
+        metrics.pool("tasks", futures)
+        assert metrics.gauges == {"tasks_in_flight": 1, "tasks_queued": 2}
+        release.set()
+    metrics.pool("tasks", futures)
+    assert metrics.gauges == {"tasks_in_flight": 0, "tasks_queued": 0}
+    assert metrics.peaks == {"tasks_in_flight": 1, "tasks_queued": 2}
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from collections import Counter
+import numpy as np
+from src.data.corpus import Corpus
+from src.features.search import term_key
+from src.features.ngrams import CountTable, NgramCounts, Phrases, ngram_keys, build
+
+
+def table(rows):
+    return CountTable.count(np.array(rows, dtype=np.uint64).reshape(len(rows), -1))
+
+
+def as_counter(t):
+    return Counter({tuple(p): c for p, c in zip(t.parts.tolist(), t.counts.tolist())})
+
+
+def test_count():
+    t = table([[1, 2], [2, 3], [1, 2], [3, 1]])
+    assert as_counter(t) == Counter({(1, 2): 2, (2, 3): 1, (3, 1): 1})
+    assert np.all(np.diff(t.keys.astype(np.float64)) > 0)
+
+
+def test_merge_adds_counts_of_shared_ngrams():
+    rng = np.random.RandomState(0)
+    chunks = [rng.randint(1, 20, (200, 2)).tolist() for _ in range(4)]
+    merged = CountTable.merge([table(rows) for rows in chunks] + [CountTable.merge([], 2)], 2)
+    expected = Counter(tuple(r) for rows in chunks for r in rows)
+    assert as_counter(merged) == expected
+    assert merged.counts.dtype == np.int64
+    keys = ngram_keys(np.array([[1, 2], [999, 999]], dtype=np.uint64))
+    assert merged.get(keys).tolist() == [expected[(1, 2)], 0]
+
+
+def test_merge_of_nothing_is_empty():
+    t = CountTable.merge([], 3)
+    assert len(t) == 0 and t.parts.shape == (0, 3)
+    assert t.get(np.array([1], dtype=np.uint64)).tolist() == [0]
+
+
+def test_save_and_load(tmp_path):
+    t = table([[1], [2], [2]])
+    t.save(str(tmp_path / "1980.n1"))
+    loaded = CountTable.load(str(tmp_path / "1980.n1"))
+    assert as_counter(loaded) == as_counter(t)
+
+
+class Counts:
+    '''Stand-in for NgramCounts over fixed unigram, bigram and trigram
+    counts of terms.
+    '''
+    def __init__(self, *orders):
+        self.tables = {}
+        for n, counts in enumerate(orders, 1):
+            parts = np.array([[term_key(t) for t in ngram] for ngram in counts], dtype=np.uint64).reshape(-1, n)
+            keys = ngram_keys(parts)
+            order = np.argsort(keys)
+            self.tables[n] = CountTable(keys[order], parts[order],
+                                        np.array(list(counts.values()), dtype=np.int64)[order])
+        self.terms = sorted(t for (t,) in orders[0])
+
+    def table(self, order, start_year=None, end_year=None, prefixes=None):
+        return self.tables[order]
+
+    def vocabulary(self, start_year=None, end_year=None):
+        keys = np.array([term_key(t) for t in self.terms], dtype=np.uint64)
+        order = np.argsort(keys)
+        return keys[order], np.array(self.terms, dtype=object)[order]
+
+
+def test_phrases_join_collocations_but_not_frequent_neighbours():
+    # A million tokens over a thousand terms
+    unigrams = {("w{}".format(i),): 1000 for i in range(996)}
+    unigrams.update({("fianna",): 50, ("fáil",): 50, ("minister",): 1000, ("say",): 1000})
+    # "minister say" turns up fifty times where chance gives one, but it is
+    # not a phrase; scaled by the token count rather than the vocabulary it
+    # would score 45 and be joined
+    bigrams = {("fianna", "fáil"): 50, ("minister", "say"): 50, ("w1", "w2"): 3}
+    p = Phrases(Counts(unigrams, bigrams, {}))
+    assert set(p.bigrams) == {("fianna", "fáil")}
+    assert p.apply(["the", "minister", "say", "fianna", "fáil"]) == ["the", "minister", "say", "fianna_fáil"]
+
+
+def test_year_ranges_include_the_end_year(tmp_path):
+    corpus = Corpus(str(tmp_path / "tagged"))
+    for year in [1980, 1981, 1982]:
+        corpus.write_year(year, iter(["{}-01-10/1: land/NOUN bill/NOUN\n".format(year)]))
+    assert not build(str(tmp_path / "tagged"), str(tmp_path / "ngrams"), 1)
+    counts = NgramCounts(str(tmp_path / "ngrams"))
+    assert counts.select(1980, 1981) == [1980, 1981]
+    assert int(counts.table(2, 1981, 1982).counts.sum()) == 2
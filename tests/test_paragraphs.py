@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+import numpy as np
+from src.data.get_english_text import Paragraph
+from src.features.stats import ParagraphStats, year_stats_path
+from src.features.paragraphs import LANGUAGES, languages, export, table_path, ParagraphTable
+
+
+def test_language_is_the_one_with_most_tokens():
+    d = {"tokens": np.array([5, 4, 3, 0]), "en": np.array([3, 2, 0, 0]),
+         "ga": np.array([2, 2, 1, 0]), "other": np.array([0, 0, 2, 0])}
+    # Ties go to English
+    assert [LANGUAGES[i] for i in languages(d)] == ["en", "en", "other", "none"]
+
+
+def write_stats(corpus, year, rows):
+    stats = ParagraphStats()
+    for i, (date, speaker, sentences) in enumerate(rows):
+        stats.add(Paragraph("{}/{}".format(date, i), date, speaker, "s1", "Heading", ""), sentences)
+    stats.save(year_stats_path(corpus, year))
+
+
+def test_export_writes_a_table_per_year_and_queries_filter_it(tmp_path):
+    pytest.importorskip("pyarrow")
+    corpus, root = str(tmp_path / "english"), str(tmp_path / "paragraphs")
+    os.makedirs(corpus)
+    write_stats(corpus, 1980, [("1980-01-10", "#Lynch", [("one two", "en")]),
+                               ("1980-01-10", "#Haughey", [("tá sé ann", "ga")])])
+    write_stats(corpus, 1981, [("1981-03-10", "#Lynch", [("three four five", "en"), ("sé", "ga")])])
+    os.makedirs(root)
+    open(table_path(root, 1979), "w").close()
+
+    assert export(corpus, root, 1) == set()
+    assert sorted(os.listdir(root)) == ["1980.parquet", "1981.parquet"]
+    table = ParagraphTable(root)
+    rows = table.read(["uri", "speaker", "language", "tokens"]).to_pylist()
+    assert rows[1] == {"uri": "1980-01-10/1", "speaker": "#Haughey", "language": "ga", "tokens": 3}
+    totals = table.totals("speaker", start_date="1980-01-01", end_date="1980-12-31", language="en").to_pylist()
+    assert [(r["speaker"], r["tokens_sum"]) for r in totals] == [("#Lynch", 2)]
+    assert [r["speaker"] for r in table.totals("speaker").to_pylist()] == ["#Lynch", "#Haughey"]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+import numpy as np
+from src.model.predict_model import NeighbourIndex
+
+WORDS = ["land", "farmer", "tax", "rate", "school"]
+
+
+def save_model(dirpath, name, vectors):
+    '''A word2vec model file with the given vectors in place of trained ones.
+    '''
+    from gensim.models import Word2Vec
+    model = Word2Vec([WORDS], vector_size=2, min_count=1, workers=1, seed=1)
+    for word, v in vectors.items():
+        model.wv.vectors[model.wv.key_to_index[word]] = v
+    model.save(os.path.join(dirpath, name))
+    return model
+
+
+def test_neighbours_match_gensim_and_drift_compares_neighbour_sets(tmp_path):
+    pytest.importorskip("gensim")
+    first = save_model(str(tmp_path), "word2vec-test_1980-1999.w2v",
+                       {"land": [1, 0], "farmer": [1, 0.1], "tax": [0, 1], "rate": [0.1, 1], "school": [-1, 0]})
+    second = save_model(str(tmp_path), "word2vec-test_1990-2009.w2v",
+                        {"land": [0, -1], "farmer": [1, 0.1], "tax": [0, 1], "rate": [0.1, 1], "school": [-1, 0]})
+    index = NeighbourIndex(str(tmp_path))
+    assert [w.label for w in index.windows] == ["1980-1999", "1990-2009"]
+
+    result = index.neighbours(["land", "parliament"], topn=2)
+    assert result["parliament"] == []
+    for (_, nn), model in zip(result["land"], [first, second]):
+        expected = model.wv.most_similar("land", topn=2)
+        assert [n for n, _ in nn] == [n for n, _ in expected]
+        assert np.allclose([s for _, s in nn], [s for _, s in expected], atol=1e-5)
+    # Normalised vectors are cached once per model
+    assert len([fn for fn in os.listdir(index.cache_dirpath) if fn.endswith(".kv")]) == 2
+
+    drift = index.drift(["land", "rate"], topn=1)
+    assert drift["land"] == [("1980-1999", "1990-2009", 1.0)]
+    assert drift["rate"] == [("1980-1999", "1990-2009", 0.0)]
+
+
+def test_models_of_several_corpora_need_a_corpus_name(tmp_path):
+    pytest.importorskip("gensim")
+    vectors = {w: [i, 1] for i, w in enumerate(WORDS)}
+    save_model(str(tmp_path), "word2vec-dail_1980-1999.w2v", vectors)
+    save_model(str(tmp_path), "word2vec-seanad_1980-1999.w2v", vectors)
+    with pytest.raises(ValueError):
+        NeighbourIndex(str(tmp_path))
+    assert [w.corpus for w in NeighbourIndex(str(tmp_path), "seanad").windows] == ["seanad"]
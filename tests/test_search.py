@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from src.data.corpus import Corpus
+from src.features.search import encode_postings, decode_postings, build, SearchIndex
+
+
+def test_postings_round_trip():
+    rng = np.random.RandomState(0)
+    docs = np.sort(rng.randint(0, 500, 2000))
+    positions = np.zeros(len(docs), dtype=np.int64)
+    for d in np.unique(docs):
+        rows = np.flatnonzero(docs == d)
+        positions[rows] = np.sort(rng.choice(1000, len(rows), replace=False))
+    ids, tfs, decoded = decode_postings(encode_postings(docs, positions))
+    assert np.array_equal(np.repeat(ids, tfs), docs)
+    assert np.array_equal(decoded, positions)
+    assert np.array_equal(ids, np.unique(docs))
+
+
+def test_postings_single_occurrence():
+    ids, tfs, positions = decode_postings(encode_postings(np.array([7]), np.array([3])))
+    assert ids.tolist() == [7] and tfs.tolist() == [1] and positions.tolist() == [3]
+
+
+def test_phrase_search(tmp_path):
+    corpus = Corpus(str(tmp_path / "tagged"))
+    corpus.write_year(1980, iter([
+        "1980-01-10/1: land/NOUN bill/NOUN land/NOUN\n",
+        "1980-01-10/2: bill/NOUN land/NOUN bill/NOUN land/NOUN\n",
+        "1980-02-11/1: land/VERB\n",
+    ]))
+    assert not build(str(tmp_path / "tagged"), str(tmp_path / "index"), 1)
+    index = SearchIndex(str(tmp_path / "index"))
+    assert list(index.search("land bill")) == [("1980-01-10/1", 1), ("1980-01-10/2", 1)]
+    assert list(index.search("bill land")) == [("1980-01-10/1", 1), ("1980-01-10/2", 2)]
+    assert index.timeline("land") == [(1980, 3, 5)]
+    assert list(index.search("land/VERB")) == [("1980-02-11/1", 1)]
+    assert list(index.search("land", start_date="1980-02-01")) == [("1980-02-11/1", 1)]
+
+
+def test_empty_and_unknown_queries_match_nothing(tmp_path):
+    corpus = Corpus(str(tmp_path / "tagged"))
+    corpus.write_year(1980, iter(["1980-01-10/1: land/NOUN\n"]))
+    build(str(tmp_path / "tagged"), str(tmp_path / "index"), 1)
+    index = SearchIndex(str(tmp_path / "index"))
+    assert list(index.search("")) == []
+    assert list(index.search("   ")) == []
+    assert index.timeline("unknown words") == []
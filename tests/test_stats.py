@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from src.data.get_english_text import Paragraph
+from src.features.stats import ParagraphStats, StatsStore, write_year_stats, load_columns, year_stats_path
+
+
+def part(path, rows):
+    stats = ParagraphStats()
+    for date, speaker, sentences in rows:
+        stats.add(Paragraph("{}/1".format(date), date, speaker, "s1", "Heading", ""), sentences)
+    stats.save(path)
+    return path
+
+
+def test_year_stats_merge_parts_and_aggregate_by_term_and_speaker(tmp_path):
+    corpus = tmp_path / "english"
+    corpus.mkdir()
+    # Parts arrive out of date order, each with its own speaker codes
+    parts = [
+        part(str(tmp_path / "p1.npz"), [("1981-07-01", "#Haughey", [("one two three", "en"), ("tá sé", "ga")])]),
+        part(str(tmp_path / "p0.npz"), [("1981-03-10", "#FitzGerald", [("four five", "en")]),
+                                        ("1981-03-10", "#Haughey", [("six", "en"), ("?", None)])]),
+    ]
+    write_year_stats(str(corpus), 1981, parts)
+    d = load_columns(year_stats_path(str(corpus), 1981))
+    assert d["date"].astype(str).tolist() == ["1981-03-10", "1981-03-10", "1981-07-01"]
+    assert d["speakers"][d["speaker"]].tolist() == ["#FitzGerald", "#Haughey", "#Haughey"]
+    assert d["tokens"].tolist() == [2, 2, 5]
+    assert d["ga_sentences"].tolist() == [0, 0, 1]
+
+    # A re-extracted date replaces that date's rows only
+    new = part(str(tmp_path / "p2.npz"), [("1981-03-10", "#Lynch", [("seven eight nine ten", "en")])])
+    write_year_stats(str(corpus), 1981, [new], replaced={"1981-03-10"})
+
+    store = StatsStore.build(str(corpus), str(tmp_path / "stats"))
+    assert len(store) == 2
+    assert store.total("en") == 7
+    assert store.total("tokens", "1981-06-01", "1981-12-31") == 5
+    assert [(int(t), int(n)) for t, n in zip(*store.group("term"))] == [(21, 4), (22, 5)]
+    assert store.dail(22, "ga") == 2
+    assert store.top("speaker", n=1) == [("#Haughey", 5)]
+    assert StatsStore.load_or_build(str(corpus), store.root).meta == store.meta
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+from src.features.token_cache import CachedSitting, TokenCache, ALPHA, STOP
+
+
+def sitting():
+    '''Two paragraphs: "The bill passed. Land is" and "land".
+    '''
+    return CachedSitting({
+        "uris": np.array([b"1980-01-10/1", b"1980-01-10/2"]),
+        "paragraphs": np.array([0, 5, 6], dtype=np.uint32),
+        "lemmas": np.array(["be", "bill", "land", "pass", "the"]),
+        "tags": np.array(["AUX", "DET", "NOUN", "VERB"]),
+        "lemma": np.array([4, 1, 3, 2, 0, 2], dtype=np.uint32),
+        "pos": np.array([1, 2, 3, 2, 0, 2], dtype=np.uint8),
+        "flags": np.array([ALPHA | STOP, ALPHA, ALPHA, ALPHA, ALPHA | STOP, ALPHA], dtype=np.uint8),
+        "sentences": np.array([0, 3, 5], dtype=np.uint32),
+        "has_sentences": np.array(True)})
+
+
+def test_lines_and_tokens():
+    s = sitting()
+    assert s.lines("para") == ["1980-01-10/1: bill/NOUN pass/VERB land/NOUN\n", "1980-01-10/2: land/NOUN\n"]
+    assert s.lines("sent", ["NOUN"]) == ["1980-01-10/1: bill/NOUN\n", "1980-01-10/1: land/NOUN\n",
+                                         "1980-01-10/2: land/NOUN\n"]
+    assert s.tokens("sent") == [["bill", "pass"], ["land"], ["land"]]
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "s.npz")
+    sitting().save(path)
+    assert CachedSitting.load(path).lines("sent") == sitting().lines("sent")
+
+
+def test_get_put_and_stale_digests(tmp_path):
+    cache = TokenCache(str(tmp_path), {"model": "test"})
+    assert cache.get("1980-01-10", "aa" * 20) is None
+    cache.put("1980-01-10", "aa" * 20, sitting())
+    assert cache.get("1980-01-10", "aa" * 20).lines("para") == sitting().lines("para")
+    # A changed sitting replaces the old entry for its date
+    cache.put("1980-01-10", "bb" * 20, sitting())
+    assert cache.get("1980-01-10", "aa" * 20) is None
+    assert len(list(cache.entries())) == 1
+    assert (cache.hits, cache.misses) == (1, 2)
+    # Another configuration has its own entries
+    assert TokenCache(str(tmp_path), {"model": "other"}).get("1980-01-10", "bb" * 20) is None
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    probe = str(tmp_path / "probe.npz")
+    sitting().save(probe)
+    size = os.path.getsize(probe)
+    os.remove(probe)
+
+    cache = TokenCache(str(tmp_path / "cache"), {"model": "test"}, max_bytes=int(size * 3.5))
+    dates = ["1980-01-{:02d}".format(d) for d in range(1, 4)]
+    for i, date in enumerate(dates):
+        cache.put(date, "aa" * 20, sitting())
+        os.utime(cache.path(date, "aa" * 20), (1000 + i, 1000 + i))
+    # Reading the oldest entry makes it the most recently used
+    assert cache.get(dates[0], "aa" * 20) is not None
+    cache.put("1980-01-04", "aa" * 20, sitting())
+    assert cache.get(dates[1], "aa" * 20) is None
+    assert all(cache.get(d, "aa" * 20) is not None for d in [dates[0], dates[2], "1980-01-04"])
+    assert cache.size <= 0.9 * cache.max_bytes
+    assert cache.size == sum(n for _, _, n in cache.entries())
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import pytest
+from src.data.corpus import Corpus
+from src.model.encoded_corpus import EncodedCorpus
+from src.model.train_word2vec_model import write_corpus_file, train_window, model_filename
+
+# Each word five times, so it survives the trainers' min_count
+LINES = [
+    "1980-01-10/1: " + "alpha/NOUN beta/NOUN gamma/NOUN " * 5 + "\n",
+    # All Irish or all stopwords: nothing left after filtering
+    "1980-01-10/2: \n",
+    "1980-01-10/3: " + "delta/NOUN epsilon/NOUN alpha/NOUN " * 5 + "\n",
+    "1981-02-11/1: " + "beta/NOUN delta/NOUN " * 5 + "\n",
+]
+
+
+def encoded_corpus(tmp_path):
+    Corpus(str(tmp_path / "tagged")).write_year(1980, iter(LINES[:3]))
+    Corpus(str(tmp_path / "tagged")).write_year(1981, iter(LINES[3:]))
+    return EncodedCorpus.build(str(tmp_path / "tagged"), str(tmp_path / "encoded"))
+
+
+def test_corpus_file_drops_empty_documents_and_keeps_tags_aligned(tmp_path):
+    encoded = encoded_corpus(tmp_path)
+    path = str(tmp_path / "window.txt")
+    tags, n_tokens = write_corpus_file(encoded, 1980, 1982, path)
+    with open(path, encoding="utf-8") as f:
+        written = f.read().split("\n")[:-1]
+    assert written == [" ".join(line.split()[1:]) for line in LINES if line.split()[1:]]
+    assert [t.decode("utf-8") for t in tags] == ["1980-01-10/1", "1980-01-10/3", "1981-02-11/1"]
+    assert n_tokens == 40
+
+
+def test_doc2vec_vectors_line_up_with_tags(tmp_path):
+    pytest.importorskip("gensim")
+    encoded = encoded_corpus(tmp_path)
+    out = tmp_path / "models"
+    out.mkdir()
+    train_window(encoded.root, str(out), "test", 1980, 1982, 1, ("doc2vec",))
+    path = str(out / model_filename("doc2vec", "test", 1980, 1982))
+    from gensim.models import Doc2Vec
+    model = Doc2Vec.load(path)
+    with open(path + ".tags", encoding="utf-8") as f:
+        tags = f.read().split()
+    assert tags == ["1980-01-10/1", "1980-01-10/3", "1981-02-11/1"]
+    assert len(model.dv) == len(tags)